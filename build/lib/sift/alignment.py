@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a class for aligning a stack of images on a reference frame
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer", "Pierre Paleo"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-18"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import logging
+import numpy
+from .plan import SiftPlan
+from .match import MatchPlan
+from .warp import WarpPlan
+logger = logging.getLogger("sift.alignment")
+
+
+def estimate_affine(src, dst, nb_iter=3, cutoff=3.0):
+    """
+    Least-squares estimation of the affine transformation dst = A.src + t,
+    outliers (residual larger than cutoff times the median residual) are rejected iteratively.
+
+    @param src: (n,2) array of (x,y) positions
+    @param dst: (n,2) array of (x,y) positions
+    @return: 3x3 matrix mapping src onto dst, None if less than 3 points
+    """
+    src = numpy.asarray(src, dtype=numpy.float64)
+    dst = numpy.asarray(dst, dtype=numpy.float64)
+    valid = numpy.ones(src.shape[0], dtype=bool)
+    matrix = None
+    for i in range(nb_iter):
+        if valid.sum() < 3:
+            break
+        design = numpy.ones((valid.sum(), 3), dtype=numpy.float64)
+        design[:, :2] = src[valid]
+        sol = numpy.linalg.lstsq(design, dst[valid])[0]
+        matrix = numpy.identity(3)
+        matrix[:2, :] = sol.T
+        residual = numpy.sqrt(((numpy.dot(src, matrix[:2, :2].T) + matrix[:2, 2] - dst) ** 2).sum(axis=-1))
+        threshold = max(cutoff * numpy.median(residual[valid]), 1e-3)
+        new_valid = residual < threshold
+        if (new_valid == valid).all():
+            break
+        valid = new_valid
+    return matrix
+
+
+class StackAlign(object):
+    """
+    Align a stack of images on a fixed reference frame:
+
+    sa = sift.StackAlign(reference)
+    for frame in stack:
+        matrix = sa.align(frame)
+    avg = sa.average()  # only if accumulate=True
+
+    The keypoints and descriptors of the reference are calculated once and kept resident
+    on the device: each new frame costs one keypoint extraction and one matching.
+
+    When a frame does not overlap enough with the reference (less than min_match matching pairs),
+    it is matched against the previous frame instead and the transformations are chained:
+    the previous frame becomes the new anchor for the following frames.
+
+    The returned matrices (3x3) map the reference coordinates (x:col, y:row) onto the frame coordinates,
+    as expected by WarpPlan to resample the frame on the reference grid.
+    """
+    def __init__(self, reference, devicetype="GPU", device=None, profile=False, min_match=10,
+                 accumulate=False, interpolation="bilinear", max_workgroup_size=None, ctx=None):
+        """
+        Contructor of the class
+
+        @param reference: reference image, all frames are aligned on it
+        @param min_match: minimum number of matching keypoints to trust a transformation
+        @param accumulate: warp all aligned frames on the device and sum them up
+        @param interpolation: "bilinear" or "bicubic", for the accumulation
+        @param ctx: re-use an existing OpenCL context (i.e. the one of an upstream processing)
+        """
+        kwargs = {"template": reference, "devicetype": devicetype, "device": device, "profile": profile, "ctx": ctx}
+        if max_workgroup_size:
+            kwargs["max_workgroup_size"] = max_workgroup_size
+        self.sift = SiftPlan(**kwargs)
+        self.match = MatchPlan(ctx=self.sift.ctx, profile=profile)
+        self.min_match = int(min_match)
+        self.warp = None
+        if accumulate:
+            self.warp = WarpPlan(plan=self.sift, interpolation=interpolation)
+        self.ref_kp = self.sift.keypoints(reference)
+        self.match.set_reference(self.ref_kp)
+        self.anchor_kp = self.ref_kp
+        self.anchor_matrix = numpy.identity(3)  # reference -> anchor
+        self.last_kp = self.ref_kp
+        self.last_matrix = numpy.identity(3)  # reference -> last frame
+        self.nb_frames = 0
+        self.nb_anchors = 1
+        if self.warp is not None:
+            self.warp.accumulate(reference.astype(numpy.float32), self.anchor_matrix)
+
+    def _transformation(self, matching):
+        """
+        @param matching: (n,2) record array of matching keypoints (frame, anchor)
+        @return: 3x3 matrix mapping the anchor coordinates onto the frame coordinates
+        """
+        if matching.shape[0] < self.min_match:
+            return None
+        src = numpy.vstack((matching[:, 1].x, matching[:, 1].y)).T
+        dst = numpy.vstack((matching[:, 0].x, matching[:, 0].y)).T
+        return estimate_affine(src, dst)
+
+    def align(self, frame):
+        """
+        Calculate the transformation between the reference and a frame
+
+        @param frame: image with the same shape and dtype as the reference
+        @return: 3x3 matrix mapping reference coordinates onto frame coordinates, None if alignment failed
+        """
+        kp = self.sift.keypoints(frame)
+        matrix = self._transformation(self.match.match(kp))
+        if matrix is not None:
+            matrix = numpy.dot(matrix, self.anchor_matrix)
+        else:
+            logger.info("Frame %s drifted away from the anchor, chaining on the previous frame" % self.nb_frames)
+            matrix = self._transformation(self.match.match(kp, self.last_kp))
+            if matrix is None:
+                logger.warning("Unable to align frame %s" % self.nb_frames)
+                self.match.set_reference(self.anchor_kp)
+                self.nb_frames += 1
+                return None
+            # the previous frame is now the anchor, its descriptors are resident on the device
+            matrix = numpy.dot(matrix, self.last_matrix)
+            self.anchor_kp = self.last_kp
+            self.anchor_matrix = self.last_matrix
+            self.nb_anchors += 1
+        self.last_kp = kp
+        self.last_matrix = matrix
+        self.nb_frames += 1
+        if self.warp is not None:
+            self.warp.accumulate(frame.astype(numpy.float32), matrix)
+        return matrix
+
+    def average(self):
+        """
+        @return: the average of all aligned frames (reference included), on the reference grid
+        """
+        if self.warp is None:
+            raise RuntimeError("StackAlign was created without accumulate=True")
+        return self.warp.average()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains an on-disk cache of keypoints, keyed by the content of the images and the parameters,
+evicting the least recently used entries
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-27"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, hashlib, threading, time
+import numpy
+from .param import par
+from .keyfile import KeypointWriter, KeypointFile
+logger = logging.getLogger("sift.cache")
+
+
+def hash_parameters(*args):
+    """
+    @return: hexadecimal digest of the SIFT parameters (par) and any other object describing the calculation
+    """
+    md5 = hashlib.md5()
+    md5.update(repr(sorted(par.items())).encode("ascii"))
+    for arg in args:
+        md5.update(repr(arg).encode("utf-8"))
+    return md5.hexdigest()
+
+
+def hash_image(image):
+    """
+    @return: hexadecimal digest of the content, the shape and the dtype of an image
+    """
+    image = numpy.ascontiguousarray(image)
+    md5 = hashlib.md5()
+    md5.update(("%s %s" % (image.shape, image.dtype.str)).encode("ascii"))
+    md5.update(image.view(numpy.uint8).ravel().data)
+    return md5.hexdigest()
+
+
+class KeypointCache(object):
+    """
+    Cache of keypoints on disk, one .sift file per entry:
+
+    cache = sift.KeypointCache("/tmp/sift_cache", max_size=2**30)
+    siftp = sift.SiftPlan(template=img, cache=cache)
+    kp = siftp.keypoints(img)  # calculated and stored
+    kp = siftp.keypoints(img)  # read back, without touching the device
+
+    Entries are keyed on the content of the image and on a digest of the parameters (par, kernel sources, ...):
+
+    key = cache.key(img, hash_parameters(...))  # the image is hashed once
+    kp = cache.get(key)
+    if kp is None:
+        kp = ...
+        cache.put(key, kp)
+
+    When the total size exceeds max_size, the least recently used entries are removed.
+    """
+    def __init__(self, directory, max_size=2 ** 30):
+        """
+        Contructor of the class
+
+        @param directory: where the entries are stored
+        @param max_size: maximum size of the cache in bytes
+        """
+        self.directory = directory
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.entries = {}  # filename: [last access, size]
+        for name in os.listdir(directory):
+            filename = os.path.join(directory, name)
+            if name.endswith(".sift"):
+                stat = os.stat(filename)
+                self.entries[filename] = [stat.st_mtime, stat.st_size]
+        self.size = sum(i[1] for i in self.entries.values())
+
+    def key(self, image, digest):
+        """
+        @param image: numpy array
+        @param digest: digest of the parameters of the calculation (see hash_parameters)
+        @return: key of the entry, i.e. its filename
+        """
+        return os.path.join(self.directory, "%s_%s.sift" % (hash_image(image), digest))
+
+    def get(self, key):
+        """
+        @param key: key of the entry (see key)
+        @return: record array of keypoints, None if not in the cache
+        """
+        with self._lock:
+            kp = None
+            if key in self.entries:
+                try:
+                    kp = numpy.array(KeypointFile(key)[0]).view(numpy.recarray)
+                except (IOError, OSError, ValueError, IndexError) as error:
+                    # i.e. removed by another process sharing the directory
+                    logger.warning("Unable to read %s: %s" % (key, error))
+                    self.size -= self.entries.pop(key)[1]
+            if kp is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            try:
+                os.utime(key, None)
+            except OSError:
+                pass
+            self.entries[key][0] = time.time()
+        return kp
+
+    def put(self, key, kp):
+        """
+        Store the keypoints of an entry, evicting the oldest entries if needed
+
+        @param key: key of the entry (see key)
+        @param kp: record array of keypoints
+        """
+        tmp = "%s.%s.part" % (key, threading.current_thread().ident)
+        with KeypointWriter(tmp) as writer:
+            writer.write(kp)
+        os.rename(tmp, key)
+        with self._lock:
+            if key in self.entries:
+                self.size -= self.entries[key][1]
+            stat = os.stat(key)
+            self.entries[key] = [stat.st_mtime, stat.st_size]
+            self.size += stat.st_size
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_size
+        """
+        if self.size <= self.max_size:
+            return
+        for filename in sorted(self.entries, key=lambda name: self.entries[name][0]):
+            if self.size <= self.max_size:
+                break
+            try:
+                os.unlink(filename)
+            except OSError as error:
+                logger.warning("Unable to remove %s: %s" % (filename, error))
+            self.size -= self.entries.pop(filename)[1]
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            for filename in list(self.entries):
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+            self.entries = {}
+            self.size = 0
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains the client of the keypoint server (SiftServer): it only needs numpy,
+neither pyopencl nor any OpenCL device
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, tempfile, socket, struct, json, mmap
+import numpy
+from .utils import dtype_kp
+logger = logging.getLogger("sift.client")
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+HEADER = struct.Struct("<ii")  # status, number of keypoints
+
+
+def recv_exactly(sock, size):
+    """
+    Read exactly size bytes from a socket
+    """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise IOError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class SiftClient(object):
+    """
+    Client of the SiftServer, costs neither kernel compilation nor device memory
+    and works without pyopencl:
+
+    client = sift.SiftClient("/tmp/sift.sock")
+    kp = client.keypoints(img)
+
+    The image is written once in a shared memory file re-used for all requests.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        fd, self.shm_name = tempfile.mkstemp(prefix="sift_", dir=SHM_DIR)
+        self.shm = os.fdopen(fd, "r+b")
+        self.shm_size = 0
+        self.mmap = None
+
+    def _reserve(self, size):
+        """
+        Grow the shared memory file if needed
+        """
+        if size > self.shm_size:
+            if self.mmap is not None:
+                self.mmap.close()
+            self.shm.truncate(size)
+            self.mmap = mmap.mmap(self.shm.fileno(), size)
+            self.shm_size = size
+
+    def keypoints(self, image):
+        """
+        @param image: numpy array (2D, or 3D if RGB)
+        @return: record array of keypoints
+        """
+        image = numpy.ascontiguousarray(image)
+        self._reserve(image.nbytes)
+        numpy.frombuffer(self.mmap, dtype=numpy.uint8, count=image.nbytes)[:] = image.view(numpy.uint8).ravel()
+        request = {"shm": self.shm_name, "shape": image.shape, "dtype": image.dtype.str}
+        self.sock.sendall((json.dumps(request) + "\n").encode("ascii"))
+        status, size = HEADER.unpack(recv_exactly(self.sock, HEADER.size))
+        if status:
+            raise RuntimeError("Server error: %s" % recv_exactly(self.sock, size).decode("utf-8"))
+        data = recv_exactly(self.sock, size * dtype_kp.itemsize)
+        return numpy.frombuffer(data, dtype=dtype_kp).view(numpy.recarray)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+            os.unlink(self.shm_name)
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains the reader and writer of the binary keypoint container (.sift files),
+and the conversion from and to the text format (.key) of D. Lowe
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-26"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, struct
+import numpy
+from .utils import dtype_kp
+try:
+    from .keypoints import DeviceKeypoints
+except ImportError:  # without pyopencl, keypoints can only be record arrays
+    DeviceKeypoints = ()
+logger = logging.getLogger("sift.keyfile")
+
+################################################################################
+# Layout of a .sift file (little endian):
+# HEADER_SIZE bytes: magic, version, record size, number of frames, offset of the index
+# records: keypoints of all frames, one after the other (dtype_kp: x, y, scale, angle as float32 and 128 uint8)
+# index: for each frame the position (in records) and the number of its keypoints, -1 for a failed frame
+# The header is only written when the file is closed. Meanwhile the index is journaled, frame by frame,
+# in filename.idx so that an interrupted file can be resumed after its last frame on disk.
+################################################################################
+MAGIC = b"SIFTKP\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+HEADER_SIZE = 64
+dtype_index = numpy.dtype([("offset", "<u8"), ("size", "<i8")])
+
+
+class KeypointWriter(object):
+    """
+    Streaming writer of a .sift file, frames are appended one after the other:
+
+    with KeypointWriter("stack.sift") as writer:
+        for img in stack:
+            writer.write(siftp.keypoints(img))
+
+    The index is written when the file is closed.
+    """
+    def __init__(self, filename, keep=0):
+        """
+        Contructor of the class
+
+        @param filename: name of the file, overwritten
+        @param keep: number of frames of an existing (closed or interrupted) file to keep, the next ones being appended
+        """
+        self.filename = filename
+        self.journal_name = filename + ".idx"
+        if keep:
+            index = recover_index(filename)
+            if len(index) < keep:
+                raise RuntimeError("Only %s frames of %s can be kept, not %s" % (len(index), filename, keep))
+            self.index = [(int(offset), int(size)) for offset, size in index[:keep]]
+            self.nb_records = sum(size for offset, size in self.index)
+            self.file = open(filename, "r+b")
+            self.file.truncate(HEADER_SIZE + self.nb_records * dtype_kp.itemsize)
+            self.file.write(b"\x00" * HEADER_SIZE)  # not complete until closed again
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.index = []
+            self.nb_records = 0
+            self.file = open(filename, "wb")
+            self.file.write(b"\x00" * HEADER_SIZE)
+        self.journal = open(self.journal_name, "wb")
+        self.journal.write(numpy.array(self.index, dtype=dtype_index).data)
+        self.journal.flush()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, kp):
+        """
+        Append the keypoints of a frame
+
+        @param kp: record array of keypoints (or DeviceKeypoints), None for a frame which could not be processed
+        """
+        if kp is None:
+            entry = (self.nb_records, -1)
+        else:
+            if isinstance(kp, DeviceKeypoints):
+                kp = kp.get()
+            kp = numpy.ascontiguousarray(kp, dtype=dtype_kp)
+            self.file.write(kp.data)
+            self.file.flush()
+            entry = (self.nb_records, kp.shape[0])
+            self.nb_records += kp.shape[0]
+        self.index.append(entry)
+        self.journal.write(numpy.array([entry], dtype=dtype_index).data)
+        self.journal.flush()
+
+    def failed(self):
+        """
+        @return: list of the frames which could not be processed
+        """
+        return [frame for frame, (offset, size) in enumerate(self.index) if size < 0]
+
+    def abort(self):
+        """
+        Close the file without writing the index: it remains incomplete and can be resumed (see keep)
+        """
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.journal.close()
+
+    def close(self):
+        """
+        Write the index and the header
+        """
+        if self.file is None:
+            return
+        index_offset = HEADER_SIZE + self.nb_records * dtype_kp.itemsize
+        index = numpy.array(self.index, dtype=dtype_index)
+        self.file.write(index.data)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, dtype_kp.itemsize, len(self.index), index_offset))
+        self.file.close()
+        self.file = None
+        self.journal.close()
+        os.unlink(self.journal_name)
+
+
+class KeypointFile(object):
+    """
+    Memory-mapped reader of a .sift file, any frame is accessed without reading the rest of the file:
+
+    kf = KeypointFile("stack.sift")
+    len(kf)       # number of frames
+    kp = kf[10]   # record array with the keypoints of frame 10
+
+    Failed frames have no keypoints and a size of -1 in sizes().
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise IOError("File %s is too short to be a keypoint file" % filename)
+        magic, version, record_size, nframes, index_offset = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise IOError("File %s is not a keypoint file" % filename)
+        if version > VERSION:
+            raise IOError("File %s has version %s, only up to %s is supported" % (filename, version, VERSION))
+        if record_size != dtype_kp.itemsize:
+            raise IOError("File %s has records of %s bytes, expected %s" % (filename, record_size, dtype_kp.itemsize))
+        self.version = version
+        nb_records = (index_offset - HEADER_SIZE) // record_size
+        if nb_records:
+            self.records = numpy.memmap(filename, dtype=dtype_kp, mode="r", offset=HEADER_SIZE, shape=(nb_records,))
+        else:
+            self.records = numpy.zeros(0, dtype=dtype_kp)
+        if nframes:
+            self.index = numpy.memmap(filename, dtype=dtype_index, mode="r", offset=index_offset, shape=(nframes,))
+        else:
+            self.index = numpy.zeros(0, dtype=dtype_index)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def __getitem__(self, frame):
+        """
+        @return: record array of the keypoints of a frame (read-only view on the file)
+        """
+        offset, size = int(self.index[frame]["offset"]), max(0, int(self.index[frame]["size"]))
+        return self.records[offset:offset + size].view(numpy.recarray)
+
+    def __iter__(self):
+        for frame in range(len(self)):
+            yield self[frame]
+
+    def sizes(self):
+        """
+        @return: number of keypoints of each frame, -1 for failed frames
+        """
+        return numpy.array(self.index["size"])
+
+    def failed(self):
+        """
+        @return: list of the frames which could not be processed
+        """
+        return [int(i) for i in numpy.where(self.index["size"] < 0)[0]]
+
+
+def is_closed(filename):
+    """
+    @return: True if filename is a keypoint file properly closed (i.e. not interrupted)
+    """
+    try:
+        with open(filename, "rb") as f:
+            header = f.read(HEADER.size)
+        return len(header) == HEADER.size and HEADER.unpack(header)[0] == MAGIC
+    except IOError:
+        return False
+
+
+def is_complete(filename):
+    """
+    @return: True if filename is a keypoint file properly closed, without any failed frame
+    """
+    if not is_closed(filename):
+        return False
+    try:
+        return not KeypointFile(filename).failed()
+    except (IOError, ValueError):
+        return False
+
+
+def recover_index(filename):
+    """
+    Index of the frames of an existing file which can be kept when resuming it: the frames before the first
+    failed one, whose keypoints are entirely on disk. The index of an interrupted file is read from its journal.
+
+    @return: array of dtype_index, empty if nothing can be recovered
+    """
+    empty = numpy.zeros(0, dtype=dtype_index)
+    try:
+        if is_closed(filename):
+            index = numpy.array(KeypointFile(filename).index)
+        else:
+            with open(filename + ".idx", "rb") as f:
+                journal = f.read()
+            index = numpy.frombuffer(journal[:len(journal) - len(journal) % dtype_index.itemsize], dtype=dtype_index)
+        data_size = os.path.getsize(filename) - HEADER_SIZE
+    except (IOError, OSError, ValueError):
+        return empty
+    expected = 0
+    for frame, (offset, size) in enumerate(index):
+        if size < 0 or offset != expected or (offset + size) * dtype_kp.itemsize > data_size:
+            return index[:frame].copy()
+        expected += size
+    return index.copy()
+
+
+def read_key(filename):
+    """
+    Read a .key text file as written by the SIFT demo program of D. Lowe:
+    first line "N 128", then for each keypoint: row col scale orientation followed by 128 integers
+
+    @return: record array of keypoints
+    """
+    with open(filename) as f:
+        values = f.read().split()
+    nb, length = int(values[0]), int(values[1])
+    if length != 128:
+        raise IOError("Descriptors of length %s are not supported" % length)
+    data = numpy.array(values[2:2 + nb * (4 + length)], dtype=numpy.float64).reshape(nb, 4 + length)
+    kp = numpy.recarray(shape=(nb,), dtype=dtype_kp)
+    kp.y = data[:, 0]
+    kp.x = data[:, 1]
+    kp.scale = data[:, 2]
+    kp.angle = data[:, 3]
+    kp.desc = data[:, 4:]
+    return kp
+
+
+def write_key(filename, kp):
+    """
+    Write keypoints in the .key text format of D. Lowe (20 values of the descriptor per line)
+
+    @param kp: record array of keypoints
+    """
+    with open(filename, "w") as f:
+        f.write("%i 128\n" % kp.shape[0])
+        for k in kp:
+            f.write("%.2f %.2f %.2f %.3f\n" % (k["y"], k["x"], k["scale"], k["angle"]))
+            desc = k["desc"]
+            for start in range(0, 128, 20):
+                f.write(" " + " ".join(str(i) for i in desc[start:start + 20]) + "\n")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains the container for keypoints and descriptors kept on the device
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-19"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import numpy
+import pyopencl, pyopencl.array
+from .utils import dtype_kp
+
+
+def to_records(keypoints, descriptors):
+    """
+    Assemble keypoints and descriptors in a record array
+
+    @param keypoints: (n,4) array of float32: x, y, scale, angle
+    @param descriptors: (n,128) array of uint8
+    @return: record array with dtype_kp
+    """
+    size = keypoints.shape[0]
+    output = numpy.recarray(shape=(size,), dtype=dtype_kp)
+    if size:
+        output.x = keypoints[:, 0]
+        output.y = keypoints[:, 1]
+        output.scale = keypoints[:, 2]
+        output.angle = keypoints[:, 3]
+        output.desc = descriptors
+    return output
+
+
+class DeviceKeypoints(object):
+    """
+    Keypoints and descriptors of all octaves, kept contiguous on the device:
+
+    dkp = siftp.keypoints(img, device=True)
+    dkp.keypoints    # pyopencl array (n,4) of float32: x, y, scale, angle
+    dkp.descriptors  # pyopencl array (n,128) of uint8
+    dkp.count        # pyopencl array (1,) of int32 with n
+    kp = dkp.get()   # record array on the host, only transferred on first access
+
+    The arrays are views on the buffers of the plan: they are overwritten by the next call
+    to keypoints unless copy() is called.
+    """
+    def __init__(self, queue, keypoints, descriptors, count, size, host_keypoints=None, host_descriptors=None):
+        """
+        @param queue: OpenCL queue
+        @param keypoints: pyopencl array with at least size keypoints (float4)
+        @param descriptors: pyopencl array with at least size descriptors (128 uint8)
+        @param count: pyopencl array (1,) of int32 holding the number of keypoints
+        @param size: number of keypoints
+        @param host_keypoints: optional page-locked host array used as destination of the transfer
+        @param host_descriptors: optional page-locked host array used as destination of the transfer
+        """
+        self.queue = queue
+        self.size = int(size)
+        self.keypoints = keypoints[:self.size]
+        self.descriptors = descriptors[:self.size]
+        self.count = count
+        self.host_keypoints = host_keypoints
+        self.host_descriptors = host_descriptors
+        self._host = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def shape(self):
+        return (self.size,)
+
+    def get(self):
+        """
+        @return: record array with the keypoints (x, y, scale, angle, desc), transferred once
+        """
+        if self._host is None:
+            if self.size and (self.host_keypoints is not None) and (self.host_descriptors is not None):
+                keypoints = self.keypoints.get(self.queue, ary=self.host_keypoints[:self.size])
+                descriptors = self.descriptors.get(self.queue, ary=self.host_descriptors[:self.size])
+                self._host = to_records(keypoints, descriptors)
+            elif self.size:
+                self._host = to_records(self.keypoints.get(self.queue), self.descriptors.get(self.queue))
+            else:
+                self._host = numpy.recarray(shape=(0,), dtype=dtype_kp)
+        return self._host
+
+    def __getattr__(self, name):
+        """
+        Fields of the record array (x, y, scale, angle, desc) trigger the transfer to the host
+        """
+        if name in dtype_kp.names:
+            return self.get()[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def copy(self):
+        """
+        @return: DeviceKeypoints with its own buffers on the device, safe from the next extraction.
+                 The page-locked staging of the plan is not shared: it is the destination of the transfers
+                 of the next extractions, the copy is transferred into its own arrays
+        """
+        keypoints = self.keypoints.copy(self.queue)
+        descriptors = self.descriptors.copy(self.queue)
+        count = self.count.copy(self.queue)
+        new = self.__class__(self.queue, keypoints, descriptors, count, self.size)
+        new._host = self._host
+        return new
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a front-end for the live processing of frames arriving faster than they can be analysed
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-20"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import logging, threading, time
+import collections
+import numpy
+logger = logging.getLogger("sift.live")
+
+
+class LiveSift(object):
+    """
+    Process frames pushed by an acquisition thread without ever stalling it for long:
+
+    live = sift.LiveSift(siftp, depth=4, policy="latest", callback=display)
+    live.start()
+    while acquiring:
+        live.push(camera.read())
+    live.stop()
+    print(live.statistics())
+
+    Frames are copied into a fixed ring of input slots (the page-locked input buffers of the plan)
+    and processed in order by a worker thread. When all slots are busy, the policy decides:
+
+    "block": the acquisition waits for a free slot (back-pressure, no frame lost)
+    "drop_oldest": the oldest frame not yet processed is dropped
+    "latest": only the most recent frame is kept, all pending ones are dropped
+
+    Results are passed to the callback (index, keypoints) from the worker thread, the last one
+    being also available as last_result: the memory used is bounded whatever the frame rate.
+    """
+    policies = ("block", "drop_oldest", "latest")
+
+    def __init__(self, plan, depth=4, policy="block", callback=None, history=1000):
+        """
+        Contructor of the class
+
+        @param plan: SiftPlan used for the calculation
+        @param depth: number of input slots in the ring (at least 2)
+        @param policy: "block", "drop_oldest" or "latest"
+        @param callback: function called with (index, keypoints) for every processed frame,
+                         its errors are logged and counted in nb_errors
+        @param history: number of latencies kept for the statistics
+        """
+        if policy not in self.policies:
+            raise RuntimeError("Unknown policy %s, valid are %s" % (policy, self.policies))
+        self.plan = plan
+        self.policy = policy
+        self.callback = callback
+        self.depth = max(2, int(depth))
+        self.slots = [plan.input_buffer(slot) for slot in range(self.depth)]
+        self.latencies = collections.deque(maxlen=int(history))
+        self.last_result = None
+        self.nb_received = 0
+        self.nb_processed = 0
+        self.nb_dropped = 0
+        self.nb_errors = 0
+        self._free = collections.deque(self.slots)
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        Start the worker thread
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._work, name="LiveSift")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, flush=True):
+        """
+        Stop the worker thread
+
+        @param flush: process the pending frames before stopping, otherwise they are dropped
+        """
+        with self._cond:
+            self._running = False
+            if not flush:
+                self._drop(len(self._pending))
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _drop(self, number):
+        """
+        Drop the oldest pending frames, to be called with the lock held
+        """
+        for i in range(number):
+            slot, index, t0 = self._pending.popleft()
+            self._free.append(slot)
+            self.nb_dropped += 1
+
+    def push(self, frame, index=None):
+        """
+        Submit a new frame for processing
+
+        @param frame: image with the shape and dtype of the plan
+        @param index: identifier of the frame, by default the number of frames received
+        @return: True if the frame was queued (it may still be dropped later by a newer one)
+        """
+        t0 = time.time()
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("LiveSift is not started")
+            if index is None:
+                index = self.nb_received
+            self.nb_received += 1
+            if self.policy == "latest":
+                self._drop(len(self._pending))
+            while not self._free:
+                if self.policy != "block" and self._pending:
+                    self._drop(1)
+                else:
+                    self._cond.wait()
+                    if not self._running:
+                        self.nb_dropped += 1
+                        return False
+            slot = self._free.popleft()
+        # The slot belongs to the acquisition thread until queued
+        slot[...] = frame
+        with self._cond:
+            self._pending.append((slot, index, t0))
+            self._cond.notify_all()
+        return True
+
+    def _work(self):
+        """
+        Worker thread: process the pending frames in order
+        """
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    break
+                slot, index, t0 = self._pending.popleft()
+            try:
+                kp = self.plan.keypoints(slot)
+            except Exception as error:
+                logger.error("Error while processing frame %s: %s" % (index, error))
+                kp = None
+            with self._cond:
+                self._free.append(slot)
+                if kp is None:
+                    self.nb_errors += 1
+                else:
+                    self.nb_processed += 1
+                    self.latencies.append(time.time() - t0)
+                    self.last_result = (index, kp)
+                self._cond.notify_all()
+            if kp is not None and self.callback is not None:
+                try:
+                    self.callback(index, kp)
+                except Exception as error:
+                    logger.error("Error in the callback of frame %s: %s" % (index, error))
+                    with self._cond:
+                        self.nb_errors += 1
+
+    def statistics(self):
+        """
+        @return: dict with the frame counters and the latency percentiles (in ms) from submission to result
+        """
+        with self._cond:
+            latencies = numpy.array(self.latencies) * 1000.0
+            stats = {"received": self.nb_received,
+                     "processed": self.nb_processed,
+                     "dropped": self.nb_dropped,
+                     "errors": self.nb_errors,
+                     "pending": len(self._pending)}
+        for percentile in (50, 90, 99):
+            stats["latency_%s" % percentile] = numpy.percentile(latencies, percentile) if latencies.size else None
+        return stats
@@ -0,0 +1,111 @@
+/*
+ *   Project: SIFT: An algorithm for image alignement
+ *            Kernel for keypoints matching
+ *
+ *
+ *   Copyright (C) 2013 European Synchrotron Radiation Facility
+ *                           Grenoble, France
+ *   All rights reserved.
+ *
+ *   Principal authors: J. Kieffer (kieffer@esrf.fr)
+ *   Last revision: 18/06/2013
+ *
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ * 1. Redistributions of source code must retain the above copyright
+ *    notice, this list of conditions and the following disclaimer.
+ * 2. Redistributions in binary form must reproduce the above copyright
+ *    notice, this list of conditions and the following disclaimer in the
+ *    documentation and/or other materials provided with the distribution.
+ * 3. Neither the name of the University nor the names of its contributors
+ *    may be used to endorse or promote products derived from this software
+ *    without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE AUTORS AND CONTRIBUTORS ``AS IS'' AND
+ * ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ * IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ * ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+ * FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+ * DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+ * OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+ * HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+ * LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+ * OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+ * SUCH DAMAGE.
+ *
+ */
+
+#define DESC_SIZE 128
+
+/**
+ * \brief L1 distance between two descriptors (128 unsigned char each)
+ *
+ * @param desc1: Pointer to global memory with the first descriptor
+ * @param desc2: Pointer to global memory with the second descriptor
+ */
+unsigned int
+l1_distance(__global unsigned char *desc1,
+			__global unsigned char *desc2)
+{
+	unsigned int dist = 0;
+	for (int j=0; j<DESC_SIZE; j++)
+		dist += abs_diff(desc1[j], desc2[j]);
+	return dist;
+}
+
+
+/**
+ * \brief Brute-force matching of two sets of descriptors with Lowe's ratio test.
+ *
+ * Each work-item takes one descriptor of the first set and looks for its two nearest
+ * neighbours (L1 distance) in the second set.
+ * The pair is kept if the nearest is significantly closer than the second nearest.
+ *
+ * @param desc1: Pointer to global memory with the descriptors of the first set (size1 x 128)
+ * @param desc2: Pointer to global memory with the descriptors of the second set (size2 x 128)
+ * @param matchings: Pointer to global memory with the output pairs of indices (index in set1, index in set2)
+ * @param counter: Pointer to global memory with the number of matches found -- shared between threads
+ * @param max_nb_match: size of the matchings array
+ * @param ratio_th: the nearest distance has to be below ratio_th times the second nearest (par.MatchRatio)
+ * @param size1: number of descriptors in the first set
+ * @param size2: number of descriptors in the second set
+ *
+ * Nota: this is a 1D kernel
+ */
+__kernel void
+matching(	__global unsigned char *desc1,
+			__global unsigned char *desc2,
+			__global int2 *matchings,
+			__global int *counter,
+			int max_nb_match,
+			float ratio_th,
+			int size1,
+			int size2)
+{
+	int gid0 = get_global_id(0);
+	if ((gid0 < size1) && (size2 > 1))
+	{
+		unsigned int dist, dist1 = UINT_MAX, dist2 = UINT_MAX;
+		int current_min = 0;
+		for (int i=0; i<size2; i++)
+		{
+			dist = l1_distance(desc1 + DESC_SIZE * gid0, desc2 + DESC_SIZE * i);
+			if (dist < dist1)
+			{
+				dist2 = dist1;
+				dist1 = dist;
+				current_min = i;
+			}
+			else if (dist < dist2)
+				dist2 = dist;
+		}
+		if ((dist2 != 0) && ((float) dist1 < ratio_th * (float) dist2))
+		{
+			int old = atomic_inc(counter);
+			if (old < max_nb_match)
+				matchings[old] = (int2)(gid0, current_min);
+		}
+	}
+}
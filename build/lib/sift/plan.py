@@ -0,0 +1,1377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a class for creating a plan, allocating arrays, compiling kernels and other things like that
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-12"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import time, math, os, logging, sys, hashlib, threading
+import gc
+import numpy
+import pyopencl, pyopencl.array
+from .param import par
+from .opencl import ocl
+from .utils import calc_size, kernel_size, sizeof
+from .keypoints import DeviceKeypoints, dtype_kp
+from .stack import prefetch
+from .worker import Worker
+from .cache import hash_parameters, hash_image
+logger = logging.getLogger("sift.plan")
+from pyopencl import mem_flags as MF
+
+class SiftPlan(object):
+    """
+    How to calculate a set of SIFT keypoint on an image:
+
+    siftp = sift.SiftPlan(img.shape,img.dtype,devicetype="GPU")
+    kp = siftp.keypoints(img)
+
+    kp is a record array of n keypoints, each of them composed of x, y, scale and angle (float32) as well as
+    128 uint8 describing the keypoint: kp.x, kp.y, kp.scale, kp.angle and kp.desc
+
+    """
+    kernels = ["convolution", "preprocess", "algebra", "image", "sort"]
+    converter = {numpy.dtype(numpy.uint8):"u8_to_float",
+                 numpy.dtype(numpy.int8):"s8_to_float",
+                 numpy.dtype(numpy.uint16):"u16_to_float",
+                 numpy.dtype(numpy.int16):"s16_to_float",
+                 numpy.dtype(numpy.uint32):"u32_to_float",
+                 numpy.dtype(numpy.int32):"s32_to_float",
+                 numpy.dtype(numpy.int64):"s64_to_float",
+                 numpy.dtype(numpy.float64):"double_to_float",  # only the *_minmax kernels, on devices with cl_khr_fp64
+                      }
+    color_converter = {numpy.dtype(numpy.uint8):"rgb_to_float",
+                       numpy.dtype(numpy.uint16):"rgb16_to_float",
+                       }
+    layouts = ("interleaved", "planar", "packed12")
+    sigmaRatio = 2.0 ** (1.0 / par.Scales)
+    PIX_PER_KP = 10  # pre_allocate buffers for keypoints
+    histogram_bins = 4096  # for the percentile normalization
+    dtype_kp = dtype_kp
+
+    def __init__(self, shape=None, dtype=None, devicetype="GPU", template=None, profile=False, device=None, PIX_PER_KP=None, max_workgroup_size=sys.maxint,
+                 ctx=None, queue=None, pinned=True, plan=None, cache=None, layout=None, binning=None, roi=None, mask=None,
+                 dark=None, flat=None, hot_pixels=None, percentiles=None, output_size=None):
+        """
+        Contructor of the class
+
+        @param ctx: re-use an existing OpenCL context (i.e. the one of an upstream processing)
+        @param queue: re-use an existing command queue (implies its context)
+        @param pinned: use page-locked staging buffers for the transfers (or zero-copy on devices sharing the host memory)
+        @param plan: SiftPlan whose context, compiled kernels and gaussian kernels are shared (read-only):
+                     only the queue and the working buffers are specific to this plan
+        @param cache: KeypointCache where the results are looked up before any calculation
+        @param layout: layout of the input images, converted on the device:
+                       None or "interleaved": 2D image or 3D color image (height, width, 3 or 4 for RGBA),
+                       "planar": color image (3 or 4, height, width),
+                       "packed12": 12-bit pixels packed in bytes (as Mono12p), shape being the one of the image
+        @param binning: int or (bin_h, bin_w): the image is binned on the device after conversion and the pyramid
+                        built from the binned image, keypoints being reported in pixels of the input image
+        @param roi: (row, col, height, width): only this region of interest is transferred (by rectangular copies)
+                    and processed, keypoints being reported in pixels of the input image
+        @param mask: static mask with the shape of the image, non zero for the pixels to discard (gaps, beam stop ...):
+                     masked pixels are excluded from the normalization and from the initial blur (normalized
+                     convolution) and no keypoint is refined nor described close to them. The mask is tested
+                     at the pixel where the extremum is detected, before interpolation, in the valid map of the
+                     octave (pixels whose blurred neighbourhood holds no masked pixel, eroded at each octave)
+        @param dark: dark current image (shape of the image), subtracted on the device during the conversion
+        @param flat: flat field image (shape of the image), the images are divided by it (normalized to its mean)
+                     during the conversion. Dark and flat are kept on the device (monochrome images only)
+        @param hot_pixels: threshold: pixels deviating by more than this from the median of their 3x3 neighbourhood
+                           (after correction) are replaced by this median
+        @param percentiles: p or (low, high) in percent: the image is normalized between these percentiles of its
+                            histogram (calculated on the device) instead of its min and max, i.e. 1 for (1, 99).
+                            Values beyond the percentiles are not clipped: without mask the normalization is fused
+                            in the first pass of the separable blur, where clipping would not commute with the
+                            second pass, and the masked path (normalize_weighted) does the same for consistency.
+                            The stretch stays linear, which is all the DoG needs
+        @param output_size: initial number of keypoints of the contiguous output of all octaves, grown on demand
+                            (by default the size of the keypoint buffers of the first octave)
+        """
+        self.parent = plan
+        if plan is not None:
+            if template is None and shape is None:
+                shape = plan.shape if plan.layout == "packed12" else plan.input_shape
+                dtype = plan.dtype
+                layout = plan.layout
+            if binning is None:
+                binning = plan.binning
+            if roi is None:
+                roi = plan.roi
+            if mask is None:
+                mask = plan.mask
+            if dark is None:
+                dark = plan.dark
+            if flat is None:
+                flat = plan.flat
+            if hot_pixels is None:
+                hot_pixels = plan.hot_pixels
+            if percentiles is None:
+                percentiles = plan.percentiles
+            if ctx is None and queue is None:
+                ctx = plan.ctx
+        if template is not None:
+            shape = template.shape
+            dtype = template.dtype
+        self.dtype = numpy.dtype(dtype)
+        shape = tuple(shape)
+        if layout not in (None,) + self.layouts:
+            raise RuntimeError("Unknown layout %s, valid are %s" % (layout, self.layouts))
+        self.layout = layout
+        if layout == "packed12" and len(shape) == 2 and (shape[0] * shape[1]) % 2 == 0:
+            self.RGB = False
+            self.shape = shape
+            self.dtype = numpy.dtype(numpy.uint8)
+            self.input_shape = (shape[0] * shape[1] * 3 // 2,)
+        elif layout == "planar" and len(shape) == 3 and shape[0] in (3, 4):
+            self.RGB = True
+            self.shape = shape[1:]
+            self.input_shape = shape
+        elif layout in (None, "interleaved") and len(shape) == 3 and shape[2] in (3, 4):
+            self.RGB = True
+            self.layout = "interleaved"
+            self.shape = shape[:2]
+            self.input_shape = shape
+        elif layout is None and len(shape) == 2:
+            self.RGB = False
+            self.shape = shape
+            self.input_shape = shape
+        else:
+            raise RuntimeError("Unable to process image of shape %s with layout %s" % (shape, layout))
+        self.mask = self._check_frame(mask, "Mask", bool)
+        self.dark = self._check_frame(dark, "Dark")
+        self.flat = self._check_frame(flat, "Flat")
+        if (self.dark is not None or self.flat is not None) and (self.RGB or self.layout == "packed12"):
+            raise RuntimeError("Dark and flat field correction are only available for monochrome images")
+        self.hot_pixels = None if hot_pixels is None else float(hot_pixels)
+        if percentiles is not None and not isinstance(percentiles, (tuple, list)):
+            percentiles = (percentiles, 100.0 - percentiles)
+        self.percentiles = None if percentiles is None else tuple(float(i) for i in percentiles)
+        if self.percentiles is not None and not (0 <= self.percentiles[0] < self.percentiles[1] <= 100):
+            raise RuntimeError("Invalid percentiles %s" % (self.percentiles,))
+        self.roi = None
+        self.raw_shape = self.input_shape  # what is converted on the device
+        if roi is not None:
+            row, col, height, width = (int(i) for i in roi)
+            if self.layout in ("planar", "packed12"):
+                raise RuntimeError("A region of interest is not supported with the %s layout" % self.layout)
+            if min(row, col) < 0 or min(height, width) <= 0 or row + height > self.shape[0] or col + width > self.shape[1]:
+                raise RuntimeError("Region of interest %s outside of the image of shape %s" % (tuple(roi), self.shape))
+            self.roi = (row, col, height, width)
+            self.shape = (height, width)
+            self.raw_shape = self.shape + self.input_shape[2:]
+        if PIX_PER_KP :
+            self.PIX_PER_KP = int(PIX_PER_KP)
+        self.profile = bool(profile)
+        self.max_workgroup_size = max_workgroup_size
+        self.events = []
+        self.scales = []  # in XY order
+        self.procsize = []
+        self.wgsize = []
+        self.kpsize = None
+        self.output_size = None if output_size is None else max(1, int(output_size))
+        self.buffers = {}
+        self.staging = {}  # page-locked host arrays, mapped once for all
+        self.pinned = bool(pinned)
+        self.zero_copy = False
+        self.host_input = None  # host image wrapped for zero-copy, referenced until the kernels have read it
+        self.programs = {}
+        self.worker = None
+        self._lock = threading.RLock()  # one calculation at a time: buffers and recorded launches are shared
+        self.cache = cache
+        self.kernel_digest = None
+        self.cache_digests = {}  # just_for_spots: digest of all parameters of the calculation
+        self.kernel_cache = {}  # kernel objects re-used for the data-dependent launches
+        self.launches = []  # per octave: pre-bound launches replayed for each frame
+        self.init_launches = []
+        self.minmax_launches = []
+        self.weight_launches = []
+        self.memory = None
+        self.octave_max = None
+        self.double_size = bool(par.DoubleImSize)  # octave -1: the image is upsampled twice on the device
+        if binning is None:
+            binning = 1
+        if isinstance(binning, int):
+            binning = (binning, binning)
+        self.binning = tuple(int(i) for i in binning)
+        self._calc_scales()
+        self._calc_memory()
+        if queue is not None:
+            ctx = queue.context
+        if ctx is not None:
+            self.device = None
+            self.ctx = ctx
+        else:
+            if device is None:
+                self.device = ocl.select_device(type=devicetype, memory=self.memory, best=True)
+            else:
+                self.device = device
+            self.ctx = pyopencl.Context(devices=[pyopencl.get_platforms()[self.device[0]].get_devices()[self.device[1]]])
+        print self.ctx.devices[0]
+        # without double precision on the device, float64 images are converted on the host
+        self.host_cast = (self.dtype == numpy.float64) and ("cl_khr_fp64" not in self.ctx.devices[0].extensions)
+        if queue is not None:
+            self.queue = queue
+            if self.profile and not (queue.properties & pyopencl.command_queue_properties.PROFILING_ENABLE):
+                logger.warning("Profiling is not enabled on the provided queue: disabling profiling")
+                self.profile = False
+        elif profile:
+            self.queue = pyopencl.CommandQueue(self.ctx, properties=pyopencl.command_queue_properties.PROFILING_ENABLE)
+        else:
+            self.queue = pyopencl.CommandQueue(self.ctx)
+        self._calc_workgroups()
+        self._compile_kernels()
+        self._allocate_buffers()
+        if self.pinned:
+            self._allocate_staging()
+        self._record_launches()
+        if self.dark is not None or self.flat is not None:
+            self._init_correction()
+        if self.mask is not None:
+            self._init_mask()
+        if self.cache is not None:
+            self._init_cache()
+        self.debug = []
+
+
+    def __del__(self):
+        """
+        Destructor: release all buffers
+        """
+        if getattr(self, "worker", None) is not None:
+            self.worker.stop()
+        self.launches = []
+        self.kernel_cache = {}
+        self._free_kernels()
+        self._free_buffers()
+        self.queue = None
+        self.ctx = None
+        gc.collect()
+
+    def _calc_scales(self):
+        """
+        Nota scales are in XY order
+        """
+        bin_h, bin_w = self.binning
+        self.binned_shape = ((self.shape[0] + bin_h - 1) // bin_h, (self.shape[1] + bin_w - 1) // bin_w)
+        shape = self.binned_shape
+        # keypoints are found on the resampled image: x_input = x * scale_x + offset_x (same for y)
+        scale_x, scale_y = float(bin_w), float(bin_h)
+        if self.double_size:
+            shape = (2 * shape[0], 2 * shape[1])
+            scale_x, scale_y = scale_x / 2.0, scale_y / 2.0
+        offset_x, offset_y = (bin_w - 1) / 2.0, (bin_h - 1) / 2.0
+        if self.roi is not None:
+            offset_y += self.roi[0]
+            offset_x += self.roi[1]
+        if (scale_x, scale_y, offset_x, offset_y) == (1.0, 1.0, 0.0, 0.0):
+            self.kp_transform = None
+        else:
+            self.kp_transform = tuple(numpy.float32(i) for i in (scale_x, scale_y, offset_x, offset_y))
+        self.input_scale = tuple(numpy.int32(i) for i in self.shape[-1::-1])
+        self.scales = [tuple(numpy.int32(i) for i in shape[-1::-1])]
+        min_size = 2 * par.BorderDist + 2
+        while min(shape) > min_size * 2:
+            shape = tuple(numpy.int32(i // 2) for i in shape)
+            self.scales.append(shape)
+#        self.scales.pop()
+        self.octave_max = len(self.scales)
+
+    def _calc_memory(self):
+        # Just the context + kernel takes about 75MB on the GPU
+        self.memory = 75 * 2 ** 20
+        size_of_float = numpy.dtype(numpy.float32).itemsize
+        size_of_input = numpy.dtype(self.dtype).itemsize
+        # raw images:
+        self.memory += int(numpy.prod(self.raw_shape)) * size_of_input  # initial_image (no raw_float)
+        if self.double_size or self.binning != (1, 1):
+            self.memory += self.shape[0] * self.shape[1] * size_of_float  # float input before resampling
+        if self.dark is not None or self.flat is not None:
+            self.memory += 2 * self.shape[0] * self.shape[1] * size_of_float  # dark and gain
+        if self.hot_pixels is not None:
+            self.memory += self.shape[0] * self.shape[1] * size_of_float  # before the median filter
+        if self.percentiles is not None:
+            self.memory += self.histogram_bins * 4
+        for scale in self.scales:
+            nr_blur = par.Scales + 3  # 3 blurs and 2 tmp
+            nr_dogs = par.Scales + 2
+            size = scale[0] * scale[1]
+            self.memory += size * (nr_blur + nr_dogs) * size_of_float
+        self.kpsize = int(self.scales[0][0] * self.scales[0][1] // self.PIX_PER_KP)  # Is the number of kp independant of the octave ? int64 causes problems with pyopencl
+        self.memory += self.kpsize * size_of_float * 4 * 2  # those are array of float4 to register keypoints, we need two of them
+        self.memory += self.kpsize * 128  # stores the descriptors: 128 unsigned chars
+        self.memory += self.kpsize * (size_of_float * 4 + 128) + 4  # contiguous output of all octaves + counter, grown on demand
+        self.memory += 4  # keypoint index Counter
+        self.memory += self.kpsize * 4 * 2  # positions and block sums of the compaction
+        self.memory += par.Scales * self.kpsize * size_of_float * 4  # interpolated keypoints of each scale
+
+
+        ########################################################################
+        # Calculate space for gaussian kernels
+        ########################################################################
+        curSigma = 1.0 if self.double_size else 0.5
+        if par.InitSigma > curSigma:
+            sigma = math.sqrt(par.InitSigma ** 2 - curSigma ** 2)
+            size = kernel_size(sigma, True)
+            # TODO: possible enhancement, if size is even make it odd
+            logger.debug("pre-Allocating %s float for init blur" % size)
+            self.memory += size * size_of_float
+        prevSigma = par.InitSigma
+        for i in range(par.Scales + 2):
+            increase = prevSigma * math.sqrt(self.sigmaRatio ** 2 - 1.0)
+            size = kernel_size(increase, True)
+            logger.debug("pre-Allocating %s float for blur sigma: %s" % (size, increase))
+            self.memory += size * size_of_float
+            prevSigma *= self.sigmaRatio;
+
+    def _allocate_buffers(self):
+        shape = shape_0 = (int(self.scales[0][1]), int(self.scales[0][0]))
+        if self.dtype != numpy.float32 and not self.host_cast:
+            self.buffers["raw"] = pyopencl.array.empty(self.queue, self.raw_shape, dtype=self.dtype)
+        self.buffers[ "Kp_1" ] = pyopencl.array.empty(self.queue, (self.kpsize, 4), dtype=numpy.float32)
+        self.kp_used = self.kpsize  # range of Kp_1 to invalidate before the next octave
+        self.buffers[ "Kp_2" ] = pyopencl.array.empty(self.queue, (self.kpsize, 4), dtype=numpy.float32)
+        # interpolated keypoints of the extrema detection: one segment per scale
+        self.buffers["candidates"] = pyopencl.array.empty(self.queue, (par.Scales, self.kpsize, 4), dtype=numpy.float32)
+        self.buffers["counters"] = pyopencl.array.empty(self.queue, par.Scales, dtype=numpy.int32)
+        # prefix sums of the compaction
+        self.buffers["positions"] = pyopencl.array.empty(self.queue, self.kpsize, dtype=numpy.int32)
+        self.buffers["block_sums"] = pyopencl.array.empty(self.queue, self.kpsize // self.compact_wgsize[0] + 1, dtype=numpy.int32)
+        self.buffers["cnt" ] = pyopencl.array.empty(self.queue, 1, dtype=numpy.int32)
+        self.buffers["descriptors"] = pyopencl.array.empty(self.queue, (self.kpsize, 128), dtype=numpy.uint8)
+        # Keypoints and descriptors of all octaves are gathered there, grown on demand
+        if self.output_size is None:
+            self.output_size = self.kpsize
+        self.buffers["output_kp"] = pyopencl.array.empty(self.queue, (self.output_size, 4), dtype=numpy.float32)
+        self.buffers["output_desc"] = pyopencl.array.empty(self.queue, (self.output_size, 128), dtype=numpy.uint8)
+        self.buffers["output_cnt"] = pyopencl.array.empty(self.queue, 1, dtype=numpy.int32)
+
+        for octave in range(self.octave_max):
+            self.buffers[(octave, "tmp") ] = pyopencl.array.empty(self.queue, shape, dtype=numpy.float32)
+            self.buffers[(octave, "ori") ] = pyopencl.array.empty(self.queue, shape, dtype=numpy.float32)
+            for scale in range(par.Scales + 3):
+                self.buffers[(octave, scale) ] = pyopencl.array.empty(self.queue, shape, dtype=numpy.float32)
+            self.buffers[(octave, "DoGs") ] = pyopencl.array.empty(self.queue,(par.Scales + 2, shape[0], shape[1]), dtype=numpy.float32)
+            shape = (shape[0] // 2, shape[1] // 2)
+        if self.double_size or self.binning != (1, 1):
+            # float input, binned and/or upsampled into the first octave
+            self.buffers["input"] = pyopencl.array.empty(self.queue, self.shape, dtype=numpy.float32)
+        else:
+            self.buffers["input"] = self.buffers[(0, 0)]
+        if self.double_size and self.binning != (1, 1):
+            self.buffers["binned"] = pyopencl.array.empty(self.queue, self.binned_shape, dtype=numpy.float32)
+        if self.mask is not None:
+            self.buffers["mask"] = pyopencl.array.to_device(self.queue, self._crop(self.mask).astype(numpy.uint8))
+            self.buffers["weight"] = pyopencl.array.empty(self.queue, shape_0, dtype=numpy.float32)
+        if self.hot_pixels is not None:
+            # corrected image, before the median filter writes it into input
+            self.buffers["unfiltered"] = pyopencl.array.empty(self.queue, self.shape, dtype=numpy.float32)
+        # (min,max) of each workgroup of the input, reduced into min and max
+        nb_groups = (self.input_procsize[0] // self.input_wgsize[0]) * (self.input_procsize[1] // self.input_wgsize[1])
+        self.buffers["minmax"] = pyopencl.array.empty(self.queue, (nb_groups, 2), dtype=numpy.float32)
+        self.buffers["min"] = pyopencl.array.empty(self.queue, (1), dtype=numpy.float32)
+        self.buffers["max"] = pyopencl.array.empty(self.queue, (1), dtype=numpy.float32)
+        # min and max gathered for a single readback
+        self.buffers["range"] = pyopencl.array.empty(self.queue, (2,), dtype=numpy.float32)
+        self.host_range = numpy.empty(2, dtype=numpy.float32)
+        self.buffers["255"] = pyopencl.array.to_device(self.queue, numpy.array([255.0], dtype=numpy.float32))
+        if self.percentiles is not None:
+            # reset by percentile_range after each use
+            self.buffers["histogram"] = pyopencl.array.zeros(self.queue, self.histogram_bins, dtype=numpy.uint32)
+
+#        for buffer in self.buffers.values():
+#            buffer.fill(0)
+        ########################################################################
+        # Allocate space for gaussian kernels
+        ########################################################################
+        curSigma = 1.0 if self.double_size else 0.5
+        if par.InitSigma > curSigma:
+            sigma = math.sqrt(par.InitSigma ** 2 - curSigma ** 2)
+            self._init_gaussian(sigma)
+        prevSigma = par.InitSigma
+
+        for i in range(par.Scales + 2):
+            increase = prevSigma * math.sqrt(self.sigmaRatio ** 2 - 1.0)
+            self._init_gaussian(increase)
+            prevSigma *= self.sigmaRatio
+
+
+    def _allocate_staging(self):
+        """
+        Allocate the host side of the transfers in page-locked memory (ALLOC_HOST_PTR),
+        mapped once for all so that the DMA engine reads and writes them directly.
+
+        On devices sharing the memory of the host (CPU, integrated GPU) no staging is needed:
+        input images are wrapped (USE_HOST_PTR) and read in place by the kernels.
+        """
+        device = self.ctx.devices[0]
+        try:
+            self.zero_copy = bool(device.host_unified_memory)
+        except (pyopencl.LogicError, AttributeError):
+            self.zero_copy = False
+        if self.zero_copy:
+            logger.debug("Device shares the host memory: zero-copy transfers")
+            return
+        self.input_buffer(0)
+        self._map_staging("output_kp", (self.output_size, 4), numpy.float32, MF.WRITE_ONLY, pyopencl.map_flags.READ)
+        self._map_staging("output_desc", (self.output_size, 128), numpy.uint8, MF.WRITE_ONLY, pyopencl.map_flags.READ)
+
+    def _map_staging(self, name, shape, dtype, flags, map_flags):
+        """
+        Allocate a page-locked buffer and map it on the host
+        """
+        nbytes = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+        buf = pyopencl.Buffer(self.ctx, flags | MF.ALLOC_HOST_PTR, nbytes)
+        ary, evt = pyopencl.enqueue_map_buffer(self.queue, buf, map_flags, 0, shape, dtype)
+        evt.wait()
+        self.buffers[("staging", name)] = buf
+        self.staging[name] = ary
+
+    def input_buffer(self, slot=0):
+        """
+        Host array where the next frame can be written directly before calling keypoints on it:
+
+        frame = siftp.input_buffer()
+        frame[...] = reader.read()
+        kp = siftp.keypoints(frame)
+
+        Several slots can be used to prepare the next frames while the current one is processed.
+
+        @param slot: index of the input slot, allocated on first use
+        @return: page-locked numpy array with the shape and dtype of the plan (a plain array without staging)
+        """
+        name = "input_%s" % slot
+        if name not in self.staging:
+            if self.pinned and not self.zero_copy:
+                self._map_staging(name, self.input_shape, self.dtype, MF.READ_ONLY, pyopencl.map_flags.WRITE)
+            else:
+                self.staging[name] = numpy.empty(self.input_shape, dtype=self.dtype)
+        return self.staging[name]
+
+    def _init_gaussian(self, sigma):
+        """
+        Create a buffer of the right size according to the width of the gaussian ...
+
+
+        @param  sigma: width of the gaussian, the length of the function will be 8*sigma + 1
+
+        Same calculation done on CPU
+        x = numpy.arange(size) - (size - 1.0) / 2.0
+        gaussian = numpy.exp(-(x / sigma) ** 2 / 2.0).astype(numpy.float32)
+        gaussian /= gaussian.sum(dtype=numpy.float32)
+        """
+        name = "gaussian_%s" % sigma
+        if self.parent is not None and self.parent.buffers.get(name) is not None:
+            self.parent.queue.finish()
+            self.buffers[name] = self.parent.buffers[name]
+            return
+        size = kernel_size(sigma, True)
+        logger.debug("Allocating %s float for blur sigma: %s" % (size, sigma))
+        gaussian_gpu = pyopencl.array.empty(self.queue, size, dtype=numpy.float32)
+#       Norming the gaussian takes three OCL kernel launch (gaussian, calc_sum and norm) -
+        evt = self.programs["preprocess"].gaussian(self.queue, (size,), (1,),
+                                            gaussian_gpu.data,  # __global     float     *data,
+                                            numpy.float32(sigma),  # const        float     sigma,
+                                            numpy.int32(size))  # const        int     SIZE
+        if self.profile: self.events.append(("gaussian %s" % sigma, evt))
+
+        ########################################################################
+        # We use PyOpenCL parallel sum here. No benchmarking available.
+        ########################################################################
+        sum_data = pyopencl.array.sum(gaussian_gpu, dtype=numpy.float32, queue=self.queue)
+        evt = self.programs["preprocess"].divide_cst(self.queue, (size,), (1,),
+                                              gaussian_gpu.data,  # __global     float     *data,
+                                              sum_data.data,      # const        float     sigma,
+                                              numpy.int32(size))  # const        int     SIZE
+        if self.profile: self.events.append(("divide_cst", evt))
+        self.buffers[name] = gaussian_gpu
+
+
+    def _free_buffers(self):
+        """
+        free all memory allocated on the device
+        """
+        for buffer_name in self.buffers:
+            if self.buffers[buffer_name] is not None:
+                try:
+                    del self.buffers[buffer_name]
+                    self.buffers[buffer_name] = None
+                except pyopencl.LogicError:
+                    logger.error("Error while freeing buffer %s" % buffer_name)
+        self.staging = {}
+
+    def _compile_kernels(self):
+        """
+        Call the OpenCL compiler
+        """
+        if self.parent is not None:
+            self.programs.update(self.parent.programs)
+        md5 = hashlib.md5()
+        for kernel in self.kernels:
+            kernel_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), kernel + ".cl")
+            kernel_src = open(kernel_file).read()
+            md5.update(kernel_src.encode("utf-8"))
+            if kernel in self.programs:
+                continue
+            try:
+                program = pyopencl.Program(self.ctx, kernel_src).build()
+            except pyopencl.MemoryError as error:
+                raise MemoryError(error)
+            self.programs[kernel] = program
+        self.kernel_digest = md5.hexdigest()
+
+    def _init_cache(self):
+        """
+        Digest of the parameters of the calculation, fixed for the life of the plan, keying the cache with the image
+        """
+        corrections = [None if i is None else hash_image(i) for i in (self.mask, self.dark, self.flat)]
+        for just_for_spots in (False, True):
+            self.cache_digests[just_for_spots] = hash_parameters(self.kernel_digest, self.PIX_PER_KP, just_for_spots,
+                                                                 self.layout, self.binning, self.roi, self.double_size,
+                                                                 self.hot_pixels, self.percentiles, *corrections)
+
+    def _free_kernels(self):
+        """
+        free all kernels
+        """
+        self.programs = {}
+
+    def _check_frame(self, frame, name, dtype=numpy.float32):
+        """
+        @param frame: image with the shape of the input image (mask, dark or flat) or None
+        @param name: used in the error message
+        @return: contiguous copy of frame in the given dtype
+        """
+        if frame is None:
+            return None
+        frame = numpy.ascontiguousarray(frame).astype(dtype)
+        if frame.shape != self.shape:
+            raise RuntimeError("%s of shape %s does not match the image of shape %s" % (name, frame.shape, self.shape))
+        return frame
+
+    def _crop(self, frame):
+        """
+        @return: the region of interest of a frame with the shape of the input image
+        """
+        if self.roi is None:
+            return frame
+        row, col, height, width = self.roi
+        return numpy.ascontiguousarray(frame[row:row + height, col:col + width])
+
+    def _init_correction(self):
+        """
+        Upload the dark current and the gain (normalized inverse of the dark subtracted flat field),
+        resident on the device for the conversion kernels
+        """
+        dark = numpy.zeros(self.shape, numpy.float32) if self.dark is None else self._crop(self.dark)
+        if self.flat is None:
+            gain = numpy.ones(self.shape, numpy.float32)
+        else:
+            flat = self.flat - (0 if self.dark is None else self.dark)
+            valid = flat > 0
+            gain = numpy.zeros(flat.shape, numpy.float32)
+            gain[valid] = flat[valid].mean() / flat[valid]
+            gain = self._crop(gain)
+        self.buffers["dark"] = pyopencl.array.to_device(self.queue, dark)
+        self.buffers["gain"] = pyopencl.array.to_device(self.queue, gain)
+
+    def _init_mask(self):
+        """
+        Calculate once for all the weights of the normalized convolution
+        and the valid pixels of each octave, i.e. the pixels whose neighbourhood is not masked.
+        """
+        mask = self._crop(self.mask)
+        evt = pyopencl.enqueue_copy(self.queue, self.buffers["input"].data, numpy.ascontiguousarray(~mask, dtype=numpy.float32))
+        if self.profile:self.events.append(("copy mask", evt))
+        self._replay(self.weight_launches)
+        evt = pyopencl.enqueue_copy(self.queue, self.buffers["weight"].data, self.buffers[(0, 0)].data)
+        if self.profile:self.events.append(("copy weight", evt))
+        valid = self.buffers["weight"].get() > 0.999
+        for octave in range(self.octave_max):
+            width, height = self.scales[octave]
+            valid = valid[:height, :width]
+            self.buffers[(octave, "valid")] = pyopencl.array.to_device(self.queue, valid.astype(numpy.uint8))
+            # next octave: valid if the 4 pixels are valid, eroded by one pixel as the blur widens
+            valid = valid[:height // 2 * 2, :width // 2 * 2]
+            valid = valid[0::2, 0::2] & valid[1::2, 0::2] & valid[0::2, 1::2] & valid[1::2, 1::2]
+            eroded = valid.copy()
+            eroded[1:, :] &= valid[:-1, :]
+            eroded[:-1, :] &= valid[1:, :]
+            eroded[:, 1:] &= valid[:, :-1]
+            eroded[:, :-1] &= valid[:, 1:]
+            valid = eroded
+
+    def _calc_workgroups(self):
+        """
+        First try to guess the best workgroup size, then calculate all global worksize
+
+        Nota:
+        The workgroup size is limited by the device
+        The workgroup size is limited to the 2**n below then image size (hence changes with octaves)
+        The second dimension of the wg size should be large, the first small: i.e. (1,64)
+        The processing size should be a multiple of  workgroup size.
+        """
+        device = self.ctx.devices[0]
+        max_work_group_size = device.max_work_group_size
+        max_work_item_sizes = device.max_work_item_sizes
+        # we recalculate the shapes ...
+        shape = self.shape
+        self.max_workgroup_size = min(self.max_workgroup_size, max_work_item_sizes[1])
+        # conversion of the input image, before any upsampling
+        self.input_wgsize = (1, min(2 ** int(math.log(shape[1]) / math.log(2)), self.max_workgroup_size))
+        self.input_procsize = calc_size(shape, self.input_wgsize)
+        # 1D compaction of the keypoints by prefix sum, 2^n work-items per workgroup
+        self.compact_wgsize = (min(256, 2 ** int(math.log(min(self.max_workgroup_size, max_work_group_size)) / math.log(2))),)
+        shape = self.binned_shape
+        if self.double_size:
+            shape = (2 * shape[0], 2 * shape[1])
+        # one workgroup size per octave calculated in _calc_scales
+        self.tile_wgsize = []
+        self.tile_procsize = []
+        for octave in range(self.octave_max):
+            wg = (1, min(2 ** int(math.log(shape[1]) / math.log(2)), self.max_workgroup_size))
+            self.wgsize.append(wg)
+            self.procsize.append(calc_size(shape, wg))
+            # 3D extrema detection: tiles of (rows, cols) for all scales
+            tile_w = min(32, wg[1])
+            tile_h = max(1, min(8, min(self.max_workgroup_size, max_work_group_size) // tile_w, max_work_item_sizes[0]))
+            tile_h = 2 ** int(math.log(tile_h) / math.log(2))
+            self.tile_wgsize.append((tile_h, tile_w, 1))
+            self.tile_procsize.append(calc_size(shape, (tile_h, tile_w)) + (par.Scales,))
+            shape = tuple(i // 2 for i in shape)
+
+
+
+
+    def _upload(self, image):
+        """
+        Provide the image as float32 in the input buffer (the first buffer of the first octave without DoubleImSize).
+        The (min,max) of each workgroup is calculated in the same pass as the conversion,
+        in the minmax buffer (reduced by the minmax_launches).
+
+        Images already on the device (pyopencl array or buffer) are converted in place
+        by the *_to_float_minmax kernels, without any transfer through the host.
+        Host images are read in place on devices sharing the host memory, otherwise they are
+        transferred by DMA when written in the page-locked input_buffer().
+
+        @param image: numpy array, pyopencl array or pyopencl buffer
+        """
+        if isinstance(image, pyopencl.array.Array):
+            assert image.shape == self.input_shape
+            assert image.dtype == self.dtype
+            assert image.context == self.ctx
+            assert image.flags.c_contiguous
+            data = image.data
+            on_device = True
+        elif isinstance(image, pyopencl.Buffer):
+            nbytes = int(numpy.prod(self.input_shape)) * self.dtype.itemsize
+            assert image.size >= nbytes
+            assert image.context == self.ctx
+            data = image
+            on_device = True
+        else:
+            assert image.shape == self.input_shape
+            assert image.dtype == self.dtype
+            image = numpy.ascontiguousarray(image)
+            on_device = False
+            if self.host_cast:
+                image = image.astype(numpy.float32)
+            elif self.zero_copy:
+                # The kernels read the image in place from the host memory: image (possibly a temporary copy)
+                # and its buffer must outlive the queued kernels, they are released after the min/max readback
+                data = pyopencl.Buffer(self.ctx, MF.READ_ONLY | MF.USE_HOST_PTR, hostbuf=image)
+                self.host_input = (image, data)
+                on_device = True
+
+        if on_device and self.host_cast:
+            raise RuntimeError("float64 images can only be converted on the host: the device has no cl_khr_fp64")
+        local = pyopencl.LocalMemory(8 * self.input_wgsize[1])
+        # with the hot pixel filter, the converted image goes through the median filter into input
+        target = self.buffers["unfiltered" if self.hot_pixels is not None else "input"]
+        if (self.dtype == numpy.float32) or self.host_cast:
+            if self.roi is not None:
+                self._copy_roi(target.data, data if on_device else image, 4)
+            elif on_device:
+                evt = pyopencl.enqueue_copy(self.queue, target.data, data, byte_count=target.nbytes)
+                if self.profile:self.events.append(("copy", evt))
+            else:
+                evt = pyopencl.enqueue_copy(self.queue, target.data, image)
+                if self.profile:self.events.append(("copy", evt))
+            if "dark" in self.buffers:
+                evt = self._kernel("preprocess", "float_to_float_correct_minmax")(self.queue, self.input_procsize,
+                                   self.input_wgsize, target.data, target.data, self.buffers["dark"].data,
+                                   self.buffers["gain"].data, self.buffers["minmax"].data, local, *self.input_scale)
+                if self.profile:self.events.append(("correction", evt))
+            elif (self.mask is None) and (self.hot_pixels is None):
+                evt = self._kernel("preprocess", "minmax")(self.queue, self.input_procsize, self.input_wgsize,
+                                                           target.data, self.buffers["minmax"].data,
+                                                           local, *self.input_scale)
+                if self.profile:self.events.append(("minmax", evt))
+        else:
+            if self.roi is not None:
+                pixel_size = self.dtype.itemsize * int(numpy.prod(self.raw_shape[2:]))
+                self._copy_roi(self.buffers["raw"].data, data if on_device else image, pixel_size)
+                data = self.buffers["raw"].data
+            elif not on_device:
+                evt = pyopencl.enqueue_copy(self.queue, self.buffers["raw"].data, image)
+                if self.profile:self.events.append(("copy", evt))
+                data = self.buffers["raw"].data
+            self._convert(data, target, local)
+        if self.hot_pixels is not None:
+            evt = self._kernel("sort", "median3x3_filter")(self.queue, self.input_procsize, self.input_wgsize,
+                                                           target.data, self.buffers["input"].data,
+                                                           numpy.float32(self.hot_pixels), *self.input_scale)
+            if self.profile:self.events.append(("median filter", evt))
+            if self.mask is None:
+                evt = self._kernel("preprocess", "minmax")(self.queue, self.input_procsize, self.input_wgsize,
+                                                           self.buffers["input"].data, self.buffers["minmax"].data,
+                                                           local, *self.input_scale)
+                if self.profile:self.events.append(("minmax", evt))
+        if self.mask is not None:
+            # masked pixels are zeroed and excluded from the (min,max) of the workgroups
+            evt = self._kernel("preprocess", "mask_minmax")(self.queue, self.input_procsize, self.input_wgsize,
+                                                            self.buffers["input"].data, self.buffers["mask"].data,
+                                                            self.buffers["minmax"].data, local, *self.input_scale)
+            if self.profile:self.events.append(("mask_minmax", evt))
+
+    def _copy_roi(self, dest, src, pixel_size):
+        """
+        Rectangular copy of the region of interest of a frame into a contiguous buffer
+
+        @param dest: OpenCL buffer with the shape of the region of interest
+        @param src: numpy array or OpenCL buffer with the full frame
+        @param pixel_size: size of a pixel in bytes (channels included)
+        """
+        row, col, height, width = self.roi
+        frame_pitch = self.input_shape[1] * pixel_size
+        region = (width * pixel_size, height)
+        if isinstance(src, numpy.ndarray):
+            evt = pyopencl.enqueue_copy(self.queue, dest, src, buffer_origin=(0, 0), host_origin=(col * pixel_size, row),
+                                        region=region, buffer_pitches=(width * pixel_size,), host_pitches=(frame_pitch,))
+        else:
+            evt = pyopencl.enqueue_copy(self.queue, dest, src, src_origin=(col * pixel_size, row), dst_origin=(0, 0),
+                                        region=region, src_pitches=(frame_pitch,), dst_pitches=(width * pixel_size,))
+        if self.profile:self.events.append(("copy roi", evt))
+
+    def _convert(self, data, target, local):
+        """
+        Convert the raw frame into float32 (with dark and flat field correction if any)
+        and calculate the (min,max) of each workgroup
+
+        @param data: OpenCL buffer with the raw frame (region of interest)
+        @param target: float32 array receiving the converted image
+        @param local: local memory for the reduction
+        """
+        if self.layout == "packed12":
+            evt = self._kernel("preprocess", "packed12_to_float_minmax")(self.queue, self.input_procsize, self.input_wgsize,
+                    data, target.data, self.buffers["minmax"].data, local, *self.input_scale)
+            if self.profile:self.events.append(("packed12->float", evt))
+        elif self.RGB and (self.dtype in self.color_converter):
+            if self.layout == "planar":
+                strides = numpy.int32(1), numpy.int32(self.shape[0] * self.shape[1])
+            else:
+                strides = numpy.int32(self.input_shape[2]), numpy.int32(1)
+            program = self._kernel("preprocess", self.color_converter[self.dtype] + "_minmax")
+            evt = program(self.queue, self.input_procsize, self.input_wgsize,
+                    data, target.data, self.buffers["minmax"].data, local, strides[0], strides[1],
+                    *self.input_scale)
+            if self.profile:self.events.append(("RGB->float", evt))
+        elif (not self.RGB) and (self.dtype in self.converter) and ("dark" in self.buffers):
+            program = self._kernel("preprocess", self.converter[self.dtype] + "_correct_minmax")
+            evt = program(self.queue, self.input_procsize, self.input_wgsize,
+                    data, target.data, self.buffers["dark"].data, self.buffers["gain"].data,
+                    self.buffers["minmax"].data, local, *self.input_scale)
+            if self.profile:self.events.append(("correct ->float", evt))
+        elif (not self.RGB) and (self.dtype in self.converter):
+            program = self._kernel("preprocess", self.converter[self.dtype] + "_minmax")
+            evt = program(self.queue, self.input_procsize, self.input_wgsize,
+                    data, target.data, self.buffers["minmax"].data, local, *self.input_scale)
+            if self.profile:self.events.append(("convert ->float", evt))
+        else:
+            raise RuntimeError("invalid input format error")
+
+    def keypoints(self, image, just_for_spots=False, device=False):
+        """
+        Calculates the keypoints of the image
+        @param image: ndimage of 2D (or 3D if RGB), either a numpy array or an image already on the device
+                      (pyopencl array or buffer in the context of the plan, with the shape and dtype of the plan),
+                      raw bytes for packed layouts
+        @param device: if True, keep the results on the device and return a DeviceKeypoints, whose buffers
+                       are the ones of the plan: they are overwritten by the next calculation
+        @return: record array with x, y, scale, angle and desc (or DeviceKeypoints)
+
+        Calls from several threads (i.e. keypoints, keypoints_async and iter_keypoints) are serialized.
+        """
+        with self._lock:
+            return self._keypoints(image, just_for_spots, device)
+
+    def _keypoints(self, image, just_for_spots=False, device=False):
+        total_size = 0
+        t0 = time.time()
+        if self.cache is not None and not device and isinstance(image, numpy.ndarray):
+            key = self.cache.key(image, self.cache_digests[bool(just_for_spots)])
+            output = self.cache.get(key)
+            if output is not None:
+                return output
+        else:
+            key = None
+        self._upload(image)
+        self._replay(self.minmax_launches)
+        min_value, max_value = self._read_range()
+        flat = not (max_value > min_value)
+        # the blocking readback waited for all the kernels reading the input
+        self.host_input = None
+        if not flat:
+            # normalization between 0 and 255 is done within the initial blur
+            self._replay(self.init_launches)
+            if just_for_spots:
+                self.buffers["output_desc"].fill(0, self.queue)
+            for octave in range(self.octave_max):
+                nkp = self.one_octave(octave, just_for_spots=just_for_spots, offset=total_size)
+                print("in octave %i found %i kp" % (octave, nkp))
+                total_size += nkp
+            if (self.kp_transform is not None) and total_size:
+                # keypoints were found on the resampled image
+                wgsize = (8,)
+                evt = self._kernel("algebra", "rescale_keypoints")(self.queue, calc_size((total_size,), wgsize), wgsize,
+                                                                  self.buffers["output_kp"].data, *self.kp_transform +
+                                                                  (numpy.int32(total_size),))
+                if self.profile:self.events.append(("rescale keypoints", evt))
+        else:
+            logger.info("Flat image: no keypoints")
+
+        ########################################################################
+        # Keypoints of all octaves are contiguous on the device
+        ########################################################################
+        self.buffers["output_cnt"].fill(total_size, self.queue)
+        output = DeviceKeypoints(self.queue, self.buffers["output_kp"], self.buffers["output_desc"],
+                                 self.buffers["output_cnt"], total_size,
+                                 self.staging.get("output_kp"), self.staging.get("output_desc"))
+        if not device:
+            output = output.get()
+            if key is not None:
+                self.cache.put(key, output)
+        print("Execution time: %.3fms" % (1000 * (time.time() - t0)))
+#        self.count_kp(output)
+        return output
+
+    def _read_range(self):
+        """
+        Gather min and max on the device and read them back with a single blocking transfer
+
+        @return: array with the min and the max of the image
+        """
+        size = self.buffers["min"].nbytes
+        range_data = self.buffers["range"].data
+        pyopencl.enqueue_copy(self.queue, range_data, self.buffers["min"].data, byte_count=size)
+        pyopencl.enqueue_copy(self.queue, range_data, self.buffers["max"].data, byte_count=size, dest_offset=size)
+        pyopencl.enqueue_copy(self.queue, self.host_range, range_data)
+        return self.host_range
+
+    def keypoints_async(self, image, just_for_spots=False, device=False):
+        """
+        Submit the calculation of the keypoints of an image, without waiting for it:
+
+        future = siftp.keypoints_async(img)
+        kp = future.result()                      # blocking
+        kp = await asyncio.wrap_future(future)    # from an asyncio event loop
+
+        Requests are queued and processed in order by the worker thread of the plan,
+        so that all blocking reads of the counters happen outside the caller's thread.
+        The image must not be modified until the future is done.
+
+        @param image: as for keypoints
+        @param device: if True the result is a DeviceKeypoints with its own buffers
+        @return: future with the result of keypoints
+        """
+        if self.worker is None:
+            self.worker = Worker("SiftPlan")
+        if device:
+            return self.worker.submit(self._keypoints_copy, image, just_for_spots)
+        return self.worker.submit(self.keypoints, image, just_for_spots)
+
+    def _keypoints_copy(self, image, just_for_spots=False):
+        """
+        @return: DeviceKeypoints with their own buffers, copied before any other calculation starts
+        """
+        with self._lock:
+            return self.keypoints(image, just_for_spots, True).copy()
+
+    def iter_keypoints(self, frames, depth=2):
+        """
+        Calculates the keypoints of a sequence of frames:
+
+        for index, kp, desc in siftp.iter_keypoints(frames):
+            ...
+
+        Each frame is processed synchronously, as with keypoints, in the caller's thread: only the reading
+        is done in advance. The frames are pulled from the iterable (read, decoded) by a background thread,
+        at most depth frames in advance, into the page-locked input buffers, so that the next frame is ready
+        as soon as the previous one is processed. Results are yielded in order.
+
+        @param frames: any iterable (or generator) of images with the shape and dtype of the plan
+        @param depth: number of frames prepared in advance
+        @return: generator of (index, keypoints, descriptors), keypoints being the record array and descriptors its desc field
+        """
+        depth = max(1, int(depth))
+        slots = [self.input_buffer(slot) for slot in range(depth + 1)]
+        for index, frame in prefetch(enumerate(frames), slots):
+            kp = self.keypoints(frame)
+            yield index, kp, kp.desc
+
+    def _kernel(self, program, name):
+        """
+        @return: the kernel object, created once, for launches whose arguments change with the data
+        """
+        key = (program, name)
+        if key not in self.kernel_cache:
+            self.kernel_cache[key] = pyopencl.Kernel(self.programs[program], name)
+        return self.kernel_cache[key]
+
+    def _bind(self, label, program, name, procsize, wgsize, *args):
+        """
+        Create a kernel object with all its arguments already set
+
+        @return: launch (label, kernel, procsize, wgsize) to be replayed
+        """
+        kernel = pyopencl.Kernel(self.programs[program], name)
+        kernel.set_args(*args)
+        return (label, kernel, procsize, wgsize)
+
+    def _bind_convolution(self, input_data, output_data, sigma, octave=0, normalize=False):
+        """
+        @param normalize: normalize the input between min and max into 0-255 within the first pass
+        @return: the two launches of the separable gaussian convolution, using the tmp buffer of the octave
+        """
+        temp_data = self.buffers[(octave, "tmp") ]
+        gaussian = self.buffers["gaussian_%s" % sigma]
+        label = "Blur sigma %s octave %s" % (sigma, octave)
+        if normalize:
+            first = self._bind(label, "convolution", "horizontal_convolution_normalize", self.procsize[octave], self.wgsize[octave],
+                               input_data.data, temp_data.data, gaussian.data, numpy.int32(gaussian.size),
+                               self.buffers["min"].data, self.buffers["max"].data, numpy.float32(255.0), *self.scales[octave])
+        else:
+            first = self._bind(label, "convolution", "horizontal_convolution", self.procsize[octave], self.wgsize[octave],
+                               input_data.data, temp_data.data, gaussian.data, numpy.int32(gaussian.size), *self.scales[octave])
+        return [first,
+                self._bind(label, "convolution", "vertical_convolution", self.procsize[octave], self.wgsize[octave],
+                           temp_data.data, output_data.data, gaussian.data, numpy.int32(gaussian.size), *self.scales[octave])]
+
+    def _record_launches(self):
+        """
+        Record once all launches which do not depend on the content of the image: initial blur,
+        gaussian pyramid and DoG, gradients and shrinking of each octave.
+        Kernels, arguments, global and local sizes are set once for all and only enqueued for each frame.
+        """
+        wg = (self.input_wgsize[1],)
+        self.minmax_launches = [self._bind("reduce_minmax", "preprocess", "reduce_minmax", wg, wg,
+                                           self.buffers["minmax"].data, numpy.int32(self.buffers["minmax"].shape[0]),
+                                           self.buffers["min"].data, self.buffers["max"].data,
+                                           pyopencl.LocalMemory(8 * wg[0]))]
+        if self.percentiles is not None:
+            # one more read of the input for its histogram, the (min,max) being replaced by the percentiles
+            self.minmax_launches += [self._bind("histogram", "preprocess", "histogram", self.input_procsize, self.input_wgsize,
+                                                self.buffers["input"].data,
+                                                self.buffers["mask"].data if self.mask is not None else None,
+                                                self.buffers["min"].data, self.buffers["max"].data,
+                                                self.buffers["histogram"].data,
+                                                pyopencl.LocalMemory(4 * self.histogram_bins),
+                                                numpy.int32(self.histogram_bins), *self.input_scale),
+                                     self._bind("percentile_range", "preprocess", "percentile_range", (1,), (1,),
+                                                self.buffers["histogram"].data, numpy.int32(self.histogram_bins),
+                                                self.buffers["min"].data, self.buffers["max"].data,
+                                                numpy.float32(self.percentiles[0] / 100.0),
+                                                numpy.float32(self.percentiles[1] / 100.0))]
+        self.init_launches = []
+        source = self.buffers["input"]
+        source_scale = self.input_scale
+        if self.binning != (1, 1):
+            target = self.buffers["binned"] if self.double_size else self.buffers[(0, 0)]
+            wg = (1, min(2 ** int(math.log(self.binned_shape[1]) / math.log(2)), self.max_workgroup_size))
+            self.init_launches.append(self._bind("bin %sx%s" % self.binning, "preprocess", "bin",
+                                                 calc_size(self.binned_shape, wg), wg, source.data, target.data,
+                                                 numpy.int32(self.binning[1]), numpy.int32(self.binning[0]),
+                                                 self.input_scale[0], self.input_scale[1],
+                                                 numpy.int32(self.binned_shape[1]), numpy.int32(self.binned_shape[0])))
+            source = target
+            source_scale = numpy.int32(self.binned_shape[1]), numpy.int32(self.binned_shape[0])
+        if self.double_size:
+            self.init_launches.append(self._bind("upsample", "preprocess", "upsample2", self.procsize[0], self.wgsize[0],
+                                                 source.data, self.buffers[(0, 0)].data,
+                                                 source_scale[0], source_scale[1], *self.scales[0]))
+        curSigma = 1.0 if self.double_size else 0.5
+        blur = []
+        if par.InitSigma > curSigma:
+            sigma = math.sqrt(par.InitSigma ** 2 - curSigma ** 2)
+            blur = self._bind_convolution(self.buffers[(0, 0)], self.buffers[(0, 0)], sigma, 0, normalize=self.mask is None)
+        if self.mask is not None:
+            # the valid pixels go through the same resampling and blur to give the weights of the normalized convolution
+            self.weight_launches = self.init_launches + blur
+            self.init_launches = self.weight_launches + [self._bind("normalize", "preprocess", "normalize_weighted",
+                                             self.procsize[0], self.wgsize[0],
+                                             self.buffers[(0, 0)].data, self.buffers["weight"].data,
+                                             self.buffers["min"].data, self.buffers["max"].data, numpy.float32(255.0),
+                                             *self.scales[0])]
+        elif blur:
+            self.init_launches += blur
+        else:
+            self.init_launches += [self._bind("normalize", "preprocess", "normalizes", self.procsize[0], self.wgsize[0],
+                                             self.buffers[(0, 0)].data, self.buffers["min"].data, self.buffers["max"].data,
+                                             self.buffers["255"].data, *self.scales[0])]
+        self.launches = []
+        for octave in range(self.octave_max):
+            pyramid = []
+            prevSigma = par.InitSigma
+            for scale in range(par.Scales + 2):
+                sigma = prevSigma * math.sqrt(self.sigmaRatio ** 2 - 1.0)
+                pyramid += self._bind_convolution(self.buffers[(octave, scale)], self.buffers[(octave, scale + 1)], sigma, octave)
+                prevSigma *= self.sigmaRatio
+                pyramid.append(self._bind("DoG %s %s" % (octave, scale), "algebra", "combine",
+                                          self.procsize[octave], self.wgsize[octave],
+                                          self.buffers[(octave, scale + 1)].data, numpy.float32(-1.0),
+                                          self.buffers[(octave, scale)].data, numpy.float32(+1.0),
+                                          self.buffers[(octave, "DoGs")].data, numpy.int32(scale),
+                                          *self.scales[octave]))
+            gradient = {}
+            for scale in range(1, par.Scales + 1):
+                gradient[scale] = [self._bind("compute_gradient_orientation %s %s" % (octave, scale),
+                                              "image", "compute_gradient_orientation",
+                                              self.procsize[octave], self.wgsize[octave],
+                                              self.buffers[(octave, scale)].data,  # __global float* igray,
+                                              self.buffers[(octave, "tmp")].data,  # __global float *grad,
+                                              self.buffers[(octave, "ori")].data,  # __global float *ori,
+                                              *self.scales[octave])]  # int width,int height
+            shrink = []
+            if octave < self.octave_max - 1:
+                shrink.append(self._bind("shrink %s->%s" % (self.scales[octave], self.scales[octave + 1]),
+                                         "preprocess", "shrink", self.procsize[octave + 1], self.wgsize[octave + 1],
+                                         self.buffers[(octave, par.Scales)].data, self.buffers[(octave + 1, 0)].data,
+                                         numpy.int32(2), numpy.int32(2), *self.scales[octave + 1]))
+            self.launches.append({"pyramid": pyramid, "gradient": gradient, "shrink": shrink})
+
+    def _replay(self, launches):
+        """
+        Enqueue a list of recorded launches
+        """
+        for label, kernel, procsize, wgsize in launches:
+            evt = pyopencl.enqueue_nd_range_kernel(self.queue, kernel, procsize, wgsize)
+            if self.profile:self.events.append((label, evt))
+
+    def one_octave(self, octave, just_for_spots=False, offset=0):
+        """
+        does all scales within an octave
+
+        @param octave: number of the octave
+        @param just_for_spots: only look for maxima, without orientation nor descriptors
+        @param offset: position of the first keypoint of this octave in the output buffers
+        @return: number of keypoints of the octave appended to the output buffers
+        """
+        print("Calculating octave %i" % octave)
+        wgsize = (8,)  # (max(self.wgsize[octave]),) #TODO: optimize
+        kpsize32 = numpy.int32(self.kpsize)
+        self._reset_keypoints()
+        octsize = numpy.int32(2 ** octave)
+        last_start = numpy.int32(0)
+        launches = self.launches[octave]
+
+        ########################################################################
+        # Calculate gaussian blur and DoG: recorded launches
+        ########################################################################
+        self._replay(launches["pyramid"])
+        if not just_for_spots:
+            # extrema of all scales detected and interpolated in a single launch, the number of keypoints of each scale read at once
+            self.buffers["counters"].fill(0, self.queue)
+            tile_wg = self.tile_wgsize[octave]
+            evt = self._kernel("image", "local_maxmin_interp")(self.queue, self.tile_procsize[octave], tile_wg,
+                                          self.buffers[(octave, "DoGs")].data,  # __global float* DOGS,
+                                          self.buffers[(octave, "valid")].data if self.mask is not None else None,  # __global unsigned char* valid,
+                                          self.buffers["candidates"].data,  # __global keypoint* output,
+                                          pyopencl.LocalMemory(3 * (tile_wg[0] + 2) * (tile_wg[1] + 2) * 4),  # __local float* tile,
+                                          numpy.int32(par.BorderDist),  # int border_dist,
+                                          numpy.float32(par.PeakThresh),  # float peak_thresh,
+                                          octsize,  # int octsize,
+                                          numpy.float32(par.EdgeThresh1),  # float EdgeThresh0,
+                                          numpy.float32(par.EdgeThresh),  # float EdgeThresh,
+                                          numpy.float32(par.InitSigma),  # float InitSigma,
+                                          self.buffers["counters"].data,  # __global int* counters,
+                                          kpsize32,  # int nb_keypoints,
+                                          *self.scales[octave])  # int width, int height)
+            if self.profile:self.events.append(("local_maxmin_interp %s" % octave, evt))
+            candidates = self.buffers["counters"].get()
+        for scale in range(1, par.Scales + 1):
+                if just_for_spots:
+                    evt = self._kernel("image", "local_max")(self.queue, self.procsize[octave], self.wgsize[octave],
+                                                           self.buffers[(octave, "DoGs")].data,  # __global float* DOGS,
+                                                           self.buffers["Kp_1"].data,  # __global keypoint* output,
+                                                           numpy.int32(par.BorderDist),  # int border_dist,
+                                                           numpy.float32(par.PeakThresh),  # float peak_thresh,
+                                                           numpy.float32(par.InitSigma), 
+                                                           octsize,  # int octsize,
+                                                           self.buffers["cnt"].data,  # __global int* counter,
+                                                           kpsize32,  # int nb_keypoints,
+                                                           numpy.int32(scale),  # int scale,
+                                                           *self.scales[octave])  # int width, int height)
+                    if self.profile:self.events.append(("local_max %s %s" % (octave, scale), evt))
+                    continue
+                else:
+                    # interpolated keypoints of this scale, found by the 3D launch, are appended after the previous ones
+                    nb_candidates = max(0, min(int(candidates[scale - 1]), self.kpsize - int(last_start)))
+                    logger.debug("Keypoints of octave %s scale %s: %s (kept %s)" % (octave, scale, candidates[scale - 1], nb_candidates))
+                    if candidates[scale - 1] > nb_candidates:
+                        logger.warning("%s keypoints of octave %s scale %s discarded: buffer of %s keypoints full, increase PIX_PER_KP"
+                                       % (int(candidates[scale - 1]) - nb_candidates, octave, scale, self.kpsize))
+                    if nb_candidates > 0:
+                        evt = pyopencl.enqueue_copy(self.queue, self.buffers["Kp_1"].data, self.buffers["candidates"].data,
+                                                    byte_count=nb_candidates * 4 * 4,
+                                                    src_offset=(scale - 1) * self.kpsize * 4 * 4,
+                                                    dest_offset=int(last_start) * 4 * 4)
+                        if self.profile:self.events.append(("copy keypoints %s %s" % (octave, scale), evt))
+                newcnt = numpy.int32(last_start + nb_candidates)
+                # the orientation assignment appends the secondary orientations after newcnt
+                self.buffers["cnt"].fill(newcnt, self.queue)
+
+                # recycle buffers G_2 and tmp to store ori and grad
+                ori = self.buffers[(octave, "ori")]
+                grad = self.buffers[(octave, "tmp")]
+                self._replay(launches["gradient"][scale])
+
+    #           Orientation assignement: 1D kernel, rather heavy kernel
+                if newcnt:  # launch kernel only if needed
+                    procsize = calc_size((int(newcnt),), wgsize)
+                    print procsize, wgsize
+                    evt = self._kernel("image", "orientation_assignment")(self.queue, procsize, wgsize,
+                                          self.buffers["Kp_1"].data,  # __global keypoint* keypoints,
+                                          grad.data,  # __global float* grad,
+                                          ori.data,  # __global float* ori,
+                                          self.buffers["cnt"].data,  # __global int* counter,
+                                          octsize,  # int octsize,
+                                          numpy.float32(par.OriSigma),  # float OriSigma, //WARNING: (1.5), it is not "InitSigma (=1.6)"
+                                          kpsize32,  # int max of nb_keypoints,
+                                          numpy.int32(last_start),  # int keypoints_start,
+                                          newcnt,  # int keypoints_end,
+                                          *self.scales[octave])  # int grad_width, int grad_height)
+                    if self.profile:self.events.append(("orientation_assignment %s %s" % (octave, scale), evt))
+#                self.debug_holes("After orientation %s %s" % (octave, scale))
+                kp_end = min(self.buffers["cnt"].get()[0], self.kpsize)
+
+    #           Descriptors: 1D kernel, 128 floats of local memory per work-item
+                if kp_end > last_start:
+                    procsize = calc_size((int(kp_end),), wgsize)
+                    evt = self._kernel("image", "descriptor")(self.queue, procsize, wgsize,
+                                          self.buffers["Kp_1"].data,  # __global keypoint* keypoints,
+                                          self.buffers["descriptors"].data,  # __global unsigned char *descriptors
+                                          pyopencl.LocalMemory(wgsize[0] * 128 * 4),  # __local float* tmp_descriptors,
+                                          grad.data,  # __global float* grad,
+                                          ori.data,  # __global float* ori,
+                                          numpy.int32(last_start),  # int keypoints_start,
+                                          numpy.int32(kp_end),  # int keypoints_end,
+                                          octsize,  # int octsize,
+                                          *self.scales[octave])  # int grad_width, int grad_height)
+                    if self.profile:self.events.append(("descriptors %s %s" % (octave, scale), evt))
+                last_start = kp_end
+        if just_for_spots:
+            # the maxima of all scales are appended on the device, the counter is read once per octave
+            last_start = min(int(self.buffers["cnt"].get()[0]), self.kpsize)
+            self.kp_used = max(self.kp_used, last_start)
+            if self.mask is not None and last_start:
+                self._mask_keypoints(octave, 1, 0, last_start)
+                last_start = self.compact(numpy.int32(0), last_start)
+        self.kp_used = max(self.kp_used, int(last_start))
+        ########################################################################
+        # Rescale all images to populate all octaves TODO: scale G3 -> G'0
+        ########################################################################
+        self._replay(launches["shrink"])
+
+        ########################################################################
+        # Append keypoints and descriptors to the contiguous output, on the device
+        ########################################################################
+        nkp = last_start
+        if offset + nkp > self.output_size:
+            self._grow_output(offset, offset + nkp)
+        if nkp > 0:
+            evt = pyopencl.enqueue_copy(self.queue, self.buffers["output_kp"].data, self.buffers["Kp_1"].data,
+                                        byte_count=int(nkp * 4 * 4), dest_offset=int(offset * 4 * 4))
+            if self.profile:self.events.append(("copy keypoints %s" % octave, evt))
+            if not just_for_spots:
+                evt = pyopencl.enqueue_copy(self.queue, self.buffers["output_desc"].data, self.buffers["descriptors"].data,
+                                            byte_count=int(nkp * 128), dest_offset=int(offset * 128))
+                if self.profile:self.events.append(("copy descriptors %s" % octave, evt))
+        return nkp
+
+    def _grow_output(self, used, size):
+        """
+        Enlarge the contiguous output of all octaves (and its staging) to hold at least size keypoints,
+        keeping the first used ones already gathered
+
+        @param used: number of keypoints already in the output buffers
+        @param size: number of keypoints needed
+        """
+        size = max(int(size), 2 * self.output_size)
+        logger.debug("Growing the output buffers from %s to %s keypoints" % (self.output_size, size))
+        output_kp = pyopencl.array.empty(self.queue, (size, 4), dtype=numpy.float32)
+        # descriptors of spots are never calculated and stay null
+        output_desc = pyopencl.array.zeros(self.queue, (size, 128), dtype=numpy.uint8)
+        if used > 0:
+            evt = pyopencl.enqueue_copy(self.queue, output_kp.data, self.buffers["output_kp"].data, byte_count=int(used * 4 * 4))
+            if self.profile:self.events.append(("grow keypoints", evt))
+            evt = pyopencl.enqueue_copy(self.queue, output_desc.data, self.buffers["output_desc"].data, byte_count=int(used * 128))
+            if self.profile:self.events.append(("grow descriptors", evt))
+        self.buffers["output_kp"] = output_kp
+        self.buffers["output_desc"] = output_desc
+        self.output_size = size
+        if "output_kp" in self.staging:
+            self._map_staging("output_kp", (size, 4), numpy.float32, MF.WRITE_ONLY, pyopencl.map_flags.READ)
+            self._map_staging("output_desc", (size, 128), numpy.uint8, MF.WRITE_ONLY, pyopencl.map_flags.READ)
+
+    def _mask_keypoints(self, octave, spots, start, end):
+        """
+        Discard the candidate keypoints whose neighbourhood contains masked pixels
+
+        @param octave: number of the octave
+        @param spots: 1 if the keypoints come from local_max (coordinates in image pixels), 0 for local_maxmin
+        @param start: index of the first keypoint to check
+        @param end: index after the last keypoint to check
+        """
+        wgsize = (8,)
+        procsize = calc_size((self.kpsize,), wgsize)
+        evt = self._kernel("algebra", "mask_keypoints")(self.queue, procsize, wgsize,
+                        self.buffers["Kp_1"].data,  # __global keypoint* keypoints,
+                        self.buffers[(octave, "valid")].data,  # __global unsigned char* valid,
+                        numpy.int32(spots),  # int spots,
+                        numpy.int32(2 ** octave),  # int octsize,
+                        numpy.int32(start),  # int start_keypoint,
+                        numpy.int32(end),  # int end_keypoint,
+                        *self.scales[octave])  # int width, int height)
+        if self.profile:self.events.append(("mask_keypoints %s" % octave, evt))
+
+    def compact(self, start, end):
+        """
+        Compact the vector of keypoints between start and end, keeping their order (prefix sum):
+        only the active range is read and written, and the new number of keypoints is left in
+        the cnt buffer on the device. The caller provides the end of the range, so the counter
+        is not read on entry; it is read back once after the scatter, as the host needs it to
+        size the copy to the output.
+
+        @param start: start compacting at this adress. Before is kept as it is
+        @type start: numpy.int32
+        @param end: end of the active range, known by the caller
+        @return: number of keypoints after compaction
+        """
+        wgsize = self.compact_wgsize
+        kp_counter = min(int(end), self.kpsize)
+        if kp_counter > 0.9 * self.kpsize:
+               logger.warning("Keypoint counter overflow risk: counted %s / %s" % (kp_counter, self.kpsize))
+        if kp_counter <= start:
+            self.buffers["cnt"].set(numpy.array([start], dtype=numpy.int32))
+            return start
+        start, end = numpy.int32(start), numpy.int32(kp_counter)
+        procsize = calc_size((int(end - start),), wgsize)
+        nb_blocks = numpy.int32(procsize[0] // wgsize[0])
+        local = pyopencl.LocalMemory(4 * wgsize[0])
+        evt = self._kernel("algebra", "compact_scan")(self.queue, procsize, wgsize,
+                        self.buffers["Kp_1"].data,  # __global keypoint* keypoints,
+                        self.buffers["positions"].data,  # __global int* positions,
+                        self.buffers["block_sums"].data,  # __global int* block_sums,
+                        local,  # __local int* ldata,
+                        start,  # int start_keypoint,
+                        end)  # int end_keypoint
+        if self.profile:self.events.append(("compact scan", evt))
+        evt = self._kernel("algebra", "compact_scan_blocks")(self.queue, wgsize, wgsize,
+                        self.buffers["block_sums"].data,  # __global int* block_sums,
+                        nb_blocks,  # int nb_blocks,
+                        self.buffers["cnt"].data,  # __global int* counter,
+                        start,  # int start_keypoint,
+                        local)  # __local int* ldata
+        if self.profile:self.events.append(("compact scan blocks", evt))
+        evt = self._kernel("algebra", "compact_scatter")(self.queue, procsize, wgsize,
+                        self.buffers["Kp_1"].data,  # __global keypoint* keypoints,
+                        self.buffers["Kp_2"].data,  # __global keypoint* output,
+                        self.buffers["positions"].data,  # __global int* positions,
+                        self.buffers["block_sums"].data,  # __global int* block_sums,
+                        start,  # int start_keypoint,
+                        end)  # int end_keypoint
+        if self.profile:self.events.append(("compact scatter", evt))
+        evt = self._kernel("algebra", "compact_copy")(self.queue, procsize, wgsize,
+                        self.buffers["Kp_2"].data,  # __global keypoint* output,
+                        self.buffers["Kp_1"].data,  # __global keypoint* keypoints,
+                        self.buffers["cnt"].data,  # __global int* counter,
+                        start,  # int start_keypoint,
+                        end)  # int end_keypoint
+        if self.profile:self.events.append(("compact copy", evt))
+        newcnt = self.buffers["cnt"].get()[0]
+        logger.debug("Compaction of keypoints %s to %s: %s discarded" % (start, kp_counter, kp_counter - newcnt))
+        return newcnt
+
+
+    def _reset_keypoints(self):
+        """
+        Invalidate the keypoints of the previous octave, only within the range it used, and reset the counter
+        """
+        if self.kp_used:
+            used = pyopencl.array.Array(self.queue, (self.kp_used, 4), dtype=numpy.float32, data=self.buffers["Kp_1"].data)
+            used.fill(-1, self.queue)
+            self.kp_used = 0
+        self.buffers["cnt"].fill(0, self.queue)
+
+    def count_kp(self, output):
+        kpt = 0
+        for octave, data in enumerate(output):
+            if output.shape[0] > 0:
+                sum = (data[:, 1] != -1.0).sum()
+                kpt += sum
+                print("octave %i kp count %i/%i size %s ratio:%s" % (octave, sum, self.kpsize, self.scales[octave], 1000.0 * sum / self.scales[octave][1] / self.scales[octave][0]))
+        print("Found total %i guess %s pixels per keypoint" % (kpt, self.shape[0] * self.shape[1] / kpt))
+    def debug_holes(self, label=""):
+        print("%s %s" % (label, numpy.where(self.buffers["Kp_1"].get()[:, 1] == -1)[0]))
+    def log_profile(self):
+        t=0
+        if self.profile:
+            for e in self.events:
+                if "__len__" in dir(e) and len(e)>=2:
+                    et = 1e-6 * (e[1].profile.end - e[1].profile.start)
+                    print("%50s:\t%.3fms" % (e[0], et))
+                    t+=et
+        print("_"*80)
+        print("%50s:\t%.3fms" % ("Total execution time", t))
+if __name__ == "__main__":
+    # Prepare debugging
+    import scipy.misc
+    lena = scipy.lena()
+    s = SiftPlan(template=lena)
+    s.keypoints(lena)
+
@@ -0,0 +1,1076 @@
+/*
+ *   Project: SIFT: An algorithm for image alignement
+ *            Kernel for image pre-processing: Normalization, ...
+ *
+ *
+ *   Copyright (C) 2013 European Synchrotron Radiation Facility
+ *                           Grenoble, France
+ *   All rights reserved.
+ *
+ *   Principal authors: J. Kieffer (kieffer@esrf.fr)
+ *   Last revision: 30/05/2013
+ *
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ * 1. Redistributions of source code must retain the above copyright
+ *    notice, this list of conditions and the following disclaimer.
+ * 2. Redistributions in binary form must reproduce the above copyright
+ *    notice, this list of conditions and the following disclaimer in the
+ *    documentation and/or other materials provided with the distribution.
+ * 3. Neither the name of the University nor the names of its contributors
+ *    may be used to endorse or promote products derived from this software
+ *    without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE AUTORS AND CONTRIBUTORS ``AS IS'' AND
+ * ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ * IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ * ARE DISCLAIMED.  IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE LIABLE
+ * FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+ * DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+ * OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+ * HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+ * LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+ * OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+ * SUCH DAMAGE.
+ *
+ */
+
+
+//OpenCL extensions are silently defined by opencl compiler at compile-time:
+#ifdef cl_amd_printf
+  #pragma OPENCL EXTENSION cl_amd_printf : enable
+  //#define printf(...)
+#elif defined(cl_intel_printf)
+  #pragma OPENCL EXTENSION cl_intel_printf : enable
+#else
+  #define printf(...)
+#endif
+
+
+#ifdef ENABLE_FP64
+//	#pragma OPENCL EXTENSION cl_khr_fp64 : enable
+	typedef double bigfloat_t;
+#else
+//	#pragma OPENCL EXTENSION cl_khr_fp64 : disable
+	typedef float bigfloat_t;
+#endif
+
+#define GROUP_SIZE BLOCK_SIZE
+
+	#define MAX_CONST_SIZE 16384
+
+#define MIN(i,j) ( (i)<(j) ? (i):(j) )
+#define MAX(i,j) ( (i)<(j) ? (j):(i) )
+
+
+/**
+ * \brief Cast values of an array of uint8 into a float output array.
+ *
+ * @param array_int: 	Pointer to global memory with the input data as unsigned8 array
+ * @param array_float:  Pointer to global memory with the output data as float array
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+__kernel void
+u8_to_float( __global unsigned char  *array_int,
+		     __global float *array_float,
+		     const int IMAGE_W,
+		     const int IMAGE_H
+)
+{
+	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+		array_float[i]=(float)array_int[i];
+}//end kernel
+
+/**
+ * \brief cast values of an array of uint16 into a float output array.
+ *
+ * @param array_int:	Pointer to global memory with the input data as unsigned16 array
+ * @param array_float:  Pointer to global memory with the output data as float array
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+__kernel void
+u16_to_float(__global unsigned short  *array_int,
+		     __global float *array_float,
+		     const int IMAGE_W,
+		     const int IMAGE_H
+)
+{
+	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+		array_float[i]=(float)array_int[i];
+}//end kernel
+
+
+/**
+ * \brief convert values of an array of int32 into a float output array.
+ *
+ * @param array_int:	Pointer to global memory with the data in int
+ * @param array_float:  Pointer to global memory with the data in float
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+__kernel void
+s32_to_float(	__global int  *array_int,
+				__global float  *array_float,
+			     const int IMAGE_W,
+			     const int IMAGE_H
+)
+{
+	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+		array_float[i] = (float)(array_int[i]);
+}//end kernel
+
+/**
+ * \brief convert values of an array of int64 into a float output array.
+ *
+ * @param array_int:	Pointer to global memory with the data in int
+ * @param array_float:  Pointer to global memory with the data in float
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+__kernel void
+s64_to_float(	__global long *array_int,
+				__global float  *array_float,
+			     const int IMAGE_W,
+			     const int IMAGE_H
+)
+{
+	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+		array_float[i] = (float)(array_int[i]);
+}//end kernel
+
+/**
+ * \brief convert values of an array of float64 into a float output array.
+ *
+ * @param array_int:	Pointer to global memory with the data in double
+ * @param array_float:  Pointer to global memory with the data in float
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ *
+ * COMMENTED OUT AS THIS RUNS ONLY ON GPU WITH FP64
+ */
+//__kernel void
+//double_to_float(__global double *array_int,
+//				__global float  *array_float,
+//			     const int IMAGE_W,
+//			     const int IMAGE_H
+//)
+//{
+//	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+//	//Global memory guard for padding
+//	if(i < IMAGE_W*IMAGE_H)
+//		array_float[i] = (float)(array_int[i]);
+//}//end kernel
+
+
+/**
+ * \brief convert RGB of an array of 3xuint8 into a float output array.
+ *
+ * @param array_int:	Pointer to global memory with the data in int
+ * @param array_float:  Pointer to global memory with the data in float
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ *
+ * WARNING: still untested (formula is the same as PIL)
+ */
+__kernel void
+rgb_to_float(	__global unsigned char *array_int,
+				__global float  *array_float,
+			     const int IMAGE_W,
+			     const int IMAGE_H
+)
+{
+	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+		array_float[i] = 0.299f*array_int[3*i] + 0.587f*array_int[3*i+1] + 0.114f*array_int[3*i+2];
+;
+}//end kernel
+
+
+/**
+ * \brief Performs normalization of image between 0 and max_out (255) in place.
+ *
+ *
+ * @param image	    Float pointer to global memory storing the image.
+ * @param min_in: 	Minimum value in the input array
+ * @param max_in: 	Maximum value in the input array
+ * @param max_out: 	Maximum value in the output array (255 adviced)
+ * @param IMAGE_W:	Width of the image
+ * @param IMAGE_H: 	Height of the image
+ *
+**/
+__kernel void
+normalizes(	__global	 	float 	*image,
+			__constant 		float * min_in __attribute__((max_constant_size(MAX_CONST_SIZE))),
+			__constant 		float * max_in __attribute__((max_constant_size(MAX_CONST_SIZE))),
+			__constant 		float * max_out __attribute__((max_constant_size(MAX_CONST_SIZE))),
+			const 			int IMAGE_W,
+			const 			int IMAGE_H
+)
+{
+	float data;
+	int i = get_global_id(0) * IMAGE_W + get_global_id(1);
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+	{
+		data = image[i];
+		image[i] = max_out[0]*(data-min_in[0])/(max_in[0]-min_in[0]);
+	};//end if in IMAGE
+};//end kernel
+
+/**
+ * \brief Reduction of the (min,max) of the pixels handled by a workgroup.
+ *
+ * Called by all threads of the workgroup (of size 2^n),
+ * pixels outside the image contribute with a neutral value.
+ *
+ * @param value:	(min,max) of the pixel handled by the thread
+ * @param ldata:	Pointer to local memory with one float2 per thread of the workgroup
+ * @param partial:	Pointer to global memory with one float2 per workgroup
+ */
+inline void
+workgroup_minmax(	float2 value,
+					__local float2 *ldata,
+					__global float2 *partial
+)
+{
+	int lid = get_local_id(0) * get_local_size(1) + get_local_id(1);
+	ldata[lid] = value;
+	barrier(CLK_LOCAL_MEM_FENCE);
+	for (int stride = get_local_size(0) * get_local_size(1) / 2; stride > 0; stride /= 2)
+	{
+		if (lid < stride)
+		{
+			ldata[lid] = (float2)(fmin(ldata[lid].s0, ldata[lid + stride].s0),
+								  fmax(ldata[lid].s1, ldata[lid + stride].s1));
+		}
+		barrier(CLK_LOCAL_MEM_FENCE);
+	}
+	if (lid == 0)
+		partial[get_group_id(0) * get_num_groups(1) + get_group_id(1)] = ldata[0];
+}
+
+/**
+ * \brief Defines a kernel casting an array of the given type into a float output array
+ * and calculating in the same pass the (min,max) of each workgroup: one read of the raw data.
+ *
+ * @param array_int:	Pointer to global memory with the input data
+ * @param array_float:  Pointer to global memory with the output data as float array
+ * @param partial:		Pointer to global memory with the (min,max) of each workgroup
+ * @param ldata:		Pointer to local memory with one float2 per thread of the workgroup
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+#define CONVERT_MINMAX(name, type)											\
+__kernel void																\
+name(	__global type *array_int,											\
+		__global float *array_float,										\
+		__global float2 *partial,											\
+		__local float2 *ldata,												\
+		const int IMAGE_W,													\
+		const int IMAGE_H													\
+)																			\
+{																			\
+	int gid0 = get_global_id(0);											\
+	int gid1 = get_global_id(1);											\
+	float2 value = (float2)(INFINITY, -INFINITY);							\
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))								\
+	{																		\
+		int i = gid0 * IMAGE_W + gid1;										\
+		float data = (float)array_int[i];									\
+		array_float[i] = data;												\
+		value = (float2)(data, data);										\
+	}																		\
+	workgroup_minmax(value, ldata, partial);								\
+}
+
+CONVERT_MINMAX(u8_to_float_minmax, unsigned char)
+CONVERT_MINMAX(s8_to_float_minmax, char)
+CONVERT_MINMAX(u16_to_float_minmax, unsigned short)
+CONVERT_MINMAX(s16_to_float_minmax, short)
+CONVERT_MINMAX(u32_to_float_minmax, unsigned int)
+CONVERT_MINMAX(s32_to_float_minmax, int)
+CONVERT_MINMAX(s64_to_float_minmax, long)
+#ifdef cl_khr_fp64
+#pragma OPENCL EXTENSION cl_khr_fp64 : enable
+CONVERT_MINMAX(double_to_float_minmax, double)
+#endif
+
+/**
+ * \brief Defines a kernel casting an array of the given type into a float output array, with dark current
+ * subtraction and flat-field correction, and calculating in the same pass the (min,max) of each workgroup.
+ *
+ * output = (input - dark) * gain, the gain being the normalized inverse of the (dark subtracted) flat field,
+ * 0 for dead pixels. Input and output can be the same float buffer (in place correction).
+ *
+ * @param array_int:	Pointer to global memory with the input data
+ * @param array_float:  Pointer to global memory with the output data as float array
+ * @param dark:			Pointer to global memory with the dark current image
+ * @param gain:			Pointer to global memory with the gain image (inverse of the flat field)
+ * @param partial:		Pointer to global memory with the (min,max) of each workgroup
+ * @param ldata:		Pointer to local memory with one float2 per thread of the workgroup
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+#define CORRECT_MINMAX(name, type)											\
+__kernel void																\
+name(	__global type *array_int,											\
+		__global float *array_float,										\
+		__global float *dark,												\
+		__global float *gain,												\
+		__global float2 *partial,											\
+		__local float2 *ldata,												\
+		const int IMAGE_W,													\
+		const int IMAGE_H													\
+)																			\
+{																			\
+	int gid0 = get_global_id(0);											\
+	int gid1 = get_global_id(1);											\
+	float2 value = (float2)(INFINITY, -INFINITY);							\
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))								\
+	{																		\
+		int i = gid0 * IMAGE_W + gid1;										\
+		float data = ((float)array_int[i] - dark[i]) * gain[i];				\
+		array_float[i] = data;												\
+		value = (float2)(data, data);										\
+	}																		\
+	workgroup_minmax(value, ldata, partial);								\
+}
+
+CORRECT_MINMAX(u8_to_float_correct_minmax, unsigned char)
+CORRECT_MINMAX(s8_to_float_correct_minmax, char)
+CORRECT_MINMAX(u16_to_float_correct_minmax, unsigned short)
+CORRECT_MINMAX(s16_to_float_correct_minmax, short)
+CORRECT_MINMAX(u32_to_float_correct_minmax, unsigned int)
+CORRECT_MINMAX(s32_to_float_correct_minmax, int)
+CORRECT_MINMAX(s64_to_float_correct_minmax, long)
+CORRECT_MINMAX(float_to_float_correct_minmax, float)
+#ifdef cl_khr_fp64
+CORRECT_MINMAX(double_to_float_correct_minmax, double)
+#endif
+
+/**
+ * \brief Defines a kernel converting a color image (RGB or RGBA, alpha being ignored) of the given type
+ * into a float output array (same formula as PIL) and calculating in the same pass the (min,max) of each workgroup.
+ *
+ * Channel c of pixel i is read at i*pixel_stride + c*channel_stride:
+ * interleaved RGB: (3, 1), interleaved RGBA: (4, 1), planar: (1, IMAGE_W*IMAGE_H)
+ *
+ * @param array_int:		Pointer to global memory with the input data
+ * @param array_float:  	Pointer to global memory with the output data as float array
+ * @param partial:			Pointer to global memory with the (min,max) of each workgroup
+ * @param ldata:			Pointer to local memory with one float2 per thread of the workgroup
+ * @param pixel_stride:		Distance between two pixels of a channel
+ * @param channel_stride:	Distance between two channels of a pixel
+ * @param IMAGE_W:			Width of the image
+ * @param IMAGE_H: 			Height of the image
+ */
+#define COLOR_MINMAX(name, type)											\
+__kernel void																\
+name(	__global type *array_int,											\
+		__global float *array_float,										\
+		__global float2 *partial,											\
+		__local float2 *ldata,												\
+		const int pixel_stride,												\
+		const int channel_stride,											\
+		const int IMAGE_W,													\
+		const int IMAGE_H													\
+)																			\
+{																			\
+	int gid0 = get_global_id(0);											\
+	int gid1 = get_global_id(1);											\
+	float2 value = (float2)(INFINITY, -INFINITY);							\
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))								\
+	{																		\
+		int i = gid0 * IMAGE_W + gid1;										\
+		int j = i * pixel_stride;											\
+		float data = 0.299f * array_int[j]									\
+					+ 0.587f * array_int[j + channel_stride]				\
+					+ 0.114f * array_int[j + 2 * channel_stride];			\
+		array_float[i] = data;												\
+		value = (float2)(data, data);										\
+	}																		\
+	workgroup_minmax(value, ldata, partial);								\
+}
+
+COLOR_MINMAX(rgb_to_float_minmax, unsigned char)
+COLOR_MINMAX(rgb16_to_float_minmax, unsigned short)
+
+/**
+ * \brief Unpack 12-bit pixels (two pixels in three bytes, least significant bits first as in Mono12p)
+ * into a float output array and calculates in the same pass the (min,max) of each workgroup.
+ *
+ * pixel 2k   = byte[3k]         | (byte[3k+1] & 0xF) << 8
+ * pixel 2k+1 = byte[3k+1] >> 4  | byte[3k+2] << 4
+ *
+ * @param array_int:	Pointer to global memory with the packed bytes
+ * @param array_float:  Pointer to global memory with the data in float
+ * @param partial:		Pointer to global memory with the (min,max) of each workgroup
+ * @param ldata:		Pointer to local memory with one float2 per thread of the workgroup
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H: 		Height of the image
+ */
+__kernel void
+packed12_to_float_minmax(	__global unsigned char *array_int,
+							__global float  *array_float,
+							__global float2 *partial,
+							__local float2 *ldata,
+							const int IMAGE_W,
+							const int IMAGE_H
+)
+{
+	int gid0 = get_global_id(0);
+	int gid1 = get_global_id(1);
+	float2 value = (float2)(INFINITY, -INFINITY);
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		int i = gid0 * IMAGE_W + gid1;
+		int j = 3 * (i >> 1);
+		int pixel;
+		if (i & 1)
+			pixel = (array_int[j + 1] >> 4) | (array_int[j + 2] << 4);
+		else
+			pixel = array_int[j] | ((array_int[j + 1] & 0x0F) << 8);
+		float data = (float) pixel;
+		array_float[i] = data;
+		value = (float2)(data, data);
+	}
+	workgroup_minmax(value, ldata, partial);
+}//end kernel
+
+/**
+ * \brief Calculates the (min,max) of each workgroup of a float image (no conversion needed).
+ *
+ * @param image:	Float pointer to global memory storing the image.
+ * @param partial:	Pointer to global memory with the (min,max) of each workgroup
+ * @param ldata:	Pointer to local memory with one float2 per thread of the workgroup
+ * @param IMAGE_W:	Width of the image
+ * @param IMAGE_H: 	Height of the image
+ */
+__kernel void
+minmax(	const	__global	float	*image,
+				__global	float2	*partial,
+				__local		float2	*ldata,
+		const				int		IMAGE_W,
+		const				int		IMAGE_H
+)
+{
+	int gid0 = get_global_id(0);
+	int gid1 = get_global_id(1);
+	float2 value = (float2)(INFINITY, -INFINITY);
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		float data = image[gid0 * IMAGE_W + gid1];
+		value = (float2)(data, data);
+	}
+	workgroup_minmax(value, ldata, partial);
+}//end kernel
+
+/**
+ * \brief Sets the masked pixels of a float image to zero and calculates the (min,max) of the valid pixels of each workgroup.
+ *
+ * @param image:	Float pointer to global memory storing the image.
+ * @param mask:		Pointer to global memory with the mask (non zero for masked pixels)
+ * @param partial:	Pointer to global memory with the (min,max) of each workgroup
+ * @param ldata:	Pointer to local memory with one float2 per thread of the workgroup
+ * @param IMAGE_W:	Width of the image
+ * @param IMAGE_H: 	Height of the image
+ */
+__kernel void
+mask_minmax(			__global	float			*image,
+				const	__global	unsigned char	*mask,
+						__global	float2			*partial,
+						__local		float2			*ldata,
+				const				int				IMAGE_W,
+				const				int				IMAGE_H
+)
+{
+	int gid0 = get_global_id(0);
+	int gid1 = get_global_id(1);
+	float2 value = (float2)(INFINITY, -INFINITY);
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		int i = gid0 * IMAGE_W + gid1;
+		if (mask[i])
+			image[i] = 0.0f;
+		else
+		{
+			float data = image[i];
+			value = (float2)(data, data);
+		}
+	}
+	workgroup_minmax(value, ldata, partial);
+}//end kernel
+
+/**
+ * \brief Normalized convolution: the blurred image (with masked pixels set to zero) is divided by the blurred
+ * valid pixels, so that masked pixels do not leak into their neighbours, then normalized between 0 and max_out.
+ * Pixels too far from any valid pixel are set to 0.
+ * Values outside [min_in, max_in] (i.e. beyond the percentiles) are not clipped, as in
+ * horizontal_convolution_normalize, where clipping within the first pass of the blur would not be exact.
+ *
+ * @param image	    Float pointer to global memory storing the blurred image.
+ * @param weight	Float pointer to global memory storing the blurred valid pixels (1 far from masked pixels)
+ * @param min_in: 	Minimum value of the valid pixels
+ * @param max_in: 	Maximum value of the valid pixels
+ * @param max_out: 	Maximum value in the output array (255 adviced)
+ * @param IMAGE_W:	Width of the image
+ * @param IMAGE_H: 	Height of the image
+ */
+__kernel void
+normalize_weighted(			__global	float	*image,
+					const	__global	float	*weight,
+					const	__global	float	*min_in,
+					const	__global	float	*max_in,
+					const				float	max_out,
+					const				int		IMAGE_W,
+					const				int		IMAGE_H
+)
+{
+	int gid0 = get_global_id(0);
+	int gid1 = get_global_id(1);
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		int i = gid0 * IMAGE_W + gid1;
+		float w = weight[i];
+		if (w > 0.01f)
+			image[i] = max_out * (image[i] / w - min_in[0]) / (max_in[0] - min_in[0]);
+		else
+			image[i] = 0.0f;
+	}
+}//end kernel
+
+/**
+ * \brief Final reduction of the (min,max) of all workgroups, to be run by a single workgroup (1D, size 2^n).
+ *
+ * @param partial:	Pointer to global memory with the (min,max) of each workgroup
+ * @param size:		Number of workgroups in partial
+ * @param min_out:	Minimum value of the image
+ * @param max_out:	Maximum value of the image
+ * @param ldata:	Pointer to local memory with one float2 per thread of the workgroup
+ */
+__kernel void
+reduce_minmax(	const	__global	float2	*partial,
+				const				int		size,
+						__global	float	*min_out,
+						__global	float	*max_out,
+						__local		float2	*ldata
+)
+{
+	int lid = get_local_id(0);
+	float2 value = (float2)(INFINITY, -INFINITY);
+	for (int i = lid; i < size; i += get_local_size(0))
+	{
+		value = (float2)(fmin(value.s0, partial[i].s0), fmax(value.s1, partial[i].s1));
+	}
+	ldata[lid] = value;
+	barrier(CLK_LOCAL_MEM_FENCE);
+	for (int stride = get_local_size(0) / 2; stride > 0; stride /= 2)
+	{
+		if (lid < stride)
+		{
+			ldata[lid] = (float2)(fmin(ldata[lid].s0, ldata[lid + stride].s0),
+								  fmax(ldata[lid].s1, ldata[lid + stride].s1));
+		}
+		barrier(CLK_LOCAL_MEM_FENCE);
+	}
+	if (lid == 0)
+	{
+		min_out[0] = ldata[0].s0;
+		max_out[0] = ldata[0].s1;
+	}
+}//end kernel
+
+/**
+ * \brief Histogram of the image between its min and max, accumulated in local memory by each workgroup
+ * then merged into the global histogram (which has to be zero before the first call, see percentile_range).
+ *
+ * 2D kernel, pixels outside the image are ignored, as well as masked pixels if a mask is provided.
+ *
+ * @param image:	Float pointer to global memory storing the image
+ * @param mask:		Pointer to global memory with the mask (non zero for masked pixels) or NULL
+ * @param min_in:	Pointer to global memory with the minimum of the image
+ * @param max_in:	Pointer to global memory with the maximum of the image
+ * @param hist:		Pointer to global memory with the histogram (nbins)
+ * @param lhist:	Pointer to local memory with nbins integers
+ * @param nbins:	Number of bins of the histogram
+ * @param IMAGE_W:	Width of the image
+ * @param IMAGE_H: 	Height of the image
+ */
+__kernel void
+histogram(	const	__global	float			*image,
+			const	__global	unsigned char	*mask,
+			const	__global	float			*min_in,
+			const	__global	float			*max_in,
+					__global	unsigned int	*hist,
+					__local		unsigned int	*lhist,
+			const				int				nbins,
+			const				int				IMAGE_W,
+			const				int				IMAGE_H
+)
+{
+	int gid0 = get_global_id(0);
+	int gid1 = get_global_id(1);
+	int lid = get_local_id(0) * get_local_size(1) + get_local_id(1);
+	int lsize = get_local_size(0) * get_local_size(1);
+	float mini = min_in[0];
+	float scale = (max_in[0] > mini) ? nbins / (max_in[0] - mini) : 0.0f;
+
+	for (int i = lid; i < nbins; i += lsize)
+		lhist[i] = 0;
+	barrier(CLK_LOCAL_MEM_FENCE);
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		int i = gid0 * IMAGE_W + gid1;
+		if ((mask == 0) || (mask[i] == 0))
+		{
+			int bin = (int) ((image[i] - mini) * scale);
+			atomic_inc(&lhist[clamp(bin, 0, nbins - 1)]);
+		}
+	}
+	barrier(CLK_LOCAL_MEM_FENCE);
+	for (int i = lid; i < nbins; i += lsize)
+	{
+		if (lhist[i])
+			atomic_add(&hist[i], lhist[i]);
+	}
+}//end kernel
+
+/**
+ * \brief Replaces the (min,max) of the image by the given percentiles, read from its histogram.
+ * The histogram is reset for the next image.
+ *
+ * Single work-item kernel.
+ *
+ * @param hist:		Pointer to global memory with the histogram between min and max (nbins)
+ * @param nbins:	Number of bins of the histogram
+ * @param min_io:	Pointer to global memory with the minimum of the image, replaced by the low percentile
+ * @param max_io:	Pointer to global memory with the maximum of the image, replaced by the high percentile
+ * @param low:		Low percentile, as a fraction (i.e. 0.01)
+ * @param high:		High percentile, as a fraction (i.e. 0.99)
+ */
+__kernel void
+percentile_range(			__global	unsigned int	*hist,
+					const				int				nbins,
+							__global	float			*min_io,
+							__global	float			*max_io,
+					const				float			low,
+					const				float			high
+)
+{
+	if (get_global_id(0) == 0)
+	{
+		float total = 0.0f;
+		for (int i = 0; i < nbins; i++)
+			total += hist[i];
+		float mini = min_io[0];
+		float width = (max_io[0] - mini) / nbins;
+		float cumsum = 0.0f;
+		int low_bin = -1, high_bin = nbins - 1;
+		for (int i = 0; i < nbins; i++)
+		{
+			cumsum += hist[i];
+			hist[i] = 0;
+			if ((low_bin < 0) && (cumsum > low * total))
+				low_bin = i;
+			if (cumsum >= high * total)
+			{
+				high_bin = i;
+				for (int j = i + 1; j < nbins; j++)
+					hist[j] = 0;
+				break;
+			}
+		}
+		if ((width > 0.0f) && (low_bin >= 0) && (high_bin >= low_bin))
+		{
+			min_io[0] = mini + low_bin * width;
+			max_io[0] = mini + (high_bin + 1) * width;
+		}
+	}
+}//end kernel
+
+/**
+ * \brief shrink: Subsampling of the image_in into a smaller image_out.
+ *
+ *
+ * @param image_in	    Float pointer to global memory storing the big image.
+ * @param image_ou	    Float pointer to global memory storing the small image.
+ * @param scale_w: 	Minimum value in the input array
+ * @param scale_h: 	Maximum value in the input array
+ * @param IMAGE_W:	Width of the output image
+ * @param IMAGE_H: 	Height of the output image
+ *
+**/
+__kernel void
+shrink(const __global 	float 	*image_in,
+			__global 	float 	*image_out,
+			const 			int scale_w,
+			const 			int scale_h,
+			const 			int IMAGE_W,
+			const 			int IMAGE_H
+)
+{
+	int gid0=get_global_id(0), gid1=get_global_id(1);
+	int j,i = gid0 * IMAGE_W + gid1;
+	//Global memory guard for padding
+	if(i < IMAGE_W*IMAGE_H)
+	{
+		j = gid0*IMAGE_W*scale_w*scale_h + gid1*scale_w;
+		image_out[i] = image_in[j];
+	};//end if in IMAGE
+};//end kernel
+
+
+/**
+ * \brief bin: resampling of the image_in into a smaller image_out with higher dynamics.
+ *
+ *
+ * @param image_in	    Float pointer to global memory storing the big image.
+ * @param image_ou	    Float pointer to global memory storing the small image.
+ * @param scale_w: 	Minimum value in the input array
+ * @param scale_h: 	Maximum value in the input array
+ * @param binned_width:	Width of the output image
+ * @param IMAGE_H: 	Height of the output image
+ *
+ *Nota: this is a 2D kernel.
+**/
+__kernel void
+bin(		const	__global 	float 	*image_in,
+					__global 	float 	*image_out,
+			const 				int 	scale_width,
+			const 				int 	scale_heigth,
+			const 				int 	orig_width,
+			const 				int 	orig_heigth,
+			const 				int 	binned_width,
+			const 				int 	binned_heigth
+)
+{
+	int gid0=get_global_id(0), gid1=get_global_id(1);
+	int j,i = gid0 * binned_width + gid1;
+	int w, h, size_w, size_h, big_h, big_w;
+	float data=0.0f;
+	//Global memory guard for padding
+	if((gid0 < binned_heigth) && (gid1 < binned_width)){
+		size_h = 0;
+		for (h=0; h<scale_heigth; h++){
+			big_h = gid0 * scale_heigth + h;
+			if (big_h < orig_heigth){
+				size_h += 1;
+				size_w = 0;
+				for (w=0; w<scale_width; w++){
+					big_w = gid1*scale_width + w;
+					if (big_w < orig_width){
+						//j = (gid0 * scale_heigth + h) * (binned_width*scale_width) + (gid1*scale_width + w);
+						size_w += 1;
+						j = big_h * orig_width + big_w;
+						data += image_in[j];
+					}//end test in image horiz
+				};//end for horiz
+			}//end test in image vert
+		};//end for vertical
+		image_out[i] = data/size_h/size_w;
+	};//end if in IMAGE
+};//end kernel
+
+
+/**
+ * \brief upsample2: bilinear interpolation of image_in on a grid twice finer (octave -1, DoubleImSize).
+ *
+ * Pixel (r,c) of the output is interpolated at (r/2,c/2) in the input: even pixels are copied,
+ * odd ones are the average of their neighbours, the last row and column being replicated.
+ *
+ * @param image_in	    Float pointer to global memory storing the small image.
+ * @param image_out	    Float pointer to global memory storing the big image.
+ * @param IN_W:		Width of the input image
+ * @param IN_H: 	Height of the input image
+ * @param IMAGE_W:	Width of the output image
+ * @param IMAGE_H: 	Height of the output image
+ *
+ *Nota: this is a 2D kernel.
+**/
+__kernel void
+upsample2(	const	__global 	float 	*image_in,
+					__global 	float 	*image_out,
+			const 				int 	IN_W,
+			const 				int 	IN_H,
+			const 				int 	IMAGE_W,
+			const 				int 	IMAGE_H
+)
+{
+	int gid0=get_global_id(0), gid1=get_global_id(1);
+	if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		int r0 = MIN(gid0 / 2, IN_H - 1), c0 = MIN(gid1 / 2, IN_W - 1);
+		int r1 = MIN(r0 + (gid0 & 1), IN_H - 1), c1 = MIN(c0 + (gid1 & 1), IN_W - 1);
+		image_out[gid0 * IMAGE_W + gid1] = 0.25f * (image_in[r0 * IN_W + c0] + image_in[r0 * IN_W + c1]
+												  + image_in[r1 * IN_W + c0] + image_in[r1 * IN_W + c1]);
+	};//end if in IMAGE
+};//end kernel
+
+/**
+ * \brief gaussian: Initialize a vector with a gaussian function.
+ *
+ *
+ * @param data:	    Float pointer to global memory storing the vector.
+ * @param sigma:	width of the gaussian
+ * @param size: 	size of the function
+ *
+**/
+
+__kernel void
+gaussian(			__global 	float 	*data,
+			const 				float 	sigma,
+			const 				int 	SIZE
+)
+{
+	int gid=get_global_id(0);
+	if(gid < SIZE){
+		float x = ((float)gid - ((float)SIZE - 1.0f)/2.0f) / sigma;
+        float y = exp(-x * x / 2.0f);
+        data[gid] = y / sigma / sqrt(2.0f * M_PI_F);
+	}
+}
+
+/**
+ * \brief divide_cst: divide a vector by a constant.
+ *
+ *
+ * @param data:	    Float pointer to global memory storing the vector.
+ * @param value:	calc data/value
+ * @param size: 	size of the vector
+ *
+**/
+
+__kernel void
+divide_cst(	__global 	float 	*data,
+			__global	float 	*value,
+			const 		int 	SIZE
+)
+{
+	int gid=get_global_id(0);
+	if(gid < SIZE){
+        data[gid] = data[gid] / value[0];
+	}
+}
+
+/**
+ * \brief project: position in the input image of the pixel (x,y) of the output image.
+ *
+ * The matrix is a 3x3 projective transformation stored in row major order,
+ * it maps output coordinates (x:col, y:row, 1) onto input coordinates.
+ * Affine transformations are simply matrices with m[6]=m[7]=0 and m[8]=1.
+ *
+ * @param matrix:	Float pointer to constant memory with the 9 coefficients
+ * @param x:		column in the output image
+ * @param y:		row in the output image
+ * @return (col, row) in the input image
+**/
+float2
+project(	__constant	float	*matrix,
+			const		float	x,
+			const		float	y
+)
+{
+	float2 pos;
+	float w = matrix[6] * x + matrix[7] * y + matrix[8];
+	if (w == 0.0f)
+		w = 1.0e-10f;
+	pos.s0 = (matrix[0] * x + matrix[1] * y + matrix[2]) / w;
+	pos.s1 = (matrix[3] * x + matrix[4] * y + matrix[5]) / w;
+	return pos;
+}
+
+/**
+ * \brief cubic: Keys' cubic convolution weight (a=-0.5) used by the bicubic interpolation.
+ *
+ * @param x:	distance to the sample
+**/
+float
+cubic(const float x)
+{
+	float ax = fabs(x);
+	if (ax <= 1.0f)
+		return (1.5f * ax - 2.5f) * ax * ax + 1.0f;
+	else if (ax < 2.0f)
+		return ((-0.5f * ax + 2.5f) * ax - 4.0f) * ax + 2.0f;
+	return 0.0f;
+}
+
+/**
+ * \brief store: write (or accumulate) the warped value of a pixel.
+ *
+ * @param image_out:	Float pointer to global memory storing the output image (or the running sum)
+ * @param count:		Float pointer to global memory storing the number of contributions per pixel
+ * @param i:			index of the pixel in the output image
+ * @param value:		interpolated value
+ * @param valid:		1 if the pixel was mapped inside the input image
+ * @param accumulate:	0 to overwrite the output, 1 to add to it
+ * @param fill:			value of the pixels mapped outside the input image (overwrite only)
+**/
+void
+store(	__global	float	*image_out,
+		__global	float	*count,
+		const		int		i,
+		const		float	value,
+		const		int		valid,
+		const		int		accumulate,
+		const		float	fill
+)
+{
+	if (accumulate)
+	{
+		if (valid)
+		{
+			image_out[i] += value;
+			count[i] += 1.0f;
+		}
+	}
+	else
+	{
+		image_out[i] = (valid) ? value : fill;
+		count[i] = (valid) ? 1.0f : 0.0f;
+	}
+}
+
+/**
+ * \brief transform_bilinear: warp an image with an affine or projective transformation
+ *  using bilinear interpolation.
+ *
+ * @param image_in:		Float pointer to global memory storing the input image.
+ * @param image_out:	Float pointer to global memory storing the warped image (or the running sum).
+ * @param count:		Float pointer to global memory storing the number of contributions per pixel.
+ * @param matrix:		3x3 matrix mapping output coordinates (x,y,1) to input coordinates.
+ * @param accumulate:	0 to overwrite the output, 1 to add the warped frame to it
+ * @param fill:			value of the pixels mapped outside the input image (overwrite only)
+ * @param in_width:		Width of the input image
+ * @param in_height:	Height of the input image
+ * @param out_width:	Width of the output image
+ * @param out_height:	Height of the output image
+ *
+ *Nota: this is a 2D kernel.
+**/
+__kernel void
+transform_bilinear(	const	__global	float	*image_in,
+							__global	float	*image_out,
+							__global	float	*count,
+							__constant	float	*matrix __attribute__((max_constant_size(MAX_CONST_SIZE))),
+					const				int		accumulate,
+					const				float	fill,
+					const				int		in_width,
+					const				int		in_height,
+					const				int		out_width,
+					const				int		out_height
+)
+{
+	int gid0=get_global_id(0), gid1=get_global_id(1);
+	//Global memory guard for padding
+	if((gid0 < out_height) && (gid1 < out_width))
+	{
+		int i = gid0 * out_width + gid1;
+		float2 pos = project(matrix, (float) gid1, (float) gid0);
+		int valid = (pos.s0 >= 0.0f) && (pos.s0 <= in_width - 1.0f) && (pos.s1 >= 0.0f) && (pos.s1 <= in_height - 1.0f);
+		float value = 0.0f;
+		if (valid)
+		{
+			int c0 = (int) floor(pos.s0), r0 = (int) floor(pos.s1);
+			int c1 = MIN(c0 + 1, in_width - 1), r1 = MIN(r0 + 1, in_height - 1);
+			float dc = pos.s0 - c0, dr = pos.s1 - r0;
+			value = (1.0f - dr) * ((1.0f - dc) * image_in[r0 * in_width + c0] + dc * image_in[r0 * in_width + c1])
+						 + dr * ((1.0f - dc) * image_in[r1 * in_width + c0] + dc * image_in[r1 * in_width + c1]);
+		}
+		store(image_out, count, i, value, valid, accumulate, fill);
+	};//end if in IMAGE
+};//end kernel
+
+/**
+ * \brief transform_bicubic: warp an image with an affine or projective transformation
+ *  using bicubic interpolation (Keys' kernel, borders are clamped).
+ *
+ * Same parameters as transform_bilinear.
+ *
+ *Nota: this is a 2D kernel.
+**/
+__kernel void
+transform_bicubic(	const	__global	float	*image_in,
+							__global	float	*image_out,
+							__global	float	*count,
+							__constant	float	*matrix __attribute__((max_constant_size(MAX_CONST_SIZE))),
+					const				int		accumulate,
+					const				float	fill,
+					const				int		in_width,
+					const				int		in_height,
+					const				int		out_width,
+					const				int		out_height
+)
+{
+	int gid0=get_global_id(0), gid1=get_global_id(1);
+	//Global memory guard for padding
+	if((gid0 < out_height) && (gid1 < out_width))
+	{
+		int i = gid0 * out_width + gid1;
+		float2 pos = project(matrix, (float) gid1, (float) gid0);
+		int valid = (pos.s0 >= 0.0f) && (pos.s0 <= in_width - 1.0f) && (pos.s1 >= 0.0f) && (pos.s1 <= in_height - 1.0f);
+		float value = 0.0f;
+		if (valid)
+		{
+			int c0 = (int) floor(pos.s0), r0 = (int) floor(pos.s1);
+			float dc = pos.s0 - c0, dr = pos.s1 - r0;
+			int r, c, rr, cc;
+			float wr, row;
+			for (r=-1; r<=2; r++)
+			{
+				rr = MIN(MAX(r0 + r, 0), in_height - 1);
+				wr = cubic(dr - r);
+				row = 0.0f;
+				for (c=-1; c<=2; c++)
+				{
+					cc = MIN(MAX(c0 + c, 0), in_width - 1);
+					row += cubic(dc - c) * image_in[rr * in_width + cc];
+				}
+				value += wr * row;
+			}
+		}
+		store(image_out, count, i, value, valid, accumulate, fill);
+	};//end if in IMAGE
+};//end kernel
+
+/**
+ * \brief average: divide the running sum of warped frames by the number of contributions.
+ *
+ * @param image_sum:	Float pointer to global memory storing the accumulated frames
+ * @param count:		Float pointer to global memory storing the number of contributions per pixel
+ * @param image_out:	Float pointer to global memory storing the average image
+ * @param fill:			value of the pixels which never received any contribution
+ * @param IMAGE_W:		Width of the image
+ * @param IMAGE_H:		Height of the image
+**/
+__kernel void
+average(	const	__global	float	*image_sum,
+			const	__global	float	*count,
+					__global	float	*image_out,
+			const				float	fill,
+			const				int		IMAGE_W,
+			const				int		IMAGE_H
+)
+{
+	int gid0=get_global_id(0), gid1=get_global_id(1);
+	//Global memory guard for padding
+	if((gid0 < IMAGE_H) && (gid1 < IMAGE_W))
+	{
+		int i = gid0 * IMAGE_W + gid1;
+		float cnt = count[i];
+		image_out[i] = (cnt > 0.0f) ? image_sum[i] / cnt : fill;
+	};//end if in IMAGE
+};//end kernel
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a long-running server keeping warm plans, serving keypoints over a Unix socket,
+the images being exchanged through shared memory
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, threading, json, collections
+import SocketServer
+import numpy
+from .client import SHM_DIR, HEADER
+logger = logging.getLogger("sift.server")
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """
+    One connection: one JSON request per line, answered by a binary header followed by the keypoints
+    """
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line.decode("ascii"))
+                kp = self.server.process(request)
+            except Exception as error:
+                logger.error("Error while processing %s: %s" % (line.strip(), error))
+                message = str(error).encode("utf-8")
+                self.wfile.write(HEADER.pack(-1, len(message)) + message)
+            else:
+                self.wfile.write(HEADER.pack(0, kp.shape[0]))
+                self.wfile.write(numpy.ascontiguousarray(kp).data)
+            self.wfile.flush()
+
+
+class SiftServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Daemon keeping warm plans (compiled kernels, allocated buffers), one pool per image geometry:
+
+    server = sift.SiftServer("/tmp/sift.sock", devicetype="GPU")
+    server.serve_forever()
+
+    Clients (SiftClient) write the image in a shared memory file (/dev/shm) and only send its name,
+    shape and dtype through the socket; the keypoints come back as raw record arrays (dtype_kp).
+    Only the sift_* files of SHM_DIR are read, within their size.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, path, pool_size=2, max_pools=4, **kwargs):
+        """
+        Contructor of the class
+
+        @param path: filename of the Unix socket
+        @param pool_size: number of concurrent requests processed per geometry
+        @param max_pools: maximum number of geometries kept warm, the plans of the least recently used one
+                          being released beyond
+        @param kwargs: parameters of the SiftPlan (devicetype, device, ...)
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        self.path = path
+        self.pool_size = pool_size
+        self.max_pools = max(1, int(max_pools))
+        self.kwargs = kwargs
+        self.pools = collections.OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+        self._building = {}  # one lock per geometry whose plans are being built
+        SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+
+    def get_pool(self, shape, dtype):
+        """
+        @return: the pool of plans for a given geometry, created on first use
+        """
+        from .pool import SiftPool  # OpenCL is only initialised by the first request
+        key = (tuple(shape), numpy.dtype(dtype).str)
+        with self._lock:
+            pool = self.pools.pop(key, None)
+            if pool is not None:
+                self.pools[key] = pool
+                return pool
+            building = self._building.setdefault(key, threading.Lock())
+        # the plans are built outside of the server lock: requests for the other geometries are not delayed,
+        # those for this geometry wait for a single build
+        with building:
+            with self._lock:
+                pool = self.pools.get(key)
+            if pool is None:
+                logger.info("Creating plans for shape %s and dtype %s" % key)
+                pool = SiftPool(shape=key[0], dtype=dtype, size=self.pool_size, **self.kwargs)
+            with self._lock:
+                self._building.pop(key, None)
+                self.pools.pop(key, None)
+                self.pools[key] = pool
+                while len(self.pools) > self.max_pools:
+                    # requests being processed keep their own reference to the pool
+                    old = self.pools.popitem(last=False)[0]
+                    logger.info("Releasing plans for shape %s and dtype %s" % old)
+        return pool
+
+    def process(self, request):
+        """
+        @param request: dict with the shm filename, the shape, the dtype and the offset of the image
+        @return: record array of keypoints
+        """
+        shape = tuple(int(i) for i in request["shape"])
+        dtype = numpy.dtype(str(request["dtype"]))
+        filename = os.path.realpath(request["shm"])
+        if (os.path.dirname(filename) != os.path.realpath(SHM_DIR)) or not os.path.basename(filename).startswith("sift_"):
+            raise RuntimeError("Shared memory file %s is not a sift_* file of %s" % (request["shm"], SHM_DIR))
+        if dtype.hasobject or not shape or min(shape) <= 0:
+            raise RuntimeError("Invalid image of shape %s and dtype %s" % (shape, dtype))
+        offset = int(request.get("offset", 0))
+        nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        if offset < 0 or offset + nbytes > os.path.getsize(filename):
+            raise RuntimeError("Image of %s bytes at offset %s does not fit in %s" % (nbytes, offset, request["shm"]))
+        image = numpy.memmap(filename, dtype=dtype, mode="r", shape=shape, offset=offset)
+        return self.get_pool(shape, dtype).keypoints(numpy.ascontiguousarray(image))
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,2 @@
+
+from .param import par
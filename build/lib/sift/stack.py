@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a reader for large stacks of images (raw or .npy files) accessed through memory mapping,
+with a background thread prefetching the next frames
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-20"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, threading
+import Queue
+import numpy
+logger = logging.getLogger("sift.stack")
+
+
+def _fill(frames, free, ready, stop):
+    """
+    Prefetching thread: copy the frames into the free slots
+    """
+    index = None
+    try:
+        for index, frame in frames:
+            slot = free.get()
+            if stop.is_set():
+                break
+            slot[...] = frame
+            ready.put((index, slot))
+    except Exception as error:
+        logger.error("Error while reading frame after %s: %s" % (index, error))
+        ready.put((None, error))
+    ready.put((None, None))
+
+
+def prefetch(frames, slots):
+    """
+    Read (and decode) frames in a background thread, copying them into a ring of pre-allocated slots
+
+    The yielded arrays are recycled: they are only valid until the next iteration.
+
+    @param frames: iterable of (index, frame)
+    @param slots: list of at least 2 arrays receiving the frames (i.e. page-locked input buffers of a SiftPlan)
+    @return: generator of (index, slot)
+    """
+    free = Queue.Queue()
+    ready = Queue.Queue()
+    for slot in slots:
+        free.put(slot)
+    finished = threading.Event()
+    thread = threading.Thread(target=_fill, name="prefetch", args=(iter(frames), free, ready, finished))
+    thread.daemon = True
+    thread.start()
+    last = None
+    try:
+        while True:
+            index, slot = ready.get()
+            if index is None:
+                if slot is not None:
+                    raise slot
+                break
+            if last is not None:
+                free.put(last)
+            last = slot
+            yield index, slot
+    finally:
+        finished.set()
+        free.put(last)
+        thread.join()
+
+
+class StackReader(object):
+    """
+    Access a stack of frames on disk without loading it in memory:
+
+    stack = sift.StackReader("stack.npy")
+    stack = sift.StackReader("stack.raw", shape=(1000, 2048, 2048), dtype="uint16", offset=1024)
+    frame = stack[i]  # memory mapped, read from disk on access
+
+    Frames can be prefetched by a background thread into the page-locked input buffers of a SiftPlan,
+    so that disk reads, transfers and calculation overlap while the host memory remains constant:
+
+    for index, frame in stack.prefetch(siftp, depth=2):
+        kp = siftp.keypoints(frame)
+    """
+    def __init__(self, source, shape=None, dtype=None, offset=0, order="C"):
+        """
+        Contructor of the class
+
+        @param source: filename of a .npy or raw file, or a numpy array (possibly a memmap) of frames
+        @param shape: shape of the stack (nframes, height, width[, 3]) for raw files, the number of frames
+                      can be None (or -1) to be deduced from the size of the file
+        @param dtype: data type of the pixels for raw files
+        @param offset: size of the header in bytes for raw files
+        """
+        self.filename = None
+        if isinstance(source, numpy.ndarray):
+            self.data = source
+        elif os.path.splitext(source)[1].lower() == ".npy":
+            self.filename = source
+            self.data = numpy.load(source, mmap_mode="r")
+        else:
+            if shape is None or dtype is None:
+                raise RuntimeError("Shape and dtype are needed to read the raw file %s" % source)
+            self.filename = source
+            dtype = numpy.dtype(dtype)
+            shape = tuple(shape)
+            if shape[0] is None or shape[0] < 0:
+                frame_size = int(numpy.prod(shape[1:])) * dtype.itemsize
+                shape = ((os.path.getsize(source) - offset) // frame_size,) + shape[1:]
+            self.data = numpy.memmap(source, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+        if self.data.ndim not in (3, 4):
+            raise RuntimeError("Unable to read a stack of shape %s" % (self.data.shape,))
+        self.shape = self.data.shape[1:]
+        self.dtype = self.data.dtype
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.data[index]
+
+    def prefetch(self, plan=None, depth=2, start=0, stop=None, step=1):
+        """
+        Iterate over the frames, read in advance by a background thread.
+
+        The yielded arrays are recycled: they are only valid until the next iteration.
+
+        @param plan: SiftPlan whose page-locked input buffers receive the frames (plain arrays if None)
+        @param depth: number of frames read in advance
+        @return: generator of (index, frame)
+        """
+        depth = max(1, int(depth))
+        if plan is not None:
+            slots = [plan.input_buffer(slot) for slot in range(depth + 1)]
+        else:
+            slots = [numpy.empty(self.shape, dtype=self.dtype) for slot in range(depth + 1)]
+        indexes = range(*slice(start, stop, step).indices(len(self)))
+        return prefetch(((index, self.data[index]) for index in indexes), slots)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a worker thread executing the requests submitted to a plan, returning futures
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-21"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import logging, threading
+import Queue
+logger = logging.getLogger("sift.worker")
+try:
+    from concurrent.futures import Future
+except ImportError:
+    Future = None
+
+
+class SimpleFuture(object):
+    """
+    Minimal replacement for concurrent.futures.Future when the futures package is not installed
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout) and not self._event.is_set():
+            raise RuntimeError("Timeout while waiting for the result")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        self._event.wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, function):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(function)
+                return
+        function(self)
+
+    def set_running_or_notify_cancel(self):
+        return True
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for function in callbacks:
+            function(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+if Future is None:
+    Future = SimpleFuture
+
+
+class Worker(object):
+    """
+    Execute the requests in order in a background thread, the caller only gets a future:
+
+    worker = Worker()
+    future = worker.submit(siftp.keypoints, img)
+    ...
+    kp = future.result()
+
+    All blocking calls (OpenCL events, transfers) happen in the worker thread. With asyncio (python3):
+
+    kp = await asyncio.wrap_future(future)
+    """
+    def __init__(self, name="sift"):
+        self.name = name
+        self.requests = Queue.Queue()
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a request, any number of requests can be outstanding
+
+        @return: future holding the result of function(*args, **kwargs)
+        """
+        future = Future()
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+        self.requests.put((future, function, args, kwargs))
+        return future
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            future, function, args, kwargs = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                logger.error("Error in %s: %s" % (function.__name__, error))
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stop(self):
+        """
+        Stop the worker thread once all queued requests are processed
+        """
+        with self._lock:
+            if self.thread is not None:
+                self.requests.put(None)
+                if self.thread is not threading.current_thread():
+                    self.thread.join()
+                self.thread = None
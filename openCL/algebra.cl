@@ -87,15 +87,235 @@ __kernel void compact(
 
 
 
+/**
+ * \brief Work-efficient (Blelloch) exclusive prefix sum within a workgroup (size 2^n).
+ *
+ * Called by all threads of the workgroup.
+ *
+ * @param value: value of the thread
+ * @param ldata: Pointer to local memory with one int per thread of the workgroup
+ * @param total: set to the sum of the values of the workgroup
+ * @return: sum of the values of the threads before this one
+ */
+inline int workgroup_exclusive_scan(int value, __local int* ldata, int* total)
+{
+	int lid = (int) get_local_id(0);
+	int lsize = (int) get_local_size(0);
+	ldata[lid] = value;
+	// up-sweep: partial sums in place
+	for (int offset = 1; offset < lsize; offset *= 2) {
+		barrier(CLK_LOCAL_MEM_FENCE);
+		int ai = (lid + 1) * 2 * offset - 1;
+		if (ai < lsize)
+			ldata[ai] += ldata[ai - offset];
+	}
+	barrier(CLK_LOCAL_MEM_FENCE);
+	*total = ldata[lsize - 1];
+	barrier(CLK_LOCAL_MEM_FENCE);
+	if (lid == 0)
+		ldata[lsize - 1] = 0;
+	// down-sweep
+	for (int offset = lsize / 2; offset > 0; offset /= 2) {
+		barrier(CLK_LOCAL_MEM_FENCE);
+		int ai = (lid + 1) * 2 * offset - 1;
+		if (ai < lsize) {
+			int t = ldata[ai - offset];
+			ldata[ai - offset] = ldata[ai];
+			ldata[ai] += t;
+		}
+	}
+	barrier(CLK_LOCAL_MEM_FENCE);
+	int result = ldata[lid];
+	barrier(CLK_LOCAL_MEM_FENCE);
+	return result;
+}
+
+
+/**
+ * \brief Stream compaction of the keypoints, first pass: position of each valid keypoint within its workgroup.
+ *
+ * The compaction by prefix sum keeps the order of the keypoints (deterministic output)
+ * and only touches the active range [start_keypoint, end_keypoint):
+ *	compact_scan -> compact_scan_blocks -> compact_scatter -> compact_copy
+ * all launched with the same workgroup size, on end_keypoint - start_keypoint work-items.
+ *
+ * @param keypoints: Pointer to global memory with the keypoints
+ * @param positions: Pointer to global memory with the position of each keypoint in its workgroup, -1 if invalid
+ * @param block_sums: Pointer to global memory with the number of valid keypoints of each workgroup
+ * @param ldata: Pointer to local memory with one int per thread of the workgroup
+ * @param start_keypoint: index of the first keypoint to compact, the previous ones are kept as they are
+ * @param end_keypoint: index after the last keypoint to compact
+ */
+__kernel void compact_scan(
+	__global keypoint* keypoints,
+	__global int* positions,
+	__global int* block_sums,
+	__local int* ldata,
+	int start_keypoint,
+	int end_keypoint)
+{
+	int i = start_keypoint + (int) get_global_id(0);
+	int valid = ((i < end_keypoint) && (keypoints[i].s1 != -1.0f)) ? 1 : 0;
+	int total;
+	int position = workgroup_exclusive_scan(valid, ldata, &total);
+	if (i < end_keypoint)
+		positions[i] = valid ? position : -1;
+	if (get_local_id(0) == 0)
+		block_sums[get_group_id(0)] = total;
+}
 
 
+/**
+ * \brief Stream compaction of the keypoints, second pass: offset of each workgroup in the output
+ * (exclusive prefix sum of the block sums, in place) and new number of keypoints, left in the counter
+ * on the device for the next kernels.
+ *
+ * Single workgroup.
+ *
+ * @param block_sums: Pointer to global memory with the number of valid keypoints of each workgroup
+ * @param nb_blocks: number of workgroups of the first pass
+ * @param counter: Pointer to global memory with the keypoint counter, set to start_keypoint + valid keypoints
+ * @param start_keypoint: index of the first compacted keypoint
+ * @param ldata: Pointer to local memory with one int per thread of the workgroup
+ */
+__kernel void compact_scan_blocks(
+	__global int* block_sums,
+	int nb_blocks,
+	__global int* counter,
+	int start_keypoint,
+	__local int* ldata)
+{
+	int lid = (int) get_local_id(0);
+	int carry = 0;
+	for (int base = 0; base < nb_blocks; base += get_local_size(0)) {
+		int i = base + lid;
+		int total;
+		int offset = workgroup_exclusive_scan((i < nb_blocks) ? block_sums[i] : 0, ldata, &total);
+		if (i < nb_blocks)
+			block_sums[i] = carry + offset;
+		carry += total;
+	}
+	if (lid == 0)
+		counter[0] = start_keypoint + carry;
+}
+
+
+/**
+ * \brief Stream compaction of the keypoints, third pass: valid keypoints are written at their final position.
+ *
+ * @param keypoints: Pointer to global memory with the keypoints
+ * @param output: Pointer to global memory with the compacted keypoints (from start_keypoint)
+ * @param positions: Pointer to global memory with the positions calculated by compact_scan
+ * @param block_sums: Pointer to global memory with the offsets calculated by compact_scan_blocks
+ * @param start_keypoint: index of the first keypoint to compact
+ * @param end_keypoint: index after the last keypoint to compact
+ */
+__kernel void compact_scatter(
+	__global keypoint* keypoints,
+	__global keypoint* output,
+	__global int* positions,
+	__global int* block_sums,
+	int start_keypoint,
+	int end_keypoint)
+{
+	int i = start_keypoint + (int) get_global_id(0);
+	if ((i < end_keypoint) && (positions[i] >= 0))
+		output[start_keypoint + block_sums[get_group_id(0)] + positions[i]] = keypoints[i];
+}
+
 
+/**
+ * \brief Stream compaction of the keypoints, last pass: the compacted keypoints are copied back,
+ * the end of the active range being reset to (-1,-1,-1,-1).
+ *
+ * @param output: Pointer to global memory with the compacted keypoints
+ * @param keypoints: Pointer to global memory with the keypoints
+ * @param counter: Pointer to global memory with the number of keypoints after compaction
+ * @param start_keypoint: index of the first compacted keypoint
+ * @param end_keypoint: index after the last keypoint of the active range
+ */
+__kernel void compact_copy(
+	__global keypoint* output,
+	__global keypoint* keypoints,
+	__global int* counter,
+	int start_keypoint,
+	int end_keypoint)
+{
+	int i = start_keypoint + (int) get_global_id(0);
+	if (i < end_keypoint)
+		keypoints[i] = (i < counter[0]) ? output[i] : (keypoint) (-1.0f, -1.0f, -1.0f, -1.0f);
+}
 
 
 
 
+/**
+ * \brief Rescale the coordinates and scale of keypoints (x:col,y:row,sigma,angle), the angle being kept.
+ *		Used to bring back the keypoints found on the resampled image (binning, DoubleImSize)
+ *		to the pixels of the input image.
+ *
+ * @param keypoints: Pointer to global memory with the keypoints
+ * @param scale_x: multiplicative factor for x
+ * @param scale_y: multiplicative factor for y
+ * @param offset_x: added to x after scaling
+ * @param offset_y: added to y after scaling
+ * @param end_keypoint: index of last keypoints
+ *
+ *	sigma is multiplied by sqrt(scale_x*scale_y)
+ */
 
+__kernel void rescale_keypoints(
+	__global keypoint* keypoints,
+	float scale_x,
+	float scale_y,
+	float offset_x,
+	float offset_y,
+	int end_keypoint)
+{
+	int gid0 = (int) get_global_id(0);
+	if (gid0 < end_keypoint) {
+		keypoint k = keypoints[gid0];
+		keypoints[gid0] = (keypoint)(k.s0 * scale_x + offset_x, k.s1 * scale_y + offset_y,
+									 k.s2 * sqrt(scale_x * scale_y), k.s3);
+	}
+}
 
 
 
+/**
+ * \brief Invalidates the keypoints lying on masked pixels, before refinement, orientation and descriptors:
+ *		they are set to (-1,-1,-1,-1) and removed by compact.
+ *
+ * @param keypoints: Pointer to global memory with the keypoints, either as output by local_maxmin (peak,r,c,scale)
+ *					or by local_max (x*octsize,y*octsize,sigma,-1)
+ * @param valid: Pointer to global memory with the valid pixels of the octave (non zero)
+ * @param spots: 0 for the output of local_maxmin, 1 for the output of local_max
+ * @param octsize: initially 1 then twiced at each octave
+ * @param start_keypoint: index of the first keypoint to check
+ * @param end_keypoint: index of last keypoints
+ * @param width: integer number of columns of the octave
+ * @param height: integer number of lines of the octave
+ *
+ */
 
+__kernel void mask_keypoints(
+	__global keypoint* keypoints,
+	__global unsigned char* valid,
+	int spots,
+	int octsize,
+	int start_keypoint,
+	int end_keypoint,
+	int width,
+	int height)
+{
+	int gid0 = (int) get_global_id(0);
+	if ((gid0 >= start_keypoint) && (gid0 < end_keypoint)) {
+		keypoint k = keypoints[gid0];
+		if (k.s1 != -1) {
+			int r = (spots ? (int) (k.s1 / octsize) : (int) k.s1);
+			int c = (spots ? (int) (k.s0 / octsize) : (int) k.s2);
+			if ((r < 0) || (r >= height) || (c < 0) || (c >= width) || (valid[r * width + c] == 0))
+				keypoints[gid0] = (keypoint) (-1.0f, -1.0f, -1.0f, -1.0f);
+		}
+	}
+}
@@ -58,6 +58,53 @@ __kernel void horizontal_convolution(
 
 
 
+/*
+	Same as horizontal_convolution, the input image being normalized between 0 and max_out on the fly:
+	as the filter is normalized (sum=1), normalizing the blurred image is the same as blurring
+	the normalized image, which saves a full pass over the image.
+*/
+__kernel void horizontal_convolution_normalize(
+	const __global float * input, 
+	__global float * output,
+	__constant float * filter __attribute__((max_constant_size(MAX_CONST_SIZE))),
+	int FILTER_SIZE,
+	const __global float * min_in,
+	const __global float * max_in,
+	float max_out,
+	int IMAGE_W,
+	int IMAGE_H
+)
+{
+	int gid1 = (int) get_global_id(1);
+	int gid0 = (int) get_global_id(0);
+	
+	int HALF_FILTER_SIZE = (FILTER_SIZE % 2 == 1 ? (FILTER_SIZE)/2 : (FILTER_SIZE+1)/2);
+	
+	if (gid0 < IMAGE_H && gid1 < IMAGE_W) {
+		
+		int pos = gid0* IMAGE_W + gid1;
+		int fIndex = 0;
+		float sum = 0.0f;
+		int c = 0;
+		int newpos = 0;
+		
+		for (c = -HALF_FILTER_SIZE ; c < FILTER_SIZE-HALF_FILTER_SIZE ; c++) {
+			newpos = pos + c;
+			if (gid1 + c < 0) {
+				newpos= pos - 2*gid1 - c - 1;
+			}
+			else if (gid1 + c > IMAGE_W -1 ) {
+				newpos= (gid0+2)*IMAGE_W - gid1 -c -1;
+			}
+			sum += input[ newpos ] * filter[ fIndex  ];
+			fIndex += 1;
+		}
+		output[pos] = max_out * (sum - min_in[0]) / (max_in[0] - min_in[0]);
+	}
+}
+
+
+
 
 
 
@@ -215,6 +215,117 @@ __kernel void local_maxmin(
 
 
 
+/**
+ * \brief Stage the three DoG planes (scale-1, scale, scale+1) of the tile of the workgroup,
+ *   with a one pixel apron clamped to the image, and test if the current pixel is a local extremum
+ *   not lying on an edge (same test as local_maxmin). Helper of local_maxmin_interp (3D launch).
+ *
+ * @param DOGS: Pointer to global memory with ALL the coutiguously pre-allocated Differences of Gaussians
+ * @param tile: Pointer to local memory with 3*(local_size0+2)*(local_size1+2) floats
+ * @param scale: the DoG to test, its two neighbours being staged as well
+ * @param border_dist: integer, distance between inner image and borders (SIFT takes 5)
+ * @param peak_thresh: float, threshold (SIFT takes 255.0 * 0.04 / 3.0)
+ * @param octsize: initially 1 then twiced at each new octave
+ * @param EdgeThresh0: initial upper limit of the curvatures ratio, to test if the point is on an edge
+ * @param EdgeThresh: upper limit of the curvatures ratio, to test if the point is on an edge
+ * @param width: integer number of columns of a DOG.
+ * @param height: integer number of lines of a DOG
+ * @return: the value of the DoG if the pixel is a good candidate, 0.0 otherwise
+ */
+inline float tile_extremum(
+	__global float* DOGS,
+	__local float* tile,
+	int scale,
+	int border_dist,
+	float peak_thresh,
+	int octsize,
+	float EdgeThresh0,
+	float EdgeThresh,
+	int width,
+	int height)
+{
+	int gid0 = (int) get_global_id(0);
+	int gid1 = (int) get_global_id(1);
+	int lid0 = (int) get_local_id(0);
+	int lid1 = (int) get_local_id(1);
+	int tile_h = (int) get_local_size(0) + 2;
+	int tile_w = (int) get_local_size(1) + 2;
+	int row0 = (int) (get_group_id(0) * get_local_size(0)) - 1;
+	int col0 = (int) (get_group_id(1) * get_local_size(1)) - 1;
+	int lid = lid0 * get_local_size(1) + lid1;
+	int plane = tile_h * tile_w;
+
+	for (int i = lid; i < 3 * plane; i += get_local_size(0) * get_local_size(1)) {
+		int s = i / plane;
+		int r = clamp(row0 + (i % plane) / tile_w, 0, height - 1);
+		int c = clamp(col0 + (i % tile_w), 0, width - 1);
+		tile[i] = DOGS[(scale - 1 + s) * width * height + r * width + c];
+	}
+	barrier(CLK_LOCAL_MEM_FENCE);
+
+	float res = 0.0f;
+	int t = plane + (lid0 + 1) * tile_w + lid1 + 1; // current pixel in the tile
+	float val = tile[t];
+	if ((gid0 < height - border_dist) && (gid1 < width - border_dist) && (gid0 >= border_dist) && (gid1 >= border_dist)
+		&& (fabs(val) > (0.8 * peak_thresh))) {
+		int ismax = 0, ismin = 0;
+		if (val > 0.0) ismax = 1;
+		else ismin = 1;
+		for (int dr = -1; dr <= 1; dr++) {
+			for (int dc = -1; dc <= 1; dc++) {
+				int pos = t + dr * tile_w + dc;
+				if (ismax == 1)
+					if (tile[pos - plane] > val || tile[pos] > val || tile[pos + plane] > val) ismax = 0;
+				if (ismin == 1)
+					if (tile[pos - plane] < val || tile[pos] < val || tile[pos + plane] < val) ismin = 0;
+			}
+		}
+		if (ismax == 1 || ismin == 1) {
+			res = val;
+			float H00 = tile[t - tile_w] - 2.0 * tile[t] + tile[t + tile_w],
+			H11 = tile[t - 1] - 2.0 * tile[t] + tile[t + 1],
+			H01 = ((tile[t + tile_w + 1] - tile[t + tile_w - 1]) - (tile[t - tile_w + 1] - tile[t - tile_w - 1])) / 4.0;
+			float det = H00 * H11 - H01 * H01, trace = H00 + H11;
+			float edthresh = (octsize <= 1 ? EdgeThresh0 : EdgeThresh);
+			if (det < edthresh * trace * trace)
+				res = 0.0f;
+		}
+	}
+	return res;
+}
+
+
+
+/**
+ * \brief Workgroup-aggregated append: reserves in one global atomic operation the space
+ *   for all the work-items of the workgroup which keep an element. Has to be called by all work-items.
+ *
+ * @param keep: non zero if the work-item has an element to append
+ * @param counter: Pointer to global memory with the number of elements already appended
+ * @param shared: Pointer to local memory with 2 integers
+ * @return: the index where to write the element, -1 if the work-item does not keep any element
+ */
+inline int workgroup_append(
+	int keep,
+	__global int* counter,
+	__local int* shared)
+{
+	int lid = (int) (get_local_id(0) * get_local_size(1) + get_local_id(1));
+	int position = -1;
+	if (lid == 0)
+		shared[0] = 0;
+	barrier(CLK_LOCAL_MEM_FENCE);
+	if (keep)
+		position = atomic_inc(&shared[0]);
+	barrier(CLK_LOCAL_MEM_FENCE);
+	if ((lid == 0) && (shared[0] > 0))
+		shared[1] = atomic_add(counter, shared[0]);
+	barrier(CLK_LOCAL_MEM_FENCE);
+	return (position >= 0 ? shared[1] + position : -1);
+}
+
+
+
 /**
  * \brief Local  maximum detection in scale space
  *
@@ -298,6 +409,139 @@ __kernel void local_max(
 	}//end "in the inner image"
 }
 
+/**
+ * \brief Sub-pixel interpolation of a local extremum of the DoG (helper of interp_keypoint and local_maxmin_interp)
+ *
+ * @param DOGS: Pointer to global memory with ALL the coutiguously pre-allocated Differences of Gaussians
+ * @param r: row of the extremum
+ * @param c: column of the extremum
+ * @param scale: index of the DoG of the extremum
+ * @param peak_thresh: we are not counting the interpolated values if below the threshold (par.PeakThresh = 255.0*0.04/3.0)
+ * @param InitSigma: float "par.InitSigma" in SIFT (1.6 by default)
+ * @param width: integer number of columns of the DoG
+ * @param height: integer number of lines of the DoG
+ * @return: the interpolated keypoint (peak, r, c, sigma) or (-1,-1,-1,-1) if it is rejected
+ */
+inline keypoint interp_extremum(
+	__global float* DOGS,
+	int r,
+	int c,
+	int scale,
+	float peak_thresh,
+	float InitSigma,
+	int width,
+	int height)
+{
+	int index_dog_prev = (scale-1)*(width*height);
+	int index_dog =scale*(width*height);
+	int index_dog_next =(scale+1)*(width*height);
+
+	//pre-allocating variables before entering into the loop
+	float g0, g1, g2,
+		H00, H11, H22, H01, H02, H12, H10, H20, H21,
+		K00, K11, K22, K01, K02, K12, K10, K20, K21,
+		solution0, solution1, solution2, det, peakval;
+	int pos = r*width+c;
+	int loop = 1, movesRemain = 5;
+	int newr = r, newc = c;
+
+	//this loop replaces the recursive "InterpKeyPoint"
+	while (loop == 1) {
+
+		r = newr, c = newc; //values got as parameters of InterpKeyPoint()" in sift.cpp
+		pos = newr*width+newc;
+
+		//Fill in the values of the gradient from pixel differences
+		g0 = (DOGS[index_dog_next+pos] - DOGS[index_dog_prev+pos]) / 2.0f;
+		g1 = (DOGS[index_dog+(newr+1)*width+newc] - DOGS[index_dog+(newr-1)*width+newc]) / 2.0f;
+		g2 = (DOGS[index_dog+pos+1] - DOGS[index_dog+pos-1]) / 2.0f;
+
+		//Fill in the values of the Hessian from pixel differences
+		H00 = DOGS[index_dog_prev+pos]   - 2.0f * DOGS[index_dog+pos] + DOGS[index_dog_next+pos];
+		H11 = DOGS[index_dog+(newr-1)*width+newc] - 2.0f * DOGS[index_dog+pos] + DOGS[index_dog+(newr+1)*width+newc];
+		H22 = DOGS[index_dog+pos-1] - 2.0f * DOGS[index_dog+pos] + DOGS[index_dog+pos+1];
+	
+		H01 = ( (DOGS[index_dog_next+(newr+1)*width+newc] - DOGS[index_dog_next+(newr-1)*width+newc])
+				- (DOGS[index_dog_prev+(newr+1)*width+newc] - DOGS[index_dog_prev+(newr-1)*width+newc])) / 4.0f;
+				
+		H02 = ( (DOGS[index_dog_next+pos+1] - DOGS[index_dog_next+pos-1])
+				-(DOGS[index_dog_prev+pos+1] - DOGS[index_dog_prev+pos-1])) / 4.0f;
+				
+		H12 = ( (DOGS[index_dog+(newr+1)*width+newc+1] - DOGS[index_dog+(newr+1)*width+newc-1])
+				- (DOGS[index_dog+(newr-1)*width+newc+1] - DOGS[index_dog+(newr-1)*width+newc-1])) / 4.0f;
+							
+		H10 = H01; H20 = H02; H21 = H12;
+
+
+		//inversion of the Hessian	: det*K = H^(-1)
+
+		det = -(H02*H11*H20) + H01*H12*H20 + H02*H10*H21 - H00*H12*H21 - H01*H10*H22 + H00*H11*H22;
+
+		K00 = H11*H22 - H12*H21;
+		K01 = H02*H21 - H01*H22;
+		K02 = H01*H12 - H02*H11;
+		K10 = H12*H20 - H10*H22;
+		K11 = H00*H22 - H02*H20;
+		K12 = H02*H10 - H00*H12;
+		K20 = H10*H21 - H11*H20;
+		K21 = H01*H20 - H00*H21;
+		K22 = H00*H11 - H01*H10;
+
+
+		/*
+			x = -H^(-1)*g
+		 As the Taylor Serie is calcualted around the current keypoint,
+		 the position of the true extremum x_opt is exactly the "offset" between x and x_opt ("x" is the origin)
+		*/
+		solution0 = -(g0*K00 + g1*K01 + g2*K02)/det; //"offset" in sigma
+		solution1 = -(g0*K10 + g1*K11 + g2*K12)/det; //"offset" in r
+		solution2 = -(g0*K20 + g1*K21 + g2*K22)/det; //"offset" in c
+
+		//interpolated DoG magnitude at this peak
+		peakval = DOGS[index_dog+pos] + 0.5f * (solution0*g0+solution1*g1+solution2*g2);
+
+
+	/* Move to an adjacent (row,col) location if quadratic interpolation is larger than 0.6 units in some direction. 				The movesRemain counter allows only a fixed number of moves to prevent possibility of infinite loops.
+	*/
+
+		if (solution1 > 0.6f && newr < height - 3)
+			newr++; //if the extremum is too far (along "r" here), we get closer if we can
+		else if (solution1 < -0.6f && newr > 3)
+			newr--;
+		if (solution2 > 0.6f && newc < width - 3)
+			newc++;
+		else if (solution2 < -0.6f && newc > 3)
+			newc--;
+
+		/*
+			Loop test
+		*/
+		if (movesRemain > 0  &&  (newr != r || newc != c))
+			movesRemain--;
+		else
+			loop = 0;
+
+	}//end of the "keypoints interpolation" big loop
+
+
+	/* Do not create a keypoint if interpolation still remains far outside expected limits,
+		or if magnitude of peak value is below threshold (i.e., contrast is too low).
+	*/
+	keypoint ki = 0.0f; //float4
+	if (fabs(solution0) <= 1.5f && fabs(solution1) <= 1.5f && fabs(solution2) <= 1.5f && fabs(peakval) >= peak_thresh) {
+		ki.s0 = peakval;
+		ki.s1 = /*k.s1*/ r + solution1;
+		ki.s2 = /*k.s2*/ c + solution2;
+		ki.s3 = InitSigma * pow(2.0f, (((float) scale) + solution0) / 3.0f); //3.0 is "par.Scales"
+	}
+	else { //the keypoint was not correctly interpolated : we reject it
+		ki.s0 = -1.0f; ki.s1 = -1.0f; ki.s2 = -1.0f; ki.s3 = -1.0f;
+	}
+	return ki;
+}
+
+
+
 /**
  * \brief From the (temporary) keypoints, create a vector of interpolated keypoints
  * 			(this is the last step of keypoints refinement)
@@ -332,121 +576,70 @@ __kernel void interp_keypoint(
 		int r = (int) k.s1;
 		int c = (int) k.s2;
 		int scale = (int) k.s3;
-		if (r != -1) {
-			int index_dog_prev = (scale-1)*(width*height);
-			int index_dog =scale*(width*height);
-			int index_dog_next =(scale+1)*(width*height);
-
-			//pre-allocating variables before entering into the loop
-			float g0, g1, g2,
-				H00, H11, H22, H01, H02, H12, H10, H20, H21,
-				K00, K11, K22, K01, K02, K12, K10, K20, K21,
-				solution0, solution1, solution2, det, peakval;
-			int pos = r*width+c;
-			int loop = 1, movesRemain = 5;
-			int newr = r, newc = c;
-
-			//this loop replaces the recursive "InterpKeyPoint"
-			while (loop == 1) {
-
-				r = newr, c = newc; //values got as parameters of InterpKeyPoint()" in sift.cpp
-				pos = newr*width+newc;
-
-				//Fill in the values of the gradient from pixel differences
-				g0 = (DOGS[index_dog_next+pos] - DOGS[index_dog_prev+pos]) / 2.0f;
-				g1 = (DOGS[index_dog+(newr+1)*width+newc] - DOGS[index_dog+(newr-1)*width+newc]) / 2.0f;
-				g2 = (DOGS[index_dog+pos+1] - DOGS[index_dog+pos-1]) / 2.0f;
-
-				//Fill in the values of the Hessian from pixel differences
-				H00 = DOGS[index_dog_prev+pos]   - 2.0f * DOGS[index_dog+pos] + DOGS[index_dog_next+pos];
-				H11 = DOGS[index_dog+(newr-1)*width+newc] - 2.0f * DOGS[index_dog+pos] + DOGS[index_dog+(newr+1)*width+newc];
-				H22 = DOGS[index_dog+pos-1] - 2.0f * DOGS[index_dog+pos] + DOGS[index_dog+pos+1];
-			
-				H01 = ( (DOGS[index_dog_next+(newr+1)*width+newc] - DOGS[index_dog_next+(newr-1)*width+newc])
-						- (DOGS[index_dog_prev+(newr+1)*width+newc] - DOGS[index_dog_prev+(newr-1)*width+newc])) / 4.0f;
-						
-				H02 = ( (DOGS[index_dog_next+pos+1] - DOGS[index_dog_next+pos-1])
-						-(DOGS[index_dog_prev+pos+1] - DOGS[index_dog_prev+pos-1])) / 4.0f;
-						
-				H12 = ( (DOGS[index_dog+(newr+1)*width+newc+1] - DOGS[index_dog+(newr+1)*width+newc-1])
-						- (DOGS[index_dog+(newr-1)*width+newc+1] - DOGS[index_dog+(newr-1)*width+newc-1])) / 4.0f;
-									
-				H10 = H01; H20 = H02; H21 = H12;
-
-
-				//inversion of the Hessian	: det*K = H^(-1)
-
-				det = -(H02*H11*H20) + H01*H12*H20 + H02*H10*H21 - H00*H12*H21 - H01*H10*H22 + H00*H11*H22;
-
-				K00 = H11*H22 - H12*H21;
-				K01 = H02*H21 - H01*H22;
-				K02 = H01*H12 - H02*H11;
-				K10 = H12*H20 - H10*H22;
-				K11 = H00*H22 - H02*H20;
-				K12 = H02*H10 - H00*H12;
-				K20 = H10*H21 - H11*H20;
-				K21 = H01*H20 - H00*H21;
-				K22 = H00*H11 - H01*H10;
-
-
-				/*
-					x = -H^(-1)*g
-				 As the Taylor Serie is calcualted around the current keypoint,
-				 the position of the true extremum x_opt is exactly the "offset" between x and x_opt ("x" is the origin)
-				*/
-				solution0 = -(g0*K00 + g1*K01 + g2*K02)/det; //"offset" in sigma
-				solution1 = -(g0*K10 + g1*K11 + g2*K12)/det; //"offset" in r
-				solution2 = -(g0*K20 + g1*K21 + g2*K22)/det; //"offset" in c
-
-				//interpolated DoG magnitude at this peak
-				peakval = DOGS[index_dog+pos] + 0.5f * (solution0*g0+solution1*g1+solution2*g2);
-		
-		
-			/* Move to an adjacent (row,col) location if quadratic interpolation is larger than 0.6 units in some direction. 				The movesRemain counter allows only a fixed number of moves to prevent possibility of infinite loops.
-			*/
-
-				if (solution1 > 0.6f && newr < height - 3)
-					newr++; //if the extremum is too far (along "r" here), we get closer if we can
-				else if (solution1 < -0.6f && newr > 3)
-					newr--;
-				if (solution2 > 0.6f && newc < width - 3)
-					newc++;
-				else if (solution2 < -0.6f && newc > 3)
-					newc--;
-
-				/*
-					Loop test
-				*/
-				if (movesRemain > 0  &&  (newr != r || newc != c))
-					movesRemain--;
-				else
-					loop = 0;
+		if (r != -1)
+			keypoints[gid0] = interp_extremum(DOGS, r, c, scale, peak_thresh, InitSigma, width, height);
 
-			}//end of the "keypoints interpolation" big loop
-
-
-			/* Do not create a keypoint if interpolation still remains far outside expected limits,
-				or if magnitude of peak value is below threshold (i.e., contrast is too low).
-			*/
-			keypoint ki = 0.0f; //float4
-			if (fabs(solution0) <= 1.5f && fabs(solution1) <= 1.5f && fabs(solution2) <= 1.5f && fabs(peakval) >= peak_thresh) {
-				ki.s0 = peakval;
-				ki.s1 = /*k.s1*/ r + solution1;
-				ki.s2 = /*k.s2*/ c + solution2;
-				ki.s3 = InitSigma * pow(2.0f, (((float) scale) + solution0) / 3.0f); //3.0 is "par.Scales"
-			}
-			else { //the keypoint was not correctly interpolated : we reject it
-				ki.s0 = -1.0f; ki.s1 = -1.0f; ki.s2 = -1.0f; ki.s3 = -1.0f;
-			}
-
-			keypoints[gid0]=ki;
+	}
+}
 
-		/*
-			Better return here and compute histogram in another kernel
-		*/
-		}
 
-	}
+/**
+ * \brief Fused extrema detection and sub-pixel interpolation in all the scales of an octave (3D launch)
+ *
+ * Extrema are detected as in local_maxmin, from a tile of the three DoG planes (scale-1, scale, scale+1)
+ * and a one pixel apron staged in local memory by each workgroup, optionally discarded if they lie on a masked pixel,
+ * then interpolated as in interp_keypoint by the work-item which found them (the neighbourhood being
+ * read from the cache as the interpolation may move the point outside of the tile).
+ * Only the keypoints surviving the interpolation (peak, r, c, sigma) are appended in the segment of their scale,
+ * so that neither the intermediate candidates nor the holes of the rejected ones reach global memory.
+ * As mask_keypoints in the unfused path, the mask is only tested at the pixel where the extremum is detected,
+ * before the interpolation: valid is the eroded map of the pixels whose blurred neighbourhood holds no masked pixel.
+ *
+ * gid0 = row, gid1 = column, gid2 = scale - 1 (the local size in the third dimension has to be 1)
+ *
+ * @param DOGS: Pointer to global memory with ALL the coutiguously pre-allocated Differences of Gaussians
+ * @param valid: Pointer to global memory with the valid pixels of the octave (non zero), or NULL without mask
+ * @param output: Pointer to global memory with one segment of nb_keypoints keypoints per scale
+ * @param tile: Pointer to local memory with 3*(local_size0+2)*(local_size1+2) floats
+ * @param border_dist: integer, distance between inner image and borders (SIFT takes 5)
+ * @param peak_thresh: float, threshold (SIFT takes 255.0 * 0.04 / 3.0)
+ * @param octsize: initially 1 then twiced at each new octave
+ * @param EdgeThresh0: initial upper limit of the curvatures ratio, to test if the point is on an edge
+ * @param EdgeThresh: upper limit of the curvatures ratio, to test if the point is on an edge
+ * @param InitSigma: float "par.InitSigma" in SIFT (1.6 by default)
+ * @param counters: Pointer to global memory with the number of keypoints of each scale (set to 0 before)
+ * @param nb_keypoints: Maximum number of keypoints of a segment
+ * @param width: integer number of columns of a DOG.
+ * @param height: integer number of lines of a DOG
+ */
+__kernel void local_maxmin_interp(
+	__global float* DOGS,
+	__global unsigned char* valid,
+	__global keypoint* output,
+	__local float* tile,
+	int border_dist,
+	float peak_thresh,
+	int octsize,
+	float EdgeThresh0,
+	float EdgeThresh,
+	float InitSigma,
+	__global int* counters,
+	int nb_keypoints,
+	int width,
+	int height)
+{
+	int gid0 = (int) get_global_id(0);
+	int gid1 = (int) get_global_id(1);
+	int scale = (int) get_global_id(2) + 1;
+	__local int shared[2];
+	keypoint k = (keypoint) (-1.0f, -1.0f, -1.0f, -1.0f);
+
+	float res = tile_extremum(DOGS, tile, scale, border_dist, peak_thresh, octsize, EdgeThresh0, EdgeThresh, width, height);
+	if ((res != 0.0f) && ((valid == 0) || (valid[gid0 * width + gid1] != 0)))
+		k = interp_extremum(DOGS, gid0, gid1, scale, peak_thresh, InitSigma, width, height);
+	int old = workgroup_append(k.s1 != -1.0f, &counters[scale - 1], shared);
+	if ((old >= 0) && (old < nb_keypoints))
+		output[(scale - 1) * nb_keypoints + old] = k;
 }
 
 
@@ -456,6 +649,7 @@ __kernel void interp_keypoint(
 
 
 
+
 /**
  * \brief Assign an orientation to the keypoints.  This is done by creating a Gaussian weighted histogram
  *   of the gradient directions in the region.  The histogram is smoothed and the largest peak selected.
@@ -621,16 +815,17 @@ __kernel void orientation_assignment(
  *
  * @param keypoints: Pointer to global memory with current keypoints vector
  * @param descriptor: Pointer to global memory with the output SIFT descriptor, cast to uint8
- * @param tmp_descriptor: Pointer to shared memory with temporary computed float descriptors
+ * @param tmp_descriptor: Pointer to shared memory with temporary computed float descriptors (128 floats per work-item)
  * @param grad: Pointer to global memory with gradient norm previously calculated
  * @param oril: Pointer to global memory with gradient orientation previously calculated
  * @param keypoints_start : index start for keypoints
  * @param keypoints_end: end index for keypoints
+ * @param octsize: initially 1 then twiced at each octave, coordinates are divided by it
  * @param grad_width: integer number of columns of the gradient
  * @param grad_height: integer num of lines of the gradient
  
  
- WARNING: scale, row and col must not have been multiplied by octsize/octscale here !
+ WARNING: scale, row and col are divided by octsize here !
 
 -par.MagFactor = 3 //"1.5 sigma"
 -OriSize  = 8 //number of bins in the local histogram
@@ -658,15 +853,21 @@ __kernel void descriptor(
 	__global float* orim,
 	int keypoints_start,
 	int keypoints_end,
+	int octsize,
 	int grad_width,
 	int grad_height)
 {
 
 	int gid0 = (int) get_global_id(0);
+	int lid = (int) get_local_id(0);
 	if (keypoints_start <= gid0 && gid0 < keypoints_end) {
 	
 		keypoint k = keypoints[gid0];
 		if (k.s1 != -1.0f) {
+			/* orientation_assignment already multiplied (c,r,sigma) by octsize */
+			k.s0 /= octsize;
+			k.s1 /= octsize;
+			k.s2 /= octsize;
 	
 		/* Add features to vec obtained from sampling the grad and ori images
 		   for a particular scale.  Location of key is (scale,row,col) with respect
@@ -679,7 +880,7 @@ __kernel void descriptor(
 				Local memory memset
 			*/
 			for (i=0; i < 128; i++)
-				tmp_descriptors[128*gid0+i] = 0.0f;
+				tmp_descriptors[128*lid+i] = 0.0f;
 			
 			float rx, cx;
 			int	irow = (int) (k.s1 + 0.5f), icol = (int) (k.s0 + 0.5f);
@@ -772,7 +973,7 @@ __kernel void descriptor(
 														with a vertical representation
 												*/
 													
-												tmp_descriptors[128*gid0+(rindex*4 + cindex)*8+oindex] 
+												tmp_descriptors[128*lid+(rindex*4 + cindex)*8+oindex] 
 													+= (cweight * ((orr == 0) ? 1.0f - ofrac : ofrac));
 													
 													
@@ -798,36 +999,36 @@ __kernel void descriptor(
 			// Normalization
 			float norm = 0;
 			for (i = 0; i < 128; i++)
-				norm+=pow(tmp_descriptors[128*gid0+i],2); //warning: not the same as C "pow"
+				norm+=pow(tmp_descriptors[128*lid+i],2); //warning: not the same as C "pow"
 			norm = rsqrt(norm); //norm = 1.0f/sqrt(norm); //half_rsqrt to speed-up
 			for (i = 0; i < 128; i++)
-				tmp_descriptors[128*gid0+i] *= norm;
+				tmp_descriptors[128*lid+i] *= norm;
 			
 			
 			//Threshold to 0.2 of the norm, for invariance to illumination
 			bool changed = false;
 			norm = 0;
 			for (i = 0; i < 128; i++) {
-				if (tmp_descriptors[128*gid0+i] > 0.2f) {
-					tmp_descriptors[128*gid0+i] = 0.2f;
+				if (tmp_descriptors[128*lid+i] > 0.2f) {
+					tmp_descriptors[128*lid+i] = 0.2f;
 					changed = true;
 				}
-				norm += pow(tmp_descriptors[128*gid0+i],2); 
+				norm += pow(tmp_descriptors[128*lid+i],2); 
 			}
 
 			//if values have been changed, we have to normalize again...
 			if (changed) {
 				norm = rsqrt(norm);
 				for (i = 0; i < 128; i++)
-					tmp_descriptors[128*gid0+i] *= norm;
+					tmp_descriptors[128*lid+i] *= norm;
 			}
 
 			//finally, cast to integer			
 			//store to global memory : tmp_descriptor[i][gid0] --> descriptors[i][gid0]
 			for (i = 0; i < 128; i++) {
 				descriptors[128*gid0+i]
-					= (unsigned char) MIN(255,(unsigned char)(512.0f*tmp_descriptors[128*gid0+i]));
-					//= (unsigned char) tmp_descriptors[128*gid0+i]; 
+					= (unsigned char) MIN(255,(int)(512.0f*tmp_descriptors[128*lid+i]));
+					//= (unsigned char) tmp_descriptors[128*lid+i]; 
 			}
 		
 			
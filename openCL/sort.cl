@@ -74,3 +74,49 @@ __kernel void sort(
   }
   
 }
+
+
+/*
+ * 3x3 median filter for hot pixels (and dead pixels): a pixel is replaced by the
+ * median of its neighbourhood when it deviates from it by more than threshold.
+ * Edges are replicated.
+ * 2D kernel: gid0 = row, gid1 = column
+ *
+ * The median of 9 is obtained with the 19 exchanges of the optimal network
+ * (opt_med9, N. Devillard / A. Paeth), ORDERV puts the smaller value first
+ * with reverse set.
+ *
+ * image_in: input image
+ * image_out: filtered image (different buffer)
+ * threshold: maximum deviation to the median
+ */
+
+__kernel void median3x3_filter(
+		__global float * image_in,
+		__global float * image_out,
+		float threshold,
+		int IMAGE_W,
+		int IMAGE_H)
+{
+  int gid0 = get_global_id(0);
+  int gid1 = get_global_id(1);
+  bool reverse = true;
+  float x[9];
+
+  if ((gid0 < IMAGE_H) && (gid1 < IMAGE_W)) {
+	  for (int k=0;k<3;k++) {
+		  int r = clamp(gid0 + k - 1, 0, IMAGE_H - 1);
+		  for (int l=0;l<3;l++)
+			  x[3*k+l] = image_in[r*IMAGE_W + clamp(gid1 + l - 1, 0, IMAGE_W - 1)];
+	  }
+	  float value = x[4];
+	  ORDERV(x,1,2) ORDERV(x,4,5) ORDERV(x,7,8)
+	  ORDERV(x,0,1) ORDERV(x,3,4) ORDERV(x,6,7)
+	  ORDERV(x,1,2) ORDERV(x,4,5) ORDERV(x,7,8)
+	  ORDERV(x,0,3) ORDERV(x,5,8) ORDERV(x,4,7)
+	  ORDERV(x,3,6) ORDERV(x,1,4) ORDERV(x,2,5)
+	  ORDERV(x,4,7) ORDERV(x,4,2) ORDERV(x,6,4)
+	  ORDERV(x,4,2)
+	  image_out[gid0*IMAGE_W + gid1] = (fabs(value - x[4]) > threshold) ? x[4] : value;
+  }
+}
@@ -3,4 +3,21 @@ import os
 sift_home = os.path.dirname(os.path.abspath(__file__))
 import sys, logging
 logging.basicConfig()
-from .plan import SiftPlan
+from .stack import StackReader
+from .live import LiveSift
+from .server import SiftServer
+from .client import SiftClient
+from .keyfile import KeypointWriter, KeypointFile
+from .cache import KeypointCache
+try:
+    import pyopencl
+except ImportError:
+    pyopencl = None
+if pyopencl is not None:
+    # without pyopencl, only the pure Python parts above are available, i.e. the clients of a SiftServer
+    from .plan import SiftPlan
+    from .keypoints import DeviceKeypoints
+    from .warp import WarpPlan
+    from .match import MatchPlan
+    from .alignment import StackAlign
+    from .pool import SiftPool
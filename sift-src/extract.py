@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains the batch extraction of keypoints from many images or stacks, with a reading thread,
+worker threads sharing pooled plans and a writing thread
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-25"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, glob, logging, threading, time
+import Queue
+import numpy
+from .stack import StackReader
+from .keyfile import KeypointWriter, is_complete, recover_index
+logger = logging.getLogger("sift.extract")
+try:
+    import fabio
+except ImportError:
+    fabio = None
+
+EXTENSIONS = (".npy", ".edf", ".tif", ".tiff", ".png", ".jpg", ".jpeg", ".cbf", ".h5")
+
+
+def find_files(patterns):
+    """
+    Expand directories and glob patterns into a sorted list of files
+
+    @param patterns: list of filenames, directories or glob patterns
+    @return: list of files, each listed once
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in sorted(os.listdir(pattern)):
+                filename = os.path.join(pattern, name)
+                if os.path.isfile(filename) and os.path.splitext(name)[1].lower() in EXTENSIONS:
+                    files.append(filename)
+        elif os.path.isfile(pattern):
+            files.append(pattern)
+        else:
+            files += sorted(i for i in glob.glob(pattern) if os.path.isfile(i))
+    seen = set()
+    unique = []
+    for filename in files:
+        key = os.path.realpath(filename)
+        if key not in seen:
+            seen.add(key)
+            unique.append(filename)
+    return unique
+
+
+def common_root(files):
+    """
+    @return: deepest directory containing all files
+    """
+    if not files:
+        return os.getcwd()
+    dirs = [os.path.dirname(os.path.abspath(filename)).split(os.sep) for filename in files]
+    return os.sep.join(os.path.commonprefix(dirs)) or os.sep
+
+
+def read_frames(filename):
+    """
+    Read all frames of a file: .npy files are memory mapped (3D arrays are stacks),
+    other formats are read with fabio (or scipy for common image formats)
+
+    @return: generator of (frame number, number of frames, image)
+    """
+    if filename.lower().endswith(".npy"):
+        data = numpy.load(filename, mmap_mode="r")
+        if data.ndim == 2 or (data.ndim == 3 and data.shape[-1] == 3 and data.dtype == numpy.uint8):
+            yield 0, 1, numpy.ascontiguousarray(data)
+        else:
+            stack = StackReader(data)
+            for index, frame in enumerate(stack):
+                yield index, len(stack), numpy.ascontiguousarray(frame)
+    elif fabio is not None:
+        image = fabio.open(filename)
+        nframes = max(1, image.nframes)
+        for index in range(nframes):
+            frame = image if index == 0 else image.getframe(index)
+            yield index, nframes, frame.data
+    else:
+        import scipy.misc
+        yield 0, 1, scipy.misc.imread(filename)
+
+
+class BatchExtractor(object):
+    """
+    Extract the keypoints of many images, all stages running concurrently:
+
+    reading thread -> workers (pooled plans per geometry) -> writing thread
+
+    be = BatchExtractor(output_dir, workers=2)
+    be.run(find_files(["data/*.edf"]))
+
+    The keypoints of all frames of an input file are saved in one binary container (.sift, see KeypointFile),
+    named after the path of the input relative to the common directory of all inputs, extension included:
+    data/a/img.edf and data/b/img.edf give output_dir/a/img.edf.sift and output_dir/b/img.edf.sift.
+    Inputs whose output is already complete are skipped. An interrupted output is resumed after its last frame
+    on disk, and the frames which failed are processed again by the next run (from the first failed one).
+    """
+    def __init__(self, output_dir, workers=2, depth=4, resume=True, **kwargs):
+        """
+        Contructor of the class
+
+        @param output_dir: directory receiving the results
+        @param workers: number of frames processed concurrently
+        @param depth: number of frames read in advance
+        @param resume: skip the frames already extracted
+        @param kwargs: parameters of the SiftPlan (devicetype, device, ...)
+        """
+        self.output_dir = output_dir
+        self.workers = max(1, int(workers))
+        self.depth = max(1, int(depth))
+        self.resume = bool(resume)
+        self.kwargs = kwargs
+        self.root = None  # common directory of the inputs
+        self.pools = {}
+        self._lock = threading.Lock()
+        self.nb_frames = 0
+        self.nb_skipped = 0
+        self.nb_resumed = 0
+        self.nb_keypoints = 0
+        self.nb_errors = 0
+        self.nb_bytes = 0
+        self.elapsed = 0
+
+    def output_name(self, filename):
+        """
+        @return: name of the output file for an input file
+        """
+        if self.root is None:
+            relative = os.path.basename(filename)
+        else:
+            relative = os.path.relpath(os.path.abspath(filename), self.root)
+        return os.path.join(self.output_dir, relative + ".sift")
+
+    def output_names(self, files):
+        """
+        Set the common directory of the inputs and check that no two inputs share an output
+
+        @param files: list of input files
+        @return: list of output filenames
+        """
+        self.root = common_root(files)
+        outputs = {}
+        names = []
+        for filename in files:
+            output = self.output_name(filename)
+            if output in outputs:
+                raise RuntimeError("Inputs %s and %s would both be saved in %s" % (outputs[output], filename, output))
+            outputs[output] = filename
+            names.append(output)
+        return names
+
+    def get_pool(self, shape, dtype):
+        """
+        @return: the pool of plans for a given geometry, created on first use
+        """
+        from .pool import SiftPool  # OpenCL is only initialised by the first frame
+        key = (tuple(shape), numpy.dtype(dtype).str)
+        with self._lock:
+            if key not in self.pools:
+                logger.info("Creating plans for shape %s and dtype %s" % key)
+                self.pools[key] = SiftPool(shape=key[0], dtype=dtype, size=self.workers, **self.kwargs)
+            return self.pools[key]
+
+    def _jobs(self, files):
+        """
+        @return: generator of (output filename, frames kept in the output, frame number, number of frames, image),
+                 skipping the frames already processed
+        """
+        for filename in files:
+            output = self.output_name(filename)
+            start = 0
+            if self.resume:
+                if is_complete(output):
+                    self.nb_skipped += 1
+                    continue
+                start = len(recover_index(output))
+                self.nb_resumed += start
+            try:
+                nframes = None
+                for index, nframes, frame in read_frames(filename):
+                    if index < start:
+                        continue
+                    self.nb_bytes += frame.nbytes
+                    yield output, start, index, nframes, frame
+                if start and start == nframes:
+                    # all frames were on disk, only the index is missing
+                    KeypointWriter(output, keep=start).close()
+            except Exception as error:
+                logger.error("Unable to read %s: %s" % (filename, error))
+                self.nb_errors += 1
+
+    def _read(self, files, todo):
+        for job in self._jobs(files):
+            todo.put(job)
+        for i in range(self.workers):
+            todo.put(None)
+
+    def _work(self, todo, done):
+        while True:
+            job = todo.get()
+            if job is None:
+                break
+            output, start, index, nframes, frame = job
+            try:
+                kp = self.get_pool(frame.shape, frame.dtype).keypoints(frame)
+            except Exception as error:
+                logger.error("Unable to process frame %s of %s: %s" % (index, output, error))
+                with self._lock:
+                    self.nb_errors += 1
+                kp = None
+            done.put((output, start, index, nframes, kp))
+        done.put(None)
+
+    def _write(self, done):
+        """
+        Writing thread: frames arrive in any order from the workers, they are written in order.
+        Failed frames are recorded as such in the index and outputs which are not complete are left
+        without header, to be resumed by the next run. An output which cannot be written is given up,
+        the other ones are still written.
+        """
+        running = self.workers
+        writers = {}  # output: [writer, next frame, number of frames, {frame: keypoints}]
+        unwritable = set()  # outputs given up after an error, their next frames are discarded
+        while running:
+            job = done.get()
+            if job is None:
+                running -= 1
+                continue
+            output, start, index, nframes, kp = job
+            if output in unwritable:
+                continue
+            try:
+                self._write_frame(writers, output, start, index, nframes, kp)
+            except Exception as error:
+                # the workers are blocked until the results are drained: keep going with the other outputs
+                logger.error("Unable to write %s: %s" % (output, error))
+                with self._lock:
+                    self.nb_errors += 1
+                unwritable.add(output)
+                state = writers.pop(output, None)
+                if state is not None:
+                    try:
+                        state[0].abort()
+                    except Exception as error:
+                        logger.error("Unable to close %s: %s" % (output, error))
+        for output, state in writers.items():
+            logger.error("Output %s is incomplete, %s frames written" % (output, len(state[0])))
+            state[0].abort()
+
+    def _write_frame(self, writers, output, start, index, nframes, kp):
+        """
+        Write the results of a frame, and of the following ones already received, in order.
+        The output is closed when its last frame is written.
+
+        @param writers: dict of the outputs being written (see _write)
+        @param kp: keypoints of the frame, None for a failed frame
+        """
+        if output not in writers:
+            directory = os.path.dirname(output)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            writers[output] = [KeypointWriter(output, keep=start), start, nframes, {}]
+        state = writers[output]
+        state[3][index] = kp
+        while state[1] in state[3]:
+            kp = state[3].pop(state[1])
+            state[0].write(kp)
+            state[1] += 1
+            if kp is not None:
+                self.nb_frames += 1
+                self.nb_keypoints += kp.shape[0]
+        if state[1] == state[2]:
+            failed = state[0].failed()
+            if failed:
+                logger.error("Output %s has %s failed frames, from frame %s" % (output, len(failed), failed[0]))
+            state[0].close()
+            del writers[output]
+
+    def run(self, files):
+        """
+        Process all files
+
+        @param files: list of input files (see find_files)
+        @return: dict with the statistics of the run
+        """
+        self.output_names(files)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        t0 = time.time()
+        todo = Queue.Queue(self.depth)
+        done = Queue.Queue(self.depth)
+        threads = [threading.Thread(target=self._read, name="reader", args=(files, todo))]
+        threads += [threading.Thread(target=self._work, name="worker-%s" % i, args=(todo, done))
+                    for i in range(self.workers)]
+        threads.append(threading.Thread(target=self._write, name="writer", args=(done,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.time() - t0
+        return self.statistics()
+
+    def statistics(self):
+        """
+        @return: dict with the counters and the throughput of the run
+        """
+        elapsed = max(self.elapsed, 1e-6)
+        return {"frames": self.nb_frames,
+                "skipped": self.nb_skipped,
+                "resumed": self.nb_resumed,
+                "errors": self.nb_errors,
+                "keypoints": self.nb_keypoints,
+                "time": self.elapsed,
+                "frames_per_second": self.nb_frames / elapsed,
+                "MB_per_second": self.nb_bytes / elapsed / 1e6}
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a class for matching two sets of keypoints on the device
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer", "Pierre Paleo"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-18"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, sys
+import gc
+import numpy
+import pyopencl, pyopencl.array
+from .param import par
+from .opencl import ocl
+from .utils import calc_size
+from .keypoints import DeviceKeypoints, dtype_kp
+from .worker import Worker
+logger = logging.getLogger("sift.match")
+
+
+class MatchPlan(object):
+    """
+    Match two sets of keypoints:
+
+    mp = sift.MatchPlan()
+    match = mp.match(kp1, kp2)
+
+    match is a (n,2) record array: match[:,0] are keypoints of kp1 and match[:,1] the corresponding ones in kp2.
+    Keypoints can be record arrays or DeviceKeypoints (SiftPlan.keypoints(img, device=True)) whose
+    descriptors are then copied on the device without transiting through the host.
+
+    A reference set of keypoints can be kept resident on the device and matched against many others:
+
+    mp.set_reference(kp_ref)
+    for kp in keypoints:
+        match = mp.match(kp)
+    """
+    kernels = ["matching"]
+
+    def __init__(self, size=16384, devicetype="GPU", profile=False, device=None, ctx=None, max_workgroup_size=128):
+        """
+        Contructor of the class
+
+        @param size: initial number of keypoints the buffers can hold (grown on demand)
+        @param ctx: re-use an existing OpenCL context (i.e. the one of a SiftPlan)
+        """
+        self.profile = bool(profile)
+        self.events = []
+        self.buffers = {}
+        self.programs = {}
+        self.kpsize = 0
+        self.ref_size = 0
+        self.ref_kp = None
+        self.worker = None
+        if ctx is not None:
+            self.ctx = ctx
+        else:
+            if device is None:
+                device = ocl.select_device(type=devicetype, best=True)
+            self.device = device
+            self.ctx = pyopencl.Context(devices=[pyopencl.get_platforms()[device[0]].get_devices()[device[1]]])
+        if profile:
+            self.queue = pyopencl.CommandQueue(self.ctx, properties=pyopencl.command_queue_properties.PROFILING_ENABLE)
+        else:
+            self.queue = pyopencl.CommandQueue(self.ctx)
+        self.wgsize = (min(max_workgroup_size, self.ctx.devices[0].max_work_group_size),)
+        self._compile_kernels()
+        self._allocate_buffers(size)
+
+    def __del__(self):
+        """
+        Destructor: release all buffers
+        """
+        if self.worker is not None:
+            self.worker.stop()
+        self.buffers = {}
+        self.programs = {}
+        self.queue = None
+        self.ctx = None
+        gc.collect()
+
+    def _compile_kernels(self):
+        """
+        Call the OpenCL compiler
+        """
+        for kernel in self.kernels:
+            kernel_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), kernel + ".cl")
+            kernel_src = open(kernel_file).read()
+            try:
+                program = pyopencl.Program(self.ctx, kernel_src).build()
+            except pyopencl.MemoryError as error:
+                raise MemoryError(error)
+            self.programs[kernel] = program
+
+    def _allocate_buffers(self, size):
+        """
+        (Re-)allocate the buffers for the two sets of descriptors and the matching pairs
+        """
+        self.kpsize = int(size)
+        self.buffers["desc1"] = pyopencl.array.empty(self.queue, (self.kpsize, 128), dtype=numpy.uint8)
+        self.buffers["desc2"] = pyopencl.array.empty(self.queue, (self.kpsize, 128), dtype=numpy.uint8)
+        self.buffers["match"] = pyopencl.array.empty(self.queue, (self.kpsize, 2), dtype=numpy.int32)
+        self.buffers["cnt"] = pyopencl.array.empty(self.queue, 1, dtype=numpy.int32)
+        self.ref_size = 0
+        self.ref_kp = None
+
+    def _reserve(self, size):
+        """
+        Make sure the buffers can hold size keypoints
+        """
+        if size > self.kpsize:
+            ref_kp = self.ref_kp
+            logger.info("Re-allocating matching buffers for %s keypoints" % size)
+            self._allocate_buffers(size)
+            if ref_kp is not None:
+                self.set_reference(ref_kp)
+
+    def _upload(self, kp, buffer_name):
+        """
+        send the descriptors of a set of keypoints to the device
+        """
+        if isinstance(kp, DeviceKeypoints):
+            if kp.size:
+                kp.queue.finish()
+                evt = pyopencl.enqueue_copy(self.queue, self.buffers[buffer_name].data, kp.descriptors.data,
+                                            byte_count=int(kp.size * 128))
+                if self.profile: self.events.append(("copy %s" % buffer_name, evt))
+        elif kp.size:
+            evt = pyopencl.enqueue_copy(self.queue, self.buffers[buffer_name].data, numpy.ascontiguousarray(kp.desc))
+            if self.profile: self.events.append(("copy %s" % buffer_name, evt))
+
+    def set_reference(self, kp):
+        """
+        Keep the descriptors of a reference set of keypoints resident on the device
+
+        @param kp: record array of keypoints or DeviceKeypoints (as returned by SiftPlan.keypoints)
+        """
+        if kp.shape[0] > self.kpsize:
+            self._allocate_buffers(kp.shape[0])
+        self._upload(kp, "desc2")
+        self.ref_kp = kp
+        self.ref_size = kp.shape[0]
+
+    def match(self, nkp1, nkp2=None, raw_results=False):
+        """
+        Calculate the matching of two sets of keypoints
+
+        @param nkp1: record array of keypoints or DeviceKeypoints (as returned by SiftPlan.keypoints)
+        @param nkp2: record array of keypoints or DeviceKeypoints, if None, match against the resident reference
+        @param raw_results: if True, return the (n,2) array of indices instead of keypoints
+        @return: (n,2) record array with matching keypoints (nkp1, nkp2)
+        """
+        self._reserve(max(nkp1.shape[0], 0 if nkp2 is None else nkp2.shape[0]))
+        if nkp2 is not None:
+            self.set_reference(nkp2)
+        elif self.ref_kp is None:
+            raise RuntimeError("No reference keypoints: provide nkp2 or call set_reference")
+        nkp2 = self.ref_kp
+        size1 = nkp1.shape[0]
+        self._upload(nkp1, "desc1")
+        self.buffers["cnt"].fill(0, self.queue)
+        procsize = calc_size((size1,), self.wgsize)
+        if size1:
+            evt = self.programs["matching"].matching(self.queue, procsize, self.wgsize,
+                                                     self.buffers["desc1"].data,  # __global unsigned char *desc1,
+                                                     self.buffers["desc2"].data,  # __global unsigned char *desc2,
+                                                     self.buffers["match"].data,  # __global int2 *matchings,
+                                                     self.buffers["cnt"].data,  # __global int *counter,
+                                                     numpy.int32(self.kpsize),  # int max_nb_match,
+                                                     numpy.float32(par.MatchRatio),  # float ratio_th,
+                                                     numpy.int32(size1),  # int size1,
+                                                     numpy.int32(self.ref_size))  # int size2
+            if self.profile: self.events.append(("matching", evt))
+        size = min(self.buffers["cnt"].get()[0], self.kpsize)
+        match = self.buffers["match"].get()[:size]
+        if raw_results:
+            return match
+        result = numpy.recarray(shape=(size, 2), dtype=dtype_kp)
+        result[:, 0] = nkp1[match[:, 0]]
+        result[:, 1] = nkp2[match[:, 1]]
+        return result
+
+    def match_async(self, nkp1, nkp2=None, raw_results=False):
+        """
+        Submit the matching of two sets of keypoints, without waiting for it.
+        Requests are processed in order, so that a reference set by a previous request is used.
+
+        @return: future with the result of match (await asyncio.wrap_future(future) with asyncio)
+        """
+        if self.worker is None:
+            self.worker = Worker("MatchPlan")
+        return self.worker.submit(self.match, nkp1, nkp2, raw_results)
+
+    def log_profile(self):
+        t = 0
+        if self.profile:
+            for e in self.events:
+                if "__len__" in dir(e) and len(e) >= 2:
+                    et = 1e-6 * (e[1].profile.end - e[1].profile.start)
+                    print("%50s:\t%.3fms" % (e[0], et))
+                    t += et
+        print("_" * 80)
+        print("%50s:\t%.3fms" % ("Total execution time", t))
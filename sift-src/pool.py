@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a pool of plans sharing their kernels, for concurrent callers
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-22"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import logging, threading
+import Queue
+from .plan import SiftPlan
+logger = logging.getLogger("sift.pool")
+
+
+class SiftPool(object):
+    """
+    Thread-safe front-end for a SiftPlan, for servers driving one device from many threads:
+
+    pool = sift.SiftPool(template=img, size=4)
+    kp = pool.keypoints(img)  # from any thread
+
+    The context, the compiled programs and the gaussian kernels are shared and never modified;
+    each concurrent call borrows a workspace (a SiftPlan with its own queue and working buffers)
+    from a pool of at most size workspaces, allocated on demand. Calls block when all are busy.
+    All workspaces look up and store their results in the cache of the pool, if any.
+    """
+    def __init__(self, shape=None, dtype=None, template=None, size=4, **kwargs):
+        """
+        Contructor of the class
+
+        @param size: maximum number of concurrent calls, i.e. of workspaces allocated on the device
+        @param kwargs: other parameters of SiftPlan (devicetype, device, ctx, profile, cache ...)
+        """
+        self.size = max(1, int(size))
+        self.master = SiftPlan(shape=shape, dtype=dtype, template=template, **kwargs)
+        self.kwargs = {"profile": self.master.profile,
+                       "PIX_PER_KP": self.master.PIX_PER_KP,
+                       "max_workgroup_size": self.master.max_workgroup_size,
+                       "pinned": self.master.pinned,
+                       "cache": self.master.cache}
+        self.workspaces = [self.master]
+        self.idle = Queue.Queue()
+        self.idle.put(self.master)
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """
+        @return: an idle workspace, a new one if possible, otherwise wait for one
+        """
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            if len(self.workspaces) < self.size:
+                logger.info("Allocating workspace #%s" % len(self.workspaces))
+                workspace = SiftPlan(plan=self.master, **self.kwargs)
+                self.workspaces.append(workspace)
+                return workspace
+        return self.idle.get()
+
+    def keypoints(self, image, just_for_spots=False, device=False):
+        """
+        Calculates the keypoints of the image, can be called concurrently
+
+        @param image: as for SiftPlan.keypoints
+        @param device: if True, return a DeviceKeypoints with its own buffers
+        @return: record array with x, y, scale, angle and desc (or DeviceKeypoints)
+        """
+        workspace = self._acquire()
+        try:
+            result = workspace.keypoints(image, just_for_spots, device)
+            if device:
+                result = result.copy()
+                workspace.queue.finish()
+        finally:
+            self.idle.put(workspace)
+        return result
@@ -44,6 +44,14 @@ OTHER DEALINGS IN THE SOFTWARE.
 from math import ceil
 import numpy
 
+# keypoints as returned by SiftPlan.keypoints, stored in key files and sent by the server
+dtype_kp = numpy.dtype([('x', numpy.float32),
+                        ('y', numpy.float32),
+                        ('scale', numpy.float32),
+                        ('angle', numpy.float32),
+                        ('desc', (numpy.uint8, 128))
+                        ])
+
 def calc_size(shape, blocksize):
     """
     Calculate the optimal size for a kernel according to the workgroup size
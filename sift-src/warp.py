@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Contains a class for warping images on the device (affine or projective transformations)
+and accumulating the aligned frames into an average image
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-18"
+__status__ = "beta"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import os, logging, sys, math
+import gc
+import numpy
+import pyopencl, pyopencl.array
+from .opencl import ocl
+from .utils import calc_size
+logger = logging.getLogger("sift.warp")
+
+
+def as_matrix(matrix, offset=None):
+    """
+    Build the 3x3 projective matrix used by the transform kernels
+
+    @param matrix: 2x2 (linear part), 2x3 (affine) or 3x3 (homography) matrix in (x:col, y:row) order
+    @param offset: optional (x, y) translation, only with a 2x2 matrix
+    @return: 3x3 float32 array mapping output coordinates onto input coordinates
+    """
+    matrix = numpy.asarray(matrix, dtype=numpy.float64)
+    out = numpy.identity(3, dtype=numpy.float64)
+    if matrix.shape == (2, 2):
+        out[:2, :2] = matrix
+        if offset is not None:
+            out[:2, 2] = offset
+    elif matrix.shape == (2, 3):
+        out[:2, :] = matrix
+    elif matrix.shape == (3, 3):
+        out[:] = matrix
+    else:
+        raise RuntimeError("Unable to build a transformation from a matrix of shape %s" % (matrix.shape,))
+    return out.astype(numpy.float32)
+
+
+class WarpPlan(object):
+    """
+    How to align and average a stack of images on the device:
+
+    warp = sift.WarpPlan(plan=siftp)  # shares context, queue and kernels with a SiftPlan
+    for img, matrix in zip(stack, matrices):
+        warp.accumulate(img, matrix)
+    avg = warp.average()
+
+    matrices map the coordinates (x:col, y:row) of the output image onto the input image.
+    Only the final average is transferred back to the host.
+    """
+    kernels = ["preprocess"]
+    interpolation = {"bilinear": "transform_bilinear",
+                     "bicubic": "transform_bicubic"}
+
+    def __init__(self, shape=None, out_shape=None, plan=None, devicetype="GPU", device=None, profile=False,
+                 interpolation="bilinear", fill=0.0, max_workgroup_size=sys.maxint, ctx=None):
+        """
+        Contructor of the class
+
+        @param shape: shape of the input images
+        @param out_shape: shape of the warped images (by default the same as the input)
+        @param plan: SiftPlan whose context, queue and compiled kernels are re-used
+        @param interpolation: "bilinear" or "bicubic"
+        @param fill: value of the pixels falling outside the input image
+        @param ctx: re-use an existing OpenCL context (i.e. the one of an upstream processing)
+        """
+        if interpolation not in self.interpolation:
+            raise RuntimeError("Unknown interpolation %s, valid are %s" % (interpolation, self.interpolation.keys()))
+        self.kernel_name = self.interpolation[interpolation]
+        self.fill = numpy.float32(fill)
+        self.profile = bool(profile)
+        self.events = []
+        self.buffers = {}
+        self.programs = {}
+        if plan is not None:
+            self.shape = tuple(plan.shape)
+            self.ctx = plan.ctx
+            self.queue = plan.queue
+            self.programs["preprocess"] = plan.programs["preprocess"]
+            self.profile = plan.profile
+            max_workgroup_size = plan.max_workgroup_size
+        else:
+            self.shape = tuple(shape)
+            if ctx is not None:
+                self.ctx = ctx
+            else:
+                if device is None:
+                    device = ocl.select_device(type=devicetype, best=True)
+                self.device = device
+                self.ctx = pyopencl.Context(devices=[pyopencl.get_platforms()[device[0]].get_devices()[device[1]]])
+            if profile:
+                self.queue = pyopencl.CommandQueue(self.ctx, properties=pyopencl.command_queue_properties.PROFILING_ENABLE)
+            else:
+                self.queue = pyopencl.CommandQueue(self.ctx)
+            self._compile_kernels()
+        self.out_shape = tuple(out_shape) if out_shape is not None else self.shape
+        device = self.ctx.devices[0]
+        wg = min(2 ** int(math.log(self.out_shape[1]) / math.log(2)), max_workgroup_size,
+                 device.max_work_item_sizes[1], device.max_work_group_size)
+        self.wgsize = (1, int(wg))
+        self.procsize = calc_size(self.out_shape, self.wgsize)
+        self._allocate_buffers()
+        self.reset()
+
+    def __del__(self):
+        """
+        Destructor: release all buffers
+        """
+        self.buffers = {}
+        self.programs = {}
+        self.queue = None
+        self.ctx = None
+        gc.collect()
+
+    def _compile_kernels(self):
+        """
+        Call the OpenCL compiler
+        """
+        for kernel in self.kernels:
+            kernel_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), kernel + ".cl")
+            kernel_src = open(kernel_file).read()
+            try:
+                program = pyopencl.Program(self.ctx, kernel_src).build()
+            except pyopencl.MemoryError as error:
+                raise MemoryError(error)
+            self.programs[kernel] = program
+
+    def _allocate_buffers(self):
+        self.buffers["input"] = pyopencl.array.empty(self.queue, self.shape, dtype=numpy.float32)
+        self.buffers["output"] = pyopencl.array.empty(self.queue, self.out_shape, dtype=numpy.float32)
+        self.buffers["sum"] = pyopencl.array.empty(self.queue, self.out_shape, dtype=numpy.float32)
+        self.buffers["count"] = pyopencl.array.empty(self.queue, self.out_shape, dtype=numpy.float32)
+        self.buffers["tmp_count"] = pyopencl.array.empty(self.queue, self.out_shape, dtype=numpy.float32)
+        self.buffers["matrix"] = pyopencl.array.empty(self.queue, 9, dtype=numpy.float32)
+
+    def reset(self):
+        """
+        Reset the running sum and the contribution counter
+        """
+        self.buffers["sum"].fill(0, self.queue)
+        self.buffers["count"].fill(0, self.queue)
+        self.nb_frames = 0
+
+    def _upload(self, image):
+        """
+        Provide the image as a float32 device array, without copy if already on the device
+        """
+        if tuple(image.shape) != self.shape:
+            raise RuntimeError("Unable to warp an image of shape %s with a plan for images of shape %s" % (image.shape, self.shape))
+        if isinstance(image, pyopencl.array.Array):
+            if image.dtype != numpy.float32:
+                raise RuntimeError("Device images have to be float32, got %s" % image.dtype)
+            return image
+        image = numpy.ascontiguousarray(image, dtype=numpy.float32)
+        evt = pyopencl.enqueue_copy(self.queue, self.buffers["input"].data, image)
+        if self.profile: self.events.append(("copy", evt))
+        return self.buffers["input"]
+
+    def _transform(self, image, matrix, output, count, accumulate):
+        matrix = as_matrix(matrix)
+        evt = pyopencl.enqueue_copy(self.queue, self.buffers["matrix"].data, matrix.ravel())
+        if self.profile: self.events.append(("copy matrix", evt))
+        image = self._upload(image)
+        evt = self.programs["preprocess"].__getattr__(self.kernel_name)(self.queue, self.procsize, self.wgsize,
+                    image.data,  # const __global float *image_in,
+                    output.data,  # __global float *image_out,
+                    count.data,  # __global float *count,
+                    self.buffers["matrix"].data,  # __constant float *matrix,
+                    numpy.int32(accumulate),  # const int accumulate,
+                    self.fill,  # const float fill,
+                    numpy.int32(self.shape[1]), numpy.int32(self.shape[0]),
+                    numpy.int32(self.out_shape[1]), numpy.int32(self.out_shape[0]))
+        if self.profile: self.events.append((self.kernel_name, evt))
+
+    def warp(self, image, matrix):
+        """
+        Warp a single image
+
+        @param image: numpy array or pyopencl array (float32) already on the device
+        @param matrix: 2x3 or 3x3 matrix mapping output coordinates onto input coordinates
+        @return: pyopencl array with the warped image (use .get() to retrieve it)
+        """
+        self._transform(image, matrix, self.buffers["output"], self.buffers["tmp_count"], 0)
+        return self.buffers["output"]
+
+    def accumulate(self, image, matrix):
+        """
+        Warp an image and add it to the running sum
+
+        @param image: numpy array or pyopencl array (float32) already on the device
+        @param matrix: 2x3 or 3x3 matrix mapping output coordinates onto input coordinates
+        """
+        self._transform(image, matrix, self.buffers["sum"], self.buffers["count"], 1)
+        self.nb_frames += 1
+
+    def average(self, device=False):
+        """
+        Calculate the average of all accumulated frames, each pixel being divided
+        by the number of frames which actually contributed to it.
+
+        @param device: if True, return the pyopencl array instead of the numpy array
+        """
+        evt = self.programs["preprocess"].average(self.queue, self.procsize, self.wgsize,
+                                                  self.buffers["sum"].data, self.buffers["count"].data,
+                                                  self.buffers["output"].data, self.fill,
+                                                  numpy.int32(self.out_shape[1]), numpy.int32(self.out_shape[0]))
+        if self.profile: self.events.append(("average", evt))
+        if device:
+            return self.buffers["output"]
+        return self.buffers["output"].get()
+
+    def sum(self):
+        """
+        @return: the running sum of warped frames, on the host
+        """
+        return self.buffers["sum"].get()
+
+    def log_profile(self):
+        t = 0
+        if self.profile:
+            for e in self.events:
+                if "__len__" in dir(e) and len(e) >= 2:
+                    et = 1e-6 * (e[1].profile.end - e[1].profile.start)
+                    print("%50s:\t%.3fms" % (e[0], et))
+                    t += et
+        print("_" * 80)
+        print("%50s:\t%.3fms" % ("Total execution time", t))
@@ -23,10 +23,10 @@ sp2 = fig.add_subplot(1, 2, 2)
 im = sp2.imshow(lena, cmap="gray")
 
 for i in range(kp.shape[0]):
-    x = kp[i, 0]
-    y = kp[i, 1]
-    scale = kp[i, 2]
-    angle = kp[i, 3]
+    x = kp[i].x
+    y = kp[i].y
+    scale = kp[i].scale
+    angle = kp[i].angle
     sp1.annotate("", xy=(x, y), xytext=(x + scale * cos(angle), y + scale * sin(angle)), color="red",
                      arrowprops=dict(facecolor='red', edgecolor='red', width=1),)
 
@@ -70,7 +70,7 @@ print res[:, 4:].max()
 for p0 in range(kp.shape[0]):
     best = sys.maxint
     best_id = -1
-    kpi = kp[p0]
+    kpi = numpy.array([kp[p0].x, kp[p0].y, kp[p0].scale, kp[p0].angle])
     for p1 in range(ref.shape[0]):
         refj = ref[p1]
         d = ((kpi - refj) ** 2).sum()
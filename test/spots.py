@@ -24,10 +24,10 @@ sp2 = fig.add_subplot(1, 2, 2)
 im = sp2.imshow(lena, cmap="gray")
 
 for i in range(kp.shape[0]):
-    x = kp[i, 0]
-    y = kp[i, 1]
+    x = kp[i].x
+    y = kp[i].y
     print (x,y)
-    scale = kp[i, 2]
+    scale = kp[i].scale
     for angle in np.linspace(0.0,2*pi,4,endpoint=False)+pi/4:
         sp1.annotate("", xy=(x, y), xytext=(x + scale * cos(angle), y + scale * sin(angle)), color="red",
                      arrowprops=dict(facecolor='red', edgecolor='red', width=1),)
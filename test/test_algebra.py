@@ -182,6 +182,86 @@ class test_algebra(unittest.TestCase):
             logger.info("Compact operation took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
 
 
+    def test_compact_scan(self):
+        """
+        tests the compaction by prefix sum: compact_scan, compact_scan_blocks, compact_scatter and compact_copy
+        """
+        nbkeypoints = 10000
+        start, end = 1000, 9000
+        keypoints = numpy.random.rand(nbkeypoints, 4).astype(numpy.float32)
+        keypoints[numpy.random.rand(nbkeypoints) < 0.75] = -1
+        wg = (128,)
+        procsize = calc_size((end - start,), wg)
+        nb_blocks = numpy.int32(procsize[0] // wg[0])
+        gpu_keypoints = pyopencl.array.to_device(queue, keypoints)
+        output = pyopencl.array.empty(queue, (nbkeypoints, 4), dtype=numpy.float32)
+        positions = pyopencl.array.empty(queue, nbkeypoints, dtype=numpy.int32)
+        block_sums = pyopencl.array.empty(queue, nb_blocks, dtype=numpy.int32)
+        counter = pyopencl.array.empty(queue, 1, dtype=numpy.int32)
+        local = pyopencl.LocalMemory(4 * wg[0])
+        start, end = numpy.int32(start), numpy.int32(end)
+
+        t0 = time.time()
+        k1 = self.program.compact_scan(queue, procsize, wg, gpu_keypoints.data, positions.data, block_sums.data,
+                                       local, start, end)
+        k2 = self.program.compact_scan_blocks(queue, wg, wg, block_sums.data, nb_blocks, counter.data, start, local)
+        k3 = self.program.compact_scatter(queue, procsize, wg, gpu_keypoints.data, output.data, positions.data,
+                                          block_sums.data, start, end)
+        k4 = self.program.compact_copy(queue, procsize, wg, output.data, gpu_keypoints.data, counter.data, start, end)
+        res = gpu_keypoints.get()
+        count = counter.get()[0]
+        t1 = time.time()
+
+        ref = keypoints.copy()
+        valid = keypoints[start:end][keypoints[start:end, 1] != -1]
+        ref[start:end] = -1
+        ref[start:start + valid.shape[0]] = valid
+        self.assert_(count == start + valid.shape[0], "count=%s ref=%s" % (count, start + valid.shape[0]))
+        delta = abs(res - ref).max()
+        self.assert_(delta == 0, "order is kept, delta=%s" % (delta))
+        logger.info("delta=%s" % delta)
+        if PROFILE:
+            logger.info("Global execution time: GPU: %.3fms." % (1000.0 * (t1 - t0)))
+            logger.info("Compaction took %.3fms" % (1e-6 * sum(k.profile.end - k.profile.start for k in (k1, k2, k3, k4))))
+
+    def test_mask_keypoints(self):
+        """
+        tests the "mask_keypoints" kernel: keypoints on invalid pixels are discarded
+        """
+        width, height = 64, 48
+        valid = numpy.ones((height, width), dtype=numpy.uint8)
+        valid[10:20, 30:50] = 0
+        nbkeypoints = 500
+        keypoints = -numpy.ones((nbkeypoints, 4), dtype=numpy.float32)
+        keypoints[:, 1] = numpy.random.randint(0, height, nbkeypoints)  # row
+        keypoints[:, 2] = numpy.random.randint(0, width, nbkeypoints)  # col
+        keypoints[:, 0] = keypoints[:, 2] + 0.3
+        keypoints[:, 3] = 1.6
+        keypoints[::7] = -1
+        start, end = 20, 480
+
+        gpu_keypoints = pyopencl.array.to_device(queue, keypoints)
+        gpu_valid = pyopencl.array.to_device(queue, valid)
+        wg = (8,)
+        k1 = self.program.mask_keypoints(queue, calc_size((nbkeypoints,), wg), wg,
+                                         gpu_keypoints.data, gpu_valid.data, numpy.int32(0), numpy.int32(1),
+                                         numpy.int32(start), numpy.int32(end), numpy.int32(width), numpy.int32(height))
+        res = gpu_keypoints.get()
+
+        ref = keypoints.copy()
+        idx = numpy.arange(nbkeypoints)
+        rows = numpy.maximum(keypoints[:, 1], 0).astype(int)
+        cols = numpy.maximum(keypoints[:, 2], 0).astype(int)
+        discard = (idx >= start) & (idx < end) & (keypoints[:, 1] != -1) & (valid[rows, cols] == 0)
+        ref[discard] = -1
+        self.assert_(discard.sum() > 0, "some keypoints are masked")
+        delta = abs(res - ref).max()
+        self.assert_(delta < 1e-5, "delta=%s" % (delta))
+        logger.info("delta=%s, %s keypoints discarded" % (delta, discard.sum()))
+        if PROFILE:
+            logger.info("Mask keypoints took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
+
+
 
 
 
@@ -201,6 +281,8 @@ def test_suite_algebra():
     testSuite = unittest.TestSuite()
     testSuite.addTest(test_algebra("test_combine"))
     testSuite.addTest(test_algebra("test_compact"))
+    testSuite.addTest(test_algebra("test_compact_scan"))
+    testSuite.addTest(test_algebra("test_mask_keypoints"))
     return testSuite
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the alignment of stacks of images (estimate_affine, StackAlign)
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-18"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import scipy, scipy.ndimage
+import sys
+import unittest
+from utilstest import UtilsTest, getLogger, ctx
+import sift
+from sift.alignment import estimate_affine, StackAlign
+logger = getLogger(__file__)
+
+
+class test_alignment(unittest.TestCase):
+    def setUp(self):
+        scene = scipy.ndimage.gaussian_filter(numpy.random.random((400, 700)), 3)
+        self.scene = ((scene - scene.min()) / (scene.max() - scene.min()) * 255).astype(numpy.uint8)
+
+    def tearDown(self):
+        self.scene = None
+
+    def test_estimate_affine(self):
+        """
+        tests the least-squares affine estimation with 20% of outliers
+        """
+        nb = 100
+        matrix = numpy.array([[0.98, -0.12, 15.0], [0.1, 1.03, -7.5], [0.0, 0.0, 1.0]])
+        src = numpy.random.random((nb, 2)) * 500
+        dst = numpy.dot(src, matrix[:2, :2].T) + matrix[:2, 2] + numpy.random.normal(0, 0.05, (nb, 2))
+        outliers = numpy.random.permutation(nb)[:nb // 5]
+        dst[outliers] += numpy.random.uniform(20, 100, (outliers.size, 2))
+        res = estimate_affine(src, dst)
+        self.assert_(abs(res[:2, :2] - matrix[:2, :2]).max() < 1e-3, "linear part %s" % res[:2, :2])
+        self.assert_(abs(res[:2, 2] - matrix[:2, 2]).max() < 0.1, "translation %s" % res[:2, 2])
+        self.assert_(abs(res[2] - [0, 0, 1]).max() == 0, "affine")
+        self.assert_(estimate_affine(src[:2], dst[:2]) is None, "less than 3 points")
+
+    def test_stack_align(self):
+        """
+        tests the alignment of a drifting stack: the last frames do not overlap with the reference
+        and are aligned by chaining the transformations through intermediate anchors
+        """
+        height, width, step = 200, 256, 45
+        offsets = [(i * step, 10 + 2 * i) for i in range(7)]
+        frames = [self.scene[y:y + height, x:x + width] for x, y in offsets]
+        t0 = time.time()
+        sa = StackAlign(frames[0], ctx=ctx, min_match=60)
+        for (x, y), frame in zip(offsets[1:], frames[1:]):
+            matrix = sa.align(frame)
+            self.assert_(matrix is not None, "frame at %s is aligned" % x)
+            # reference coordinates are mapped onto the frame ones
+            expected = numpy.array([[1, 0, offsets[0][0] - x], [0, 1, offsets[0][1] - y], [0, 0, 1]])
+            self.assert_(abs(matrix[:2, :2] - expected[:2, :2]).max() < 0.01, "frame at %s: %s" % (x, matrix))
+            self.assert_(abs(matrix[:2, 2] - expected[:2, 2]).max() < 0.5, "frame at %s: %s" % (x, matrix))
+        t1 = time.time()
+        logger.info("Alignment of %s frames took %.3fs with %s anchors" % (len(frames), t1 - t0, sa.nb_anchors))
+        self.assertEqual(sa.nb_frames, len(frames) - 1)
+        self.assert_(sa.nb_anchors > 1, "transformations were chained")
+
+
+def test_suite_alignment():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_alignment("test_estimate_affine"))
+    testSuite.addTest(test_alignment("test_stack_align"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_alignment()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
@@ -49,6 +49,17 @@ from test_preproc import test_suite_preproc
 from test_convol import test_suite_convol
 from test_algebra import test_suite_algebra
 from test_image import test_suite_image
+from test_matching import test_suite_matching
+from test_warp import test_suite_warp
+from test_alignment import test_suite_alignment
+from test_keyfile import test_suite_keyfile
+from test_plan import test_suite_plan
+from test_stack import test_suite_stack
+from test_live import test_suite_live
+from test_worker import test_suite_worker
+from test_cache import test_suite_cache
+from test_extract import test_suite_extract
+from test_server import test_suite_server
 
 def test_suite_all():
     testSuite = unittest.TestSuite()
@@ -57,6 +68,17 @@ def test_suite_all():
     testSuite.addTest(test_suite_convol())
     testSuite.addTest(test_suite_algebra())
     testSuite.addTest(test_suite_image())
+    testSuite.addTest(test_suite_matching())
+    testSuite.addTest(test_suite_warp())
+    testSuite.addTest(test_suite_alignment())
+    testSuite.addTest(test_suite_keyfile())
+    testSuite.addTest(test_suite_plan())
+    testSuite.addTest(test_suite_stack())
+    testSuite.addTest(test_suite_live())
+    testSuite.addTest(test_suite_worker())
+    testSuite.addTest(test_suite_cache())
+    testSuite.addTest(test_suite_extract())
+    testSuite.addTest(test_suite_server())
     return testSuite
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the cache of keypoints on disk
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import sys, tempfile, shutil
+import unittest
+from utilstest import UtilsTest, getLogger
+import sift
+from sift.cache import KeypointCache, hash_image, hash_parameters
+from test_keyfile import random_keypoints
+logger = getLogger(__file__)
+
+
+class test_cache(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(0)
+        self.tmpdir = tempfile.mkdtemp()
+        self.images = [numpy.random.randint(0, 255, size=(16, 16)).astype(numpy.uint8) for i in range(4)]
+        self.kps = [random_keypoints(nb) for nb in (10, 20, 30, 0)]
+        self.digest = hash_parameters("test")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hash(self):
+        """
+        tests that the keys depend on the content, the shape and the dtype of the image and on the parameters
+        """
+        image = self.images[0]
+        self.assertEqual(hash_image(image), hash_image(image.copy()))
+        self.assertNotEqual(hash_image(image), hash_image(image.view(numpy.int8)))
+        self.assertNotEqual(hash_image(image), hash_image(image.reshape(8, 32)))
+        self.assertEqual(hash_image(image[:, :8]), hash_image(numpy.ascontiguousarray(image[:, :8])))
+        self.assertNotEqual(hash_parameters("test"), hash_parameters("test", 1))
+        cache = KeypointCache(self.tmpdir)
+        self.assertNotEqual(cache.key(image, self.digest), cache.key(image, hash_parameters("other")))
+
+    def test_hit_miss(self):
+        """
+        tests the hits and misses, and that the entries are found again by another cache
+        """
+        cache = KeypointCache(self.tmpdir)
+        keys = [cache.key(image, self.digest) for image in self.images]
+        self.assertEqual(cache.get(keys[0]), None)
+        for key, kp in zip(keys, self.kps):
+            cache.put(key, kp)
+        for key, kp in zip(keys, self.kps):
+            res = cache.get(key)
+            self.assertEqual(res.shape, kp.shape)
+            self.assert_((res == kp).all(), "same keypoints")
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+        other = KeypointCache(self.tmpdir)
+        self.assertEqual(other.size, cache.size)
+        self.assert_((other.get(keys[2]) == self.kps[2]).all(), "entry found by another cache")
+        # removed behind the back of the cache: a miss
+        os.unlink(keys[1])
+        self.assertEqual(cache.get(keys[1]), None)
+        self.assertEqual(cache.misses, 2)
+        self.assert_(keys[1] not in cache.entries, "entry forgotten")
+        cache.clear()
+        self.assertEqual((cache.size, os.listdir(self.tmpdir)), (0, []))
+
+    def test_eviction(self):
+        """
+        tests that the least recently used entries are removed beyond max_size
+        """
+        cache = KeypointCache(self.tmpdir)
+        keys = [cache.key(image, self.digest) for image in self.images[:3]]
+        cache.put(keys[0], self.kps[1])
+        entry_size = cache.size
+        cache.max_size = 2 * entry_size
+        cache.put(keys[1], self.kps[1])
+        cache.entries[keys[0]][0] -= 10
+        cache.entries[keys[1]][0] -= 5
+        self.assert_(cache.get(keys[0]) is not None, "first entry used again")
+        cache.put(keys[2], self.kps[1])
+        self.assertEqual(sorted(cache.entries), sorted([keys[0], keys[2]]))
+        self.assertFalse(os.path.exists(keys[1]), "least recently used entry removed")
+        self.assertEqual(cache.size, 2 * entry_size)
+
+
+def test_suite_cache():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_cache("test_hash"))
+    testSuite.addTest(test_cache("test_hit_miss"))
+    testSuite.addTest(test_cache("test_eviction"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_cache()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
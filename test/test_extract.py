@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the batch extraction of keypoints into .sift files
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import threading
+import numpy
+import sys, tempfile, shutil
+import unittest
+from utilstest import UtilsTest, getLogger
+import sift
+from sift.extract import BatchExtractor, find_files, common_root
+from sift.keyfile import KeypointWriter, KeypointFile, is_complete
+from sift.utils import dtype_kp
+logger = getLogger(__file__)
+
+
+def fake_keypoints(frame):
+    """
+    @return: as many keypoints as the value of the first pixel, at its coordinates
+    """
+    nb = int(frame.flat[0])
+    kp = numpy.recarray(shape=(nb,), dtype=dtype_kp)
+    kp.x = numpy.arange(nb)
+    kp.y = frame.flat[1]
+    kp.scale = 1
+    kp.angle = 0
+    kp.desc = nb
+    return kp
+
+
+class StubPool(object):
+    """
+    Stands for a SiftPool, without any OpenCL device
+    """
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def keypoints(self, frame):
+        with self._lock:
+            self.calls.append((int(frame.flat[0]), int(frame.flat[1])))
+        if frame.flat[0] == 255:
+            raise RuntimeError("failed frame")
+        return fake_keypoints(frame)
+
+
+class StubExtractor(BatchExtractor):
+    def __init__(self, *args, **kwargs):
+        BatchExtractor.__init__(self, *args, **kwargs)
+        self.pool = StubPool()
+
+    def get_pool(self, shape, dtype):
+        return self.pool
+
+
+class test_extract(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmpdir, "data")
+        self.output_dir = os.path.join(self.tmpdir, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def save(self, name, frames):
+        """
+        Save a stack of frames whose first pixel is the number of keypoints and the second the frame number
+        """
+        filename = os.path.join(self.input_dir, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        stack = numpy.zeros((len(frames), 8, 8), dtype=numpy.uint8)
+        stack[:, 0, 0] = frames
+        stack[:, 0, 1] = numpy.arange(len(frames))
+        numpy.save(filename, stack)
+        return filename
+
+    def test_output_names(self):
+        """
+        tests that outputs follow the tree of the inputs, keep their extension and never collide
+        """
+        first = self.save("a/img.npy", [1, 2])
+        second = self.save("b/img.npy", [3])
+        third = self.save("b/img.tif.npy", [4])
+        files = find_files([os.path.join(self.input_dir, "*", "*.npy"), second])
+        self.assertEqual(files, [first, second, third])
+        self.assertEqual(common_root(files), self.input_dir)
+        extractor = StubExtractor(self.output_dir)
+        self.assertEqual(extractor.output_names(files), [os.path.join(self.output_dir, "a", "img.npy.sift"),
+                                                         os.path.join(self.output_dir, "b", "img.npy.sift"),
+                                                         os.path.join(self.output_dir, "b", "img.tif.npy.sift")])
+        self.assertRaises(RuntimeError, extractor.output_names, [first, first])
+        stats = extractor.run(files)
+        self.assertEqual(stats["frames"], 4)
+        self.assertEqual(stats["keypoints"], 10)
+        kf = KeypointFile(os.path.join(self.output_dir, "b", "img.npy.sift"))
+        self.assertEqual(list(kf.sizes()), [3])
+        kf = KeypointFile(os.path.join(self.output_dir, "a", "img.npy.sift"))
+        self.assertEqual(list(kf.sizes()), [1, 2])
+        self.assert_(abs(kf[1].x - numpy.arange(2)).max() == 0, "keypoints of frame 1")
+
+    def test_resume(self):
+        """
+        tests that failed frames are recorded and processed again, and that interrupted outputs are resumed
+        """
+        filename = self.save("stack.npy", [2, 255, 4, 1])
+        output = os.path.join(self.output_dir, "stack.npy.sift")
+        extractor = StubExtractor(self.output_dir, workers=2)
+        stats = extractor.run([filename])
+        self.assertEqual((stats["frames"], stats["errors"]), (3, 1))
+        self.assertEqual(list(KeypointFile(output).sizes()), [2, -1, 4, 1])
+        self.assertFalse(is_complete(output), "output with a failed frame")
+        # the failed frame is fixed: it is processed again, with the next ones
+        filename = self.save("stack.npy", [2, 3, 4, 1])
+        extractor = StubExtractor(self.output_dir)
+        stats = extractor.run([filename])
+        self.assertEqual(sorted(extractor.pool.calls), [(1, 3), (3, 1), (4, 2)])
+        self.assertEqual((stats["resumed"], stats["frames"], stats["errors"]), (1, 3, 0))
+        self.assert_(is_complete(output), "complete output")
+        self.assertEqual(list(KeypointFile(output).sizes()), [2, 3, 4, 1])
+        stats = StubExtractor(self.output_dir).run([filename])
+        self.assertEqual((stats["skipped"], stats["frames"]), (1, 0))
+        # interrupted after 2 frames
+        writer = KeypointWriter(output)
+        writer.write(fake_keypoints(numpy.array([2, 0])))
+        writer.write(fake_keypoints(numpy.array([3, 1])))
+        writer.abort()
+        extractor = StubExtractor(self.output_dir)
+        stats = extractor.run([filename])
+        self.assertEqual(sorted(extractor.pool.calls), [(1, 3), (4, 2)])
+        self.assertEqual(list(KeypointFile(output).sizes()), [2, 3, 4, 1])
+        # no frame left: only the index is written
+        writer = KeypointWriter(output)
+        for nb in (2, 3, 4, 1):
+            writer.write(fake_keypoints(numpy.array([nb, 0])))
+        writer.abort()
+        self.assertFalse(is_complete(output), "interrupted before closing")
+        extractor = StubExtractor(self.output_dir)
+        extractor.run([filename])
+        self.assertEqual(extractor.pool.calls, [])
+        self.assert_(is_complete(output), "closed without processing")
+
+    def test_write_error(self):
+        """
+        tests that an output which cannot be written is given up without blocking the workers,
+        the other outputs being written
+        """
+        first = self.save("a/img.npy", range(1, 11))
+        second = self.save("b/img.npy", [3])
+        os.makedirs(self.output_dir)
+        with open(os.path.join(self.output_dir, "a"), "w") as f:
+            f.write("not a directory")
+        extractor = StubExtractor(self.output_dir, workers=2, depth=1)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(extractor.run([first, second])))
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), "run finished")
+        self.assertEqual((results[0]["frames"], results[0]["errors"]), (1, 1))
+        self.assert_(is_complete(os.path.join(self.output_dir, "b", "img.npy.sift")), "other output written")
+
+
+def test_suite_extract():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_extract("test_output_names"))
+    testSuite.addTest(test_extract("test_resume"))
+    testSuite.addTest(test_extract("test_write_error"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_extract()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
@@ -191,6 +191,62 @@ class test_image(unittest.TestCase):
 
 
 
+    def test_local_maxmin_interp(self):
+        """
+        tests the fused extrema detection and interpolation against local_maxmin followed by interp_keypoint,
+        scale per scale. In both cases the mask is tested at the pixel where the extremum is detected
+        """
+        nb_scales, height, width = 3, 100, 150
+        DOGS = scipy.ndimage.gaussian_filter(numpy.random.randn(nb_scales + 2, height, width), 1.5).astype(numpy.float32) * 100
+        valid = numpy.ones((height, width), dtype=numpy.uint8)
+        valid[:, :width // 3] = 0
+        border_dist, peakthresh = numpy.int32(5), numpy.float32(255.0 * 0.04 / 3.0)
+        EdgeThresh0, EdgeThresh, InitSigma = numpy.float32(0.08), numpy.float32(0.06), numpy.float32(1.6)
+        octsize, nb_keypoints = numpy.int32(1), numpy.int32(10000)
+        width, height = numpy.int32(width), numpy.int32(height)
+        gpu_dogs = pyopencl.array.to_device(queue, DOGS)
+        gpu_valid = pyopencl.array.to_device(queue, valid)
+        output = pyopencl.array.empty(queue, (nb_scales, nb_keypoints, 4), dtype=numpy.float32)
+        counters = pyopencl.array.zeros(queue, (nb_scales,), dtype=numpy.int32)
+        tile_wg = (8, 16, 1)
+        procsize = calc_size((height, width), tile_wg[:2]) + (nb_scales,)
+        local = pyopencl.LocalMemory(3 * (tile_wg[0] + 2) * (tile_wg[1] + 2) * 4)
+
+        t0 = time.time()
+        k1 = self.program.local_maxmin_interp(queue, procsize, tile_wg, gpu_dogs.data, gpu_valid.data, output.data, local,
+                                              border_dist, peakthresh, octsize, EdgeThresh0, EdgeThresh, InitSigma,
+                                              counters.data, nb_keypoints, width, height)
+        res = output.get()
+        count = counters.get()
+        t1 = time.time()
+        ref_output = pyopencl.array.empty(queue, (nb_keypoints, 4), dtype=numpy.float32)
+        ref_counter = pyopencl.array.empty(queue, (1,), dtype=numpy.int32)
+        for scale in range(1, nb_scales + 1):
+            ref_counter.fill(0, queue)
+            self.program.local_maxmin(queue, calc_size((height, width), self.wg), self.wg,
+                                      gpu_dogs.data, ref_output.data, border_dist, peakthresh, octsize,
+                                      EdgeThresh0, EdgeThresh, ref_counter.data, nb_keypoints, numpy.int32(scale),
+                                      width, height)
+            cand = ref_output.get()[:ref_counter.get()[0]]
+            cand = cand[valid[cand[:, 1].astype(int), cand[:, 2].astype(int)] != 0]
+            gpu_kp = pyopencl.array.to_device(queue, numpy.ascontiguousarray(cand))
+            if cand.shape[0]:
+                self.program.interp_keypoint(queue, calc_size((cand.shape[0],), (8,)), (8,), gpu_dogs.data, gpu_kp.data,
+                                             numpy.int32(0), numpy.int32(cand.shape[0]), peakthresh, InitSigma, width, height)
+            ref = gpu_kp.get()
+            ref = ref[ref[:, 1] != -1]
+            found = res[scale - 1, :count[scale - 1]]
+            self.assert_(count[scale - 1] == ref.shape[0], "scale %s: %s keypoints, ref %s" % (scale, count[scale - 1], ref.shape[0]))
+            self.assert_((found[:, 2] >= width // 3 - 1).all(), "scale %s: keypoints are not masked" % scale)
+            ref = ref[numpy.lexsort((ref[:, 2], ref[:, 1]))]
+            found = found[numpy.lexsort((found[:, 2], found[:, 1]))]
+            delta = abs(ref - found).max() if ref.shape[0] else 0
+            self.assert_(delta < 1e-4, "scale %s: delta=%s" % (scale, delta))
+        logger.info("keypoints per scale: %s" % count)
+        if PROFILE:
+            logger.info("Global execution time: GPU: %.3fms." % (1000.0 * (t1 - t0)))
+            logger.info("Fused extrema search and interpolation of all scales took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
+
     def test_interpolation(self):
         """
         tests the keypoints interpolation kernel
@@ -338,7 +394,7 @@ class test_image(unittest.TestCase):
         t0 = time.time()
         k1 = self.program.descriptor(queue, shape, wg, 
             gpu_keypoints.data, gpu_descriptors.data, local_mem, gpu_grad.data, gpu_ori.data,
-            keypoints_start, keypoints_end, grad_width, grad_height)    	
+            keypoints_start, keypoints_end, numpy.int32(1), grad_width, grad_height)
         res = gpu_descriptors.get()
         t1 = time.time()
         
@@ -372,6 +428,36 @@ class test_image(unittest.TestCase):
             logger.info("Global execution time: CPU %.3fms, GPU: %.3fms." % (1000.0 * (t2 - t1), 1000.0 * (t1 - t0)))
             logger.info("Descriptors computation took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
 
+    def test_descriptor_workgroup(self):
+        """
+        tests that the descriptors do not depend on the workgroup size (local scratch indexed by local id)
+        nor on the octave (coordinates scaled by octsize by the orientation assignment)
+        """
+        height, width, nb = 120, 140, 50
+        grad = scipy.ndimage.gaussian_filter(numpy.random.random((height, width)), 1.5).astype(numpy.float32)
+        ori = numpy.random.uniform(-numpy.pi, numpy.pi, (height, width)).astype(numpy.float32)
+        keypoints = numpy.empty((nb, 4), dtype=numpy.float32)
+        keypoints[:, 0] = numpy.random.uniform(20, width - 20, nb)  # column
+        keypoints[:, 1] = numpy.random.uniform(20, height - 20, nb)  # row
+        keypoints[:, 2] = numpy.random.uniform(1.6, 3.0, nb)  # sigma
+        keypoints[:, 3] = numpy.random.uniform(-numpy.pi, numpy.pi, nb)  # angle
+        gpu_grad = pyopencl.array.to_device(queue, grad)
+        gpu_ori = pyopencl.array.to_device(queue, ori)
+        results = []
+        for wg, octsize in (((1,), 1), ((8,), 1), ((8,), 2)):
+            kp = keypoints.copy()
+            kp[:, :3] *= octsize
+            gpu_keypoints = pyopencl.array.to_device(queue, kp)
+            gpu_descriptors = pyopencl.array.zeros(queue, (nb, 128), dtype=numpy.uint8)
+            self.program.descriptor(queue, calc_size((nb,), wg), wg,
+                                    gpu_keypoints.data, gpu_descriptors.data, pyopencl.LocalMemory(wg[0] * 128 * 4),
+                                    gpu_grad.data, gpu_ori.data, numpy.int32(0), numpy.int32(nb), numpy.int32(octsize),
+                                    numpy.int32(width), numpy.int32(height))
+            results.append(gpu_descriptors.get())
+        self.assert_(results[0].max(axis=-1).min() > 0, "all keypoints are described")
+        self.assert_(abs(results[0].astype(int) - results[1]).max() == 0, "same descriptors with a workgroup of 8")
+        self.assert_(abs(results[0].astype(int) - results[2]).max() == 0, "same descriptors with octsize=2")
+
 
 
 
@@ -423,9 +509,11 @@ def test_suite_image():
     testSuite = unittest.TestSuite()
     #testSuite.addTest(test_image("test_gradient"))
     #testSuite.addTest(test_image("test_local_maxmin"))
+    testSuite.addTest(test_image("test_local_maxmin_interp"))
     testSuite.addTest(test_image("test_interpolation"))
     #testSuite.addTest(test_image("test_orientation"))
     #testSuite.addTest(test_image("test_descriptor"))
+    testSuite.addTest(test_image("test_descriptor_workgroup"))
     return testSuite
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the keypoint files: .sift containers and .key text files
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import sys, tempfile, shutil
+import unittest
+from utilstest import UtilsTest, getLogger
+import sift
+from sift.keyfile import KeypointWriter, KeypointFile, is_closed, is_complete, recover_index, read_key, write_key
+from sift.utils import dtype_kp
+logger = getLogger(__file__)
+
+
+def random_keypoints(nb):
+    kp = numpy.recarray(shape=(nb,), dtype=dtype_kp)
+    kp.x = numpy.random.random(nb) * 100
+    kp.y = numpy.random.random(nb) * 100
+    kp.scale = numpy.random.random(nb) * 10
+    kp.angle = numpy.random.random(nb) * 6 - 3
+    kp.desc = numpy.random.randint(0, 256, size=(nb, 128))
+    return kp
+
+
+class test_keyfile(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(0)
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "stack.sift")
+        self.frames = [random_keypoints(nb) for nb in (5, 0, 12, 3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        self.frames = None
+
+    def same(self, kp, ref, what):
+        self.assertEqual(kp.shape, ref.shape, "%s: number of keypoints" % what)
+        for name in dtype_kp.names:
+            self.assert_((kp[name] == ref[name]).all(), "%s: %s" % (what, name))
+
+    def test_round_trip(self):
+        """
+        tests that the frames are read back as written, failed frames being recorded
+        """
+        with KeypointWriter(self.filename) as writer:
+            for kp in self.frames:
+                writer.write(kp)
+            writer.write(None)
+            self.assertEqual(writer.failed(), [4])
+        self.assertFalse(os.path.exists(self.filename + ".idx"), "journal removed")
+        kf = KeypointFile(self.filename)
+        self.assertEqual(len(kf), 5)
+        self.assertEqual(list(kf.sizes()), [5, 0, 12, 3, -1])
+        self.assertEqual(kf.failed(), [4])
+        for i, kp in enumerate(kf):
+            self.same(kp, self.frames[i] if i < 4 else random_keypoints(0), "frame %s" % i)
+        self.assert_(is_closed(self.filename), "closed")
+        self.assertFalse(is_complete(self.filename), "failed frame")
+        with KeypointWriter(self.filename) as writer:
+            writer.write(self.frames[0])
+        self.assert_(is_complete(self.filename), "overwritten")
+        self.assertFalse(is_complete(os.path.join(self.tmpdir, "missing.sift")), "missing")
+
+    def test_resume(self):
+        """
+        tests the recovery of an interrupted file from its journal, and of a closed file up to its first failure
+        """
+        writer = KeypointWriter(self.filename)
+        for kp in self.frames[:3]:
+            writer.write(kp)
+        writer.abort()
+        self.assertFalse(is_closed(self.filename), "interrupted")
+        self.assertEqual(list(recover_index(self.filename)["size"]), [5, 0, 12])
+        # the last frame was only partially written
+        with open(self.filename, "r+b") as f:
+            f.truncate(os.path.getsize(self.filename) - 10)
+        self.assertEqual(list(recover_index(self.filename)["size"]), [5, 0])
+        self.assertRaises(RuntimeError, KeypointWriter, self.filename, 3)
+        with KeypointWriter(self.filename, keep=2) as writer:
+            self.assertEqual(len(writer), 2)
+            writer.write(self.frames[2])
+            writer.write(None)
+            writer.write(self.frames[3])
+        self.assertEqual(list(recover_index(self.filename)["size"]), [5, 0, 12])
+        with KeypointWriter(self.filename, keep=3) as writer:
+            writer.write(self.frames[1])
+            writer.write(self.frames[3])
+        self.assert_(is_complete(self.filename), "resumed file complete")
+        kf = KeypointFile(self.filename)
+        self.assertEqual(list(kf.sizes()), [5, 0, 12, 0, 3])
+        self.same(kf[2], self.frames[2], "kept frame")
+        self.same(kf[4], self.frames[3], "appended frame")
+        self.assertEqual(len(recover_index(os.path.join(self.tmpdir, "missing.sift"))), 0)
+
+    def test_key(self):
+        """
+        tests the text format of D. Lowe
+        """
+        filename = os.path.join(self.tmpdir, "image.key")
+        kp = self.frames[2]
+        write_key(filename, kp)
+        with open(filename) as f:
+            self.assertEqual(f.readline().split(), ["12", "128"])
+        res = read_key(filename)
+        self.assertEqual(res.shape, kp.shape)
+        self.assert_(abs(res.x - kp.x).max() < 0.01, "x")
+        self.assert_(abs(res.y - kp.y).max() < 0.01, "y")
+        self.assert_(abs(res.scale - kp.scale).max() < 0.01, "scale")
+        self.assert_(abs(res.angle - kp.angle).max() < 0.001, "angle")
+        self.assert_((res.desc == kp.desc).all(), "descriptors")
+
+
+def test_suite_keyfile():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_keyfile("test_round_trip"))
+    testSuite.addTest(test_keyfile("test_resume"))
+    testSuite.addTest(test_keyfile("test_key"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_keyfile()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
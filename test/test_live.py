@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the live-stream front-end (LiveSift) and its drop policies
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import sys, threading
+import unittest
+from utilstest import UtilsTest, getLogger
+import sift
+from sift.live import LiveSift
+logger = getLogger(__file__)
+
+
+class StubPlan(object):
+    """
+    Stands for a SiftPlan: the "keypoints" of a frame are its first pixel,
+    the calculation waiting for the gate to be open
+    """
+    def __init__(self, shape=(4, 5)):
+        self.shape = shape
+        self.buffers = {}
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def input_buffer(self, slot=0):
+        if slot not in self.buffers:
+            self.buffers[slot] = numpy.empty(self.shape, dtype=numpy.int32)
+        return self.buffers[slot]
+
+    def keypoints(self, image):
+        self.started.set()
+        self.gate.wait()
+        if image[0, 0] < 0:
+            raise RuntimeError("invalid frame")
+        return image[0, 0].copy()
+
+
+class test_live(unittest.TestCase):
+    def setUp(self):
+        self.plan = StubPlan()
+        self.results = []
+
+    def tearDown(self):
+        self.plan.gate.set()
+        self.plan = None
+
+    def callback(self, index, kp):
+        self.results.append((index, int(kp)))
+
+    def frame(self, value):
+        return numpy.zeros(self.plan.shape, dtype=numpy.int32) + value
+
+    def start(self, policy, depth):
+        """
+        start a LiveSift whose worker is busy with frame 0
+        """
+        live = LiveSift(self.plan, depth=depth, policy=policy, callback=self.callback)
+        live.start()
+        live.push(self.frame(0))
+        self.assert_(self.plan.started.wait(10), "frame 0 is being processed")
+        return live
+
+    def test_block(self):
+        """
+        tests that with the block policy the acquisition waits for a free slot and no frame is lost
+        """
+        self.assertRaises(RuntimeError, LiveSift, self.plan, policy="wrong")
+        live = LiveSift(self.plan, depth=2, policy="block")
+        self.assertRaises(RuntimeError, live.push, self.frame(0))
+        live = self.start("block", 2)
+        live.push(self.frame(1))
+        pushed = threading.Event()
+
+        def push():
+            live.push(self.frame(2))
+            pushed.set()
+        thread = threading.Thread(target=push)
+        thread.start()
+        self.assert_(not pushed.wait(0.2), "the acquisition is blocked while all slots are busy")
+        self.plan.gate.set()
+        thread.join()
+        for value in range(3, 20):
+            live.push(self.frame(value))
+        live.stop()
+        self.assertEqual(self.results, [(i, i) for i in range(20)])
+        stats = live.statistics()
+        self.assertEqual((stats["received"], stats["processed"], stats["dropped"]), (20, 20, 0))
+        self.assert_(stats["latency_50"] is not None, "latencies")
+
+    def test_drop_oldest(self):
+        """
+        tests that with the drop_oldest policy the oldest pending frame makes room for the new one
+        """
+        live = self.start("drop_oldest", 2)
+        for value in (1, 2, 3):
+            self.assert_(live.push(self.frame(value)), "frame %s queued" % value)
+        self.plan.gate.set()
+        live.stop()
+        self.assertEqual(self.results, [(0, 0), (3, 3)])
+        self.assertEqual(live.nb_dropped, 2)
+
+    def test_latest(self):
+        """
+        tests that with the latest policy only the most recent frame is kept
+        """
+        live = self.start("latest", 4)
+        for value in (1, 2, 3):
+            live.push(self.frame(value))
+        self.assertEqual(live.statistics()["pending"], 1)
+        self.plan.gate.set()
+        live.stop()
+        self.assertEqual(self.results, [(0, 0), (3, 3)])
+        self.assertEqual(live.nb_dropped, 2)
+
+    def test_stop(self):
+        """
+        tests errors and stopping without flushing the pending frames
+        """
+        live = self.start("block", 4)
+        live.push(self.frame(-1), index=10)
+        live.push(self.frame(2))
+        # stop waits for frame 0, released once the pending frames are dropped
+        threading.Timer(0.2, self.plan.gate.set).start()
+        live.stop(flush=False)
+        self.assertEqual(live.nb_dropped, 2)
+        live.start()
+        live.push(self.frame(-1), index=10)
+        live.push(self.frame(4), index=11)
+        live.stop()
+        self.assertEqual(self.results, [(0, 0), (11, 4)])
+        self.assertEqual(live.nb_errors, 1)
+        self.assertEqual(live.last_result[0], 11)
+
+    def test_callback_error(self):
+        """
+        tests that an error in the callback does not stop the worker: the next frames are processed
+        and pushing never blocks for ever
+        """
+        def callback(index, kp):
+            if index == 1:
+                raise ValueError("display closed")
+            self.callback(index, kp)
+        self.plan.gate.set()
+        live = LiveSift(self.plan, depth=2, policy="block", callback=callback)
+        live.start()
+        for value in range(6):
+            live.push(self.frame(value))
+        live.stop()
+        self.assertEqual(self.results, [(i, i) for i in range(6) if i != 1])
+        self.assertEqual(live.nb_errors, 1)
+        self.assertEqual(live.nb_processed, 6)
+
+
+def test_suite_live():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_live("test_block"))
+    testSuite.addTest(test_live("test_drop_oldest"))
+    testSuite.addTest(test_live("test_latest"))
+    testSuite.addTest(test_live("test_stop"))
+    testSuite.addTest(test_live("test_callback_error"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_live()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
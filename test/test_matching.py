@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the matching kernel
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-18"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+import time, os, logging
+import numpy
+import pyopencl, pyopencl.array
+import sys
+import unittest
+from utilstest import UtilsTest, getLogger, ctx
+import sift
+from sift.utils import calc_size
+from sift.keypoints import to_records
+logger = getLogger(__file__)
+if logger.getEffectiveLevel() <= logging.INFO:
+    PROFILE = True
+    queue = pyopencl.CommandQueue(ctx, properties=pyopencl.command_queue_properties.PROFILING_ENABLE)
+else:
+    PROFILE = False
+    queue = pyopencl.CommandQueue(ctx)
+
+
+def my_matching(desc1, desc2, ratio):
+    """
+    Reference brute-force matching with L1 distance and ratio test
+    """
+    matches = []
+    d2 = desc2.astype(numpy.int32)
+    for i, d in enumerate(desc1.astype(numpy.int32)):
+        dist = abs(d2 - d).sum(axis=-1)
+        order = dist.argsort()
+        if dist[order[1]] != 0 and dist[order[0]] < ratio * dist[order[1]]:
+            matches.append((i, order[0]))
+    return numpy.array(matches, dtype=numpy.int32).reshape(-1, 2)
+
+
+class test_matching(unittest.TestCase):
+    def setUp(self):
+        kernel_path = os.path.join(os.path.dirname(os.path.abspath(sift.__file__)), "matching.cl")
+        kernel_src = open(kernel_path).read()
+        self.program = pyopencl.Program(ctx, kernel_src).build()
+        self.wg = (64,)
+
+    def tearDown(self):
+        self.program = None
+
+    def test_matching(self):
+        """
+        tests the matching kernel on a shuffled and noisy copy of random descriptors
+        """
+        nb = 500
+        ratio = numpy.float32(sift.param.par.MatchRatio)
+        desc2 = numpy.random.randint(0, 256, size=(nb, 128)).astype(numpy.uint8)
+        perm = numpy.random.permutation(nb)
+        noise = numpy.random.randint(-5, 6, size=(nb, 128))
+        desc1 = numpy.clip(desc2[perm].astype(numpy.int32) + noise, 0, 255).astype(numpy.uint8)
+        gpu_desc1 = pyopencl.array.to_device(queue, desc1)
+        gpu_desc2 = pyopencl.array.to_device(queue, desc2)
+        gpu_match = pyopencl.array.empty(queue, (nb, 2), dtype=numpy.int32)
+        gpu_cnt = pyopencl.array.zeros(queue, (1,), dtype=numpy.int32)
+        t0 = time.time()
+        k1 = self.program.matching(queue, calc_size((nb,), self.wg), self.wg,
+                                   gpu_desc1.data, gpu_desc2.data, gpu_match.data, gpu_cnt.data,
+                                   numpy.int32(nb), ratio, numpy.int32(nb), numpy.int32(nb))
+        cnt = gpu_cnt.get()[0]
+        res = gpu_match.get()[:cnt]
+        t1 = time.time()
+        ref = my_matching(desc1, desc2, ratio)
+        t2 = time.time()
+        res = res[res[:, 0].argsort()]
+        self.assertEqual(cnt, ref.shape[0], "same number of matches %s %s" % (cnt, ref.shape[0]))
+        self.assert_(abs(res - ref).max() == 0, "same matches")
+        self.assert_(abs(perm[res[:, 0]] - res[:, 1]).max() == 0, "matches are the permutation")
+        if PROFILE:
+            logger.info("Global execution time: CPU %.3fms, GPU: %.3fms." % (1000.0 * (t2 - t1), 1000.0 * (t1 - t0)))
+            logger.info("Matching took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
+
+    def test_match_reference(self):
+        """
+        tests MatchPlan.match of several sets of keypoints against a reference resident on the device,
+        the buffers being grown on demand
+        """
+        nb = 300
+        ratio = numpy.float32(sift.param.par.MatchRatio)
+        ref_desc = numpy.random.randint(0, 256, size=(nb, 128)).astype(numpy.uint8)
+        # x holds the index of the keypoint, to identify the matching pairs
+        ref_kp = to_records(numpy.outer(numpy.arange(nb), numpy.ones(4)).astype(numpy.float32), ref_desc)
+        mp = sift.MatchPlan(size=100, ctx=ctx)
+        self.assertRaises(RuntimeError, mp.match, ref_kp)
+        mp.set_reference(ref_kp)
+        self.assertEqual(mp.ref_size, nb)
+        for size in (50, 400):
+            perm = numpy.random.randint(0, nb, size)
+            noise = numpy.random.randint(-5, 6, size=(size, 128))
+            desc = numpy.clip(ref_desc[perm].astype(numpy.int32) + noise, 0, 255).astype(numpy.uint8)
+            kp = to_records(numpy.outer(numpy.arange(size), numpy.ones(4)).astype(numpy.float32), desc)
+            raw = mp.match(kp, raw_results=True)
+            raw = raw[raw[:, 0].argsort()]
+            ref = my_matching(desc, ref_desc, ratio)
+            self.assertEqual(raw.shape[0], ref.shape[0], "same number of matches %s %s" % (raw.shape[0], ref.shape[0]))
+            self.assert_(abs(raw - ref).max() == 0, "same matches against the resident reference")
+            res = mp.match(kp)
+            self.assertEqual(res.shape, (ref.shape[0], 2))
+            pairs = numpy.vstack((res[:, 0].x, res[:, 1].x)).T.astype(numpy.int32)
+            pairs = pairs[pairs[:, 0].argsort()]
+            self.assert_(abs(pairs - ref).max() == 0, "pairs of keypoints (frame, reference)")
+            self.assert_((res[:, 0].desc == desc[res[:, 0].x.astype(int)]).all(), "descriptors of the keypoints")
+        self.assert_(mp.kpsize >= 400, "buffers were grown")
+        self.assertEqual(mp.ref_size, nb, "the reference survived the growth")
+
+
+def test_suite_matching():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_matching("test_matching"))
+    testSuite.addTest(test_matching("test_match_reference"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_matching()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
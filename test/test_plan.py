@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the keypoint extraction plan (SiftPlan)
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-18"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging, math
+import numpy
+import scipy, scipy.ndimage
+import sys
+import unittest
+import pyopencl, pyopencl.array
+from utilstest import UtilsTest, getLogger, ctx
+import sift
+from sift.keypoints import dtype_kp
+from sift.param import par
+from test_preproc import bin_mean
+logger = getLogger(__file__)
+
+
+def textured_image(shape=(200, 256), seed=0):
+    """
+    Smoothed noise, rich in keypoints, as uint8 (always the same for a given seed)
+    """
+    numpy.random.seed(seed)
+    img = scipy.ndimage.gaussian_filter(numpy.random.random(shape), 3)
+    return ((img - img.min()) / (img.max() - img.min()) * 255).astype(numpy.uint8)
+
+
+def sort_keypoints(kp):
+    """
+    Keypoints are appended by atomic operations, in an order which changes from one run to the other
+
+    @param kp: record array of keypoints
+    @return: the keypoints sorted by position then scale
+    """
+    return kp[numpy.lexsort((kp.scale, kp.y, kp.x))]
+
+
+def pack12(img):
+    """
+    Pack 12-bit pixels two by two in three bytes (Mono12p)
+
+    @param img: uint16 image with an even number of pixels
+    @return: 1D uint8 array
+    """
+    pixels = img.ravel()
+    packed = numpy.empty(pixels.size * 3 // 2, dtype=numpy.uint8)
+    packed[0::3] = pixels[0::2] & 0xFF
+    packed[1::3] = (pixels[0::2] >> 8) | ((pixels[1::2] & 0xF) << 4)
+    packed[2::3] = pixels[1::2] >> 4
+    return packed
+
+def upsample2(img):
+    """
+    Numpy implementation of the upsample2 kernel: bilinear interpolation on a grid twice finer,
+    the last row and column being replicated
+
+    @return: float32 image of twice the shape of img
+    """
+    img = img.astype(numpy.float32)
+    pad = numpy.pad(img, ((0, 1), (0, 1)), mode="edge")
+    big = numpy.empty((2 * img.shape[0], 2 * img.shape[1]), dtype=numpy.float32)
+    big[0::2, 0::2] = img
+    big[0::2, 1::2] = 0.5 * (pad[:-1, :-1] + pad[:-1, 1:])
+    big[1::2, 0::2] = 0.5 * (pad[:-1, :-1] + pad[1:, :-1])
+    big[1::2, 1::2] = 0.25 * (pad[:-1, :-1] + pad[:-1, 1:] + pad[1:, :-1] + pad[1:, 1:])
+    return big
+
+def common_keypoints(kp, ref, tol=0.01):
+    """
+    @param kp: record array of keypoints
+    @param ref: record array of the reference keypoints
+    @param tol: tolerance on the position in pixels, relative on the scale
+    @return: fraction of the reference keypoints found in kp (at the same position and scale)
+    """
+    if ref.shape[0] == 0:
+        return 1.0
+    close = (abs(ref.x[:, None] - kp.x[None, :]) < tol) & (abs(ref.y[:, None] - kp.y[None, :]) < tol)
+    close &= abs(ref.scale[:, None] - kp.scale[None, :]) < tol * ref.scale[:, None]
+    return close.any(axis=1).mean()
+
+
+def percentile_range(img, nbins, low, high, mask=None):
+    """
+    Numpy implementation of the histogram and percentile_range kernels
+
+    @param low, high: percentiles as fractions (i.e. 0.01 and 0.99)
+    @param mask: non zero for the pixels excluded from the histogram
+    @return: the low and high percentiles, at the edges of the bins of the histogram between min and max
+    """
+    data = img.astype(numpy.float32)
+    if mask is not None:
+        data = data[numpy.logical_not(mask)]
+    data = data.ravel()
+    mini, maxi = data.min(), data.max()
+    scale = numpy.float32(nbins) / (maxi - mini)
+    hist = numpy.bincount(numpy.clip(((data - mini) * scale).astype(int), 0, nbins - 1), minlength=nbins)
+    cumsum = numpy.cumsum(hist)
+    low_bin = numpy.argmax(cumsum > low * cumsum[-1])
+    high_bin = numpy.argmax(cumsum >= high * cumsum[-1])
+    width = (maxi - mini) / numpy.float32(nbins)
+    return mini + low_bin * width, mini + (high_bin + 1) * width
+
+
+class test_plan(unittest.TestCase):
+    def setUp(self):
+        self.image = textured_image()
+
+    def tearDown(self):
+        self.image = None
+
+    def same_keypoints(self, kp, ref, what):
+        """
+        check that two sets of keypoints are the same, whatever their order
+        """
+        kp = sort_keypoints(kp)
+        ref = sort_keypoints(ref)
+        self.assertEqual(kp.shape, ref.shape, "%s: %s keypoints instead of %s" % (what, kp.shape[0], ref.shape[0]))
+        for field in ("x", "y", "scale", "angle"):
+            delta = abs(kp[field] - ref[field]).max()
+            self.assert_(delta < 1e-4, "%s: delta on %s is %s" % (what, field, delta))
+        self.assert_((kp.desc == ref.desc).all(), "%s: same descriptors" % what)
+
+    def test_keypoints_records(self):
+        """
+        tests that keypoints are returned as a record array with the descriptors calculated on the device
+        """
+        plan = sift.SiftPlan(template=self.image, ctx=ctx)
+        kp = plan.keypoints(self.image)
+        self.assertEqual(kp.dtype, dtype_kp)
+        self.assert_(kp.shape[0] > 10, "keypoints found: %s" % kp.shape[0])
+        self.assert_(kp.desc.max(axis=-1).min() > 0, "all keypoints are described")
+        self.assert_((kp.x >= 0).all() and (kp.x < self.image.shape[1]).all(), "x is the column")
+        self.assert_((kp.y >= 0).all() and (kp.y < self.image.shape[0]).all(), "y is the row")
+        dkp = plan.keypoints(self.image, device=True)
+        self.assertEqual(len(dkp), kp.shape[0])
+        self.assertEqual(dkp.get().dtype, dtype_kp)
+
+    def test_output_growth(self):
+        """
+        tests that no keypoint is dropped when the contiguous output of all octaves is too small
+        """
+        ref = sort_keypoints(sift.SiftPlan(template=self.image, ctx=ctx).keypoints(self.image))
+        plan = sift.SiftPlan(template=self.image, ctx=ctx, output_size=1)
+        kp = sort_keypoints(plan.keypoints(self.image))
+        self.assert_(plan.output_size >= ref.shape[0], "output grown to %s" % plan.output_size)
+        self.assertEqual(kp.shape, ref.shape)
+        self.assert_(abs(kp.x - ref.x).max() < 1e-4, "same positions")
+        self.assert_(abs(kp.y - ref.y).max() < 1e-4, "same positions")
+        self.assert_((kp.desc == ref.desc).all(), "same descriptors")
+
+    def test_device_input(self):
+        """
+        tests that images already on the device (pyopencl array or buffer) give the keypoints of the same
+        images on the host, converted in place (uint8) or copied device to device (float32)
+        """
+        for image in (self.image, self.image.astype(numpy.float32)):
+            plan = sift.SiftPlan(template=image, ctx=ctx)
+            ref = plan.keypoints(image)
+            d_image = pyopencl.array.to_device(plan.queue, image)
+            self.same_keypoints(plan.keypoints(d_image), ref, "%s array" % image.dtype)
+            self.same_keypoints(plan.keypoints(d_image.data), ref, "%s buffer" % image.dtype)
+            queue = pyopencl.CommandQueue(ctx)
+            shared = sift.SiftPlan(template=image, queue=queue)
+            self.assert_(shared.queue is queue, "queue re-used")
+            self.same_keypoints(shared.keypoints(pyopencl.array.to_device(queue, image)), ref, "external queue")
+
+    def test_pinned_upload(self):
+        """
+        tests that the page-locked staging (or zero-copy on devices sharing the host memory) gives the keypoints
+        of plain transfers, for frames written in input_buffer and for temporary copies of the input as well
+        """
+        ref = sift.SiftPlan(template=self.image, ctx=ctx, pinned=False).keypoints(self.image)
+        plan = sift.SiftPlan(template=self.image, ctx=ctx, pinned=True)
+        logger.info("zero-copy transfers: %s" % plan.zero_copy)
+        self.same_keypoints(plan.keypoints(self.image), ref, "pinned")
+        frame = plan.input_buffer(1)
+        frame[...] = self.image
+        self.same_keypoints(plan.keypoints(frame), ref, "input buffer")
+        # a Fortran-ordered image is copied into a temporary contiguous one before the transfer
+        self.same_keypoints(plan.keypoints(numpy.asfortranarray(self.image)), ref, "temporary copy")
+        self.same_keypoints(plan.keypoints(self.image, device=True).get(), ref, "device output")
+
+    def test_iter_keypoints(self):
+        """
+        tests that the frames of a generator, read in advance, give their keypoints in order
+        """
+        frames = [textured_image(seed=i) for i in range(4)]
+        plan = sift.SiftPlan(template=frames[0], ctx=ctx)
+        refs = [plan.keypoints(frame) for frame in frames]
+        indexes = []
+        for index, kp, desc in plan.iter_keypoints((frame for frame in frames), depth=2):
+            self.same_keypoints(kp, refs[index], "frame %s" % index)
+            self.assert_((desc == kp.desc).all(), "descriptors of frame %s" % index)
+            indexes.append(index)
+        self.assertEqual(indexes, range(len(frames)))
+
+    def test_concurrent_calls(self):
+        """
+        tests that synchronous calls made while the worker of the plan is busy do not mix their results
+        """
+        frames = [textured_image(seed=i) for i in range(4)]
+        plan = sift.SiftPlan(template=frames[0], ctx=ctx)
+        refs = [plan.keypoints(frame) for frame in frames]
+        futures = [plan.keypoints_async(frame) for frame in frames]
+        for i, frame in enumerate(frames):
+            self.same_keypoints(plan.keypoints(frame), refs[i], "synchronous frame %s" % i)
+        for i, future in enumerate(futures):
+            self.same_keypoints(future.result(), refs[i], "asynchronous frame %s" % i)
+        plan.worker.stop()
+
+    def test_recorded_launches(self):
+        """
+        tests that the replayed launches, recorded once, give the same gaussian pyramid and DoG
+        as the kernels launched one by one with the current buffers
+        """
+        plan = sift.SiftPlan(template=textured_image(), ctx=ctx)
+        plan.keypoints(textured_image(seed=1))
+        plan.keypoints(textured_image(seed=2))
+        queue = plan.queue
+        convolution = plan.programs["convolution"]
+        for octave in range(plan.octave_max):
+            scales = plan.scales[octave]
+            procsize, wgsize = plan.procsize[octave], plan.wgsize[octave]
+            shape = plan.buffers[(octave, 0)].shape
+            tmp = pyopencl.array.empty(queue, shape, numpy.float32)
+            blurred = [plan.buffers[(octave, 0)]]
+            prevSigma = par.InitSigma
+            for scale in range(par.Scales + 2):
+                sigma = prevSigma * math.sqrt(plan.sigmaRatio ** 2 - 1.0)
+                gaussian = plan.buffers["gaussian_%s" % sigma]
+                output = pyopencl.array.empty(queue, shape, numpy.float32)
+                convolution.horizontal_convolution(queue, procsize, wgsize, blurred[-1].data, tmp.data, gaussian.data,
+                                                   numpy.int32(gaussian.size), *scales)
+                convolution.vertical_convolution(queue, procsize, wgsize, tmp.data, output.data, gaussian.data,
+                                                 numpy.int32(gaussian.size), *scales)
+                blurred.append(output)
+                prevSigma *= plan.sigmaRatio
+            dogs = plan.buffers[(octave, "DoGs")].get()
+            for scale in range(1, par.Scales + 3):
+                ref = blurred[scale].get()
+                res = plan.buffers[(octave, scale)].get()
+                self.assert_(abs(res - ref).max() < 1e-4, "octave %s, blur %s" % (octave, scale))
+                dog = blurred[scale - 1].get() - ref
+                self.assert_(abs(dogs[scale - 1] - dog).max() < 1e-4, "octave %s, DoG %s" % (octave, scale - 1))
+
+    def test_binning(self):
+        """
+        tests that the keypoints of a binned plan are those of the image binned on the CPU, rescaled to the input:
+        x_input = x * bin_w + (bin_w - 1) / 2, y likewise and scale * sqrt(bin_w * bin_h)
+        """
+        image = textured_image((401, 515))
+        # same min and max after binning: same normalization
+        image[:2, :2] = image.min()
+        image[:2, 2:4] = image.max()
+        binsize = (2, 2)  # partial bins of 1x2, 2x1 and 1x1 pixels: exact means in float32
+        plan = sift.SiftPlan(template=image, binning=binsize, ctx=ctx)
+        self.assertEqual(plan.binned_shape, (201, 258))
+        binned = bin_mean(image, binsize)
+        ref = sift.SiftPlan(template=binned, ctx=ctx).keypoints(binned)
+        self.assert_(ref.shape[0] > 0, "keypoints found")
+        ref.x = ref.x * binsize[1] + (binsize[1] - 1) / 2.0
+        ref.y = ref.y * binsize[0] + (binsize[0] - 1) / 2.0
+        ref.scale = ref.scale * numpy.sqrt(binsize[0] * binsize[1])
+        self.same_keypoints(plan.keypoints(image), ref, "binning %sx%s" % binsize)
+
+    def test_roi(self):
+        """
+        tests that the keypoints of a region of interest, uploaded by rectangular copies from the host or
+        from the device, are those of the cropped image shifted by the origin of the region,
+        for converted (uint8) and copied (float32) images
+        """
+        row, col, height, width = roi = (23, 41, 150, 190)
+        for image in (self.image, self.image.astype(numpy.float32)):
+            crop = numpy.ascontiguousarray(image[row:row + height, col:col + width])
+            ref = sift.SiftPlan(template=crop, ctx=ctx).keypoints(crop)
+            self.assert_(ref.shape[0] > 0, "keypoints found")
+            ref.x += col
+            ref.y += row
+            plan = sift.SiftPlan(template=image, roi=roi, ctx=ctx)
+            self.same_keypoints(plan.keypoints(image), ref, "%s region of interest" % image.dtype)
+            d_image = pyopencl.array.to_device(plan.queue, image)
+            self.same_keypoints(plan.keypoints(d_image), ref, "%s region of interest on the device" % image.dtype)
+
+    def test_mask(self):
+        """
+        tests that masked pixels have no influence: the keypoints are the same whatever the content
+        of the masked pixels (no edge leaks through the normalization nor the normalized convolution)
+        and none of them lies on a masked pixel
+        """
+        mask = numpy.zeros(self.image.shape, dtype=bool)
+        mask[:, :80] = True  # detector gap
+        mask[120:150, 150:190] = True  # beam stop
+        plan = sift.SiftPlan(template=self.image, mask=mask, ctx=ctx)
+        dark = self.image.copy()
+        dark[mask] = 0
+        ref = plan.keypoints(dark)
+        self.assert_(ref.shape[0] > 0, "keypoints found")
+        rows = numpy.clip(numpy.round(ref.y).astype(int), 0, mask.shape[0] - 1)
+        cols = numpy.clip(numpy.round(ref.x).astype(int), 0, mask.shape[1] - 1)
+        self.assert_(not mask[rows, cols].any(), "%s keypoints on masked pixels" % mask[rows, cols].sum())
+        bright = self.image.copy()
+        bright[mask] = 255
+        self.same_keypoints(plan.keypoints(bright), ref, "bright masked pixels")
+        noisy = self.image.copy()
+        noisy[mask] = numpy.random.randint(0, 256, mask.sum())
+        self.same_keypoints(plan.keypoints(noisy), ref, "noisy masked pixels")
+
+    def test_correction(self):
+        """
+        tests the dark current and flat field correction and the hot pixel filter on the device against a plan fed
+        with the frame corrected on the host: (raw - dark) * gain, the gain being the mean of the dark subtracted
+        flat field divided by it, then the pixels deviating by more than the threshold from the median of their
+        3x3 neighbourhood replaced by this median
+        """
+        numpy.random.seed(1)
+        shape = self.image.shape
+        dark = numpy.random.uniform(90, 110, shape).astype(numpy.float32)
+        flat = numpy.random.uniform(900, 1100, shape).astype(numpy.float32)
+        raw = (self.image.astype(numpy.float32) * 16 * (flat - dark) / 1000 + dark).astype(numpy.uint16)
+        raw.flat[numpy.random.randint(0, raw.size, 30)] = 60000
+        threshold = 500
+        plan = sift.SiftPlan(template=raw, dark=dark, flat=flat, hot_pixels=threshold, ctx=ctx)
+        # same calculation as the plan for the gain, same order as the conversion kernel
+        flat_dark = flat - dark
+        valid = flat_dark > 0
+        gain = numpy.zeros(shape, numpy.float32)
+        gain[valid] = flat_dark[valid].mean() / flat_dark[valid]
+        corrected = (raw.astype(numpy.float32) - dark) * gain
+        median = scipy.ndimage.median_filter(corrected, 3, mode="nearest")
+        corrected = numpy.where(abs(corrected - median) > threshold, median, corrected).astype(numpy.float32)
+        ref = sift.SiftPlan(template=corrected, ctx=ctx).keypoints(corrected)
+        self.assert_(ref.shape[0] > 0, "keypoints found")
+        self.same_keypoints(plan.keypoints(raw), ref, "dark, flat and hot pixels")
+
+    def test_percentiles(self):
+        """
+        tests the normalization between the percentiles of the histogram calculated on the device:
+        the range is the one of the histogram calculated with numpy, a hot pixel does not change the keypoints
+        found away from it (whereas it spoils the min/max normalization) and the keypoints are those of the image
+        normalized on the host. Positions do not depend on the (linear) normalization, only the keypoints close
+        to the thresholds do. With a mask on the hot pixel, it is excluded from the histogram and from the blur
+        """
+        image = self.image.astype(numpy.uint16) * 8
+        row, col = 100, 128
+        hot = image.copy()
+        hot[row, col] = 65535
+
+        def far(kp):
+            # keypoints whose neighbourhood does not see the hot pixel
+            return kp[numpy.sqrt((kp.x - col) ** 2 + (kp.y - row) ** 2) > 30 * kp.scale]
+
+        plan = sift.SiftPlan(template=image, percentiles=1, ctx=ctx)
+        ref = far(plan.keypoints(image))
+        self.assert_(ref.shape[0] > 10, "keypoints found away from the hot pixel: %s" % ref.shape[0])
+        kp = far(plan.keypoints(hot))
+        low, high = plan.buffers["min"].get()[0], plan.buffers["max"].get()[0]
+        ref_low, ref_high = percentile_range(hot, plan.histogram_bins, 0.01, 0.99)
+        self.assert_(abs(low - ref_low) <= 1e-3 * (ref_high - ref_low), "low percentile %s, expected %s" % (low, ref_low))
+        self.assert_(abs(high - ref_high) <= 1e-3 * (ref_high - ref_low), "high percentile %s, expected %s" % (high, ref_high))
+        found = common_keypoints(kp, ref)
+        self.assert_(found > 0.8, "%.0f%% of the keypoints found with a hot pixel" % (100 * found))
+        plain = sift.SiftPlan(template=image, ctx=ctx)
+        found = common_keypoints(far(plain.keypoints(hot)), far(plain.keypoints(image)))
+        self.assert_(found < 0.5, "%.0f%% of the keypoints found with a hot pixel, without percentiles" % (100 * found))
+
+        normalized = (image.astype(numpy.float32) - low) * numpy.float32(255.0 / (high - low))
+        host = far(sift.SiftPlan(template=normalized, ctx=ctx).keypoints(normalized))
+        found = common_keypoints(kp, host)
+        self.assert_(found > 0.8, "%.0f%% of the keypoints of the image normalized on the host" % (100 * found))
+
+        mask = numpy.zeros(image.shape, dtype=bool)
+        mask[row - 1:row + 2, col - 1:col + 2] = True
+        masked = sift.SiftPlan(template=image, percentiles=1, mask=mask, ctx=ctx)
+        ref = masked.keypoints(image)
+        ref_low, ref_high = percentile_range(image, masked.histogram_bins, 0.01, 0.99, mask)
+        self.assert_(abs(masked.buffers["min"].get()[0] - ref_low) <= 1e-3 * (ref_high - ref_low), "masked low percentile")
+        self.assert_(abs(masked.buffers["max"].get()[0] - ref_high) <= 1e-3 * (ref_high - ref_low), "masked high percentile")
+        self.same_keypoints(masked.keypoints(hot), ref, "masked hot pixel")
+
+    def test_layouts(self):
+        """
+        tests that the layouts converted on the device give the keypoints of the equivalent image:
+        float64 (converted on the device or cast on the host) those of the float32 image, packed 12-bit those
+        of the uint16 image, RGBA, planar and 16-bit RGB those of the interleaved RGB image, which are those
+        of its grayscale conversion on the host up to the rounding of the conversion
+        """
+        gray = self.image.astype(numpy.float32)
+        u16 = self.image.astype(numpy.uint16) * 16 + 3
+        rgb = numpy.ascontiguousarray(numpy.dstack((self.image, textured_image(seed=1), textured_image(seed=2))))
+        alpha = numpy.random.randint(0, 256, self.image.shape).astype(numpy.uint8)
+        cases = [("float64", gray, self.image.astype(numpy.float64), None),
+                 ("packed12", u16, pack12(u16), "packed12"),
+                 ("RGBA", rgb, numpy.ascontiguousarray(numpy.dstack((rgb, alpha))), None),
+                 ("planar", rgb, numpy.ascontiguousarray(rgb.transpose(2, 0, 1)), "planar"),
+                 ("RGB16", rgb, rgb.astype(numpy.uint16) * 256, None)]  # gray levels scaled by 256: same normalization
+        refs = {}
+        for name, reference, frame, layout in cases:
+            if id(reference) not in refs:
+                refs[id(reference)] = sift.SiftPlan(template=reference, ctx=ctx).keypoints(reference)
+                self.assert_(refs[id(reference)].shape[0] > 0, "%s: keypoints found" % name)
+            if layout == "packed12":
+                plan = sift.SiftPlan(shape=u16.shape, dtype=numpy.uint8, layout=layout, ctx=ctx)
+            else:
+                plan = sift.SiftPlan(template=frame, layout=layout, ctx=ctx)
+            self.same_keypoints(plan.keypoints(frame), refs[id(reference)], name)
+        r, g, b = (rgb[..., i].astype(numpy.float32) for i in range(3))
+        host_gray = numpy.float32(0.299) * r + numpy.float32(0.587) * g + numpy.float32(0.114) * b
+        ref = sift.SiftPlan(template=host_gray, ctx=ctx).keypoints(host_gray)
+        found = common_keypoints(refs[id(rgb)], ref)
+        self.assert_(found > 0.9, "%.0f%% of the keypoints of the grayscale image converted on the host" % (100 * found))
+
+    def test_double_size(self):
+        """
+        tests the upsampling of the first octave on the device (DoubleImSize) against a plan fed with the image
+        upsampled on the host, whose coordinates and scales are halved.
+        InitSigma is lowered to 0.5 during the test so that neither plan blurs its first octave: the initial blur
+        would differ as the upsampled image is assumed to have a blur of 1.0, and any input image of 0.5
+        """
+        upsampled = upsample2(self.image)  # exact: half and quarter sums of integers
+        init_sigma, double_size = par.InitSigma, par.DoubleImSize
+        try:
+            par["InitSigma"] = 0.5
+            par["DoubleImSize"] = 1
+            plan = sift.SiftPlan(template=self.image, ctx=ctx)
+            par["DoubleImSize"] = 0
+            ref = sift.SiftPlan(template=upsampled, ctx=ctx).keypoints(upsampled)
+            kp = plan.keypoints(self.image)
+        finally:
+            par["InitSigma"] = init_sigma
+            par["DoubleImSize"] = double_size
+        self.assertEqual(tuple(plan.scales[0]), upsampled.shape[::-1])
+        self.assert_(ref.shape[0] > 0, "keypoints found")
+        ref.x *= 0.5
+        ref.y *= 0.5
+        ref.scale *= 0.5
+        self.same_keypoints(kp, ref, "upsampled on the device")
+
+
+def test_suite_plan():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_plan("test_keypoints_records"))
+    testSuite.addTest(test_plan("test_output_growth"))
+    testSuite.addTest(test_plan("test_device_input"))
+    testSuite.addTest(test_plan("test_pinned_upload"))
+    testSuite.addTest(test_plan("test_iter_keypoints"))
+    testSuite.addTest(test_plan("test_concurrent_calls"))
+    testSuite.addTest(test_plan("test_recorded_launches"))
+    testSuite.addTest(test_plan("test_binning"))
+    testSuite.addTest(test_plan("test_roi"))
+    testSuite.addTest(test_plan("test_mask"))
+    testSuite.addTest(test_plan("test_correction"))
+    testSuite.addTest(test_plan("test_percentiles"))
+    testSuite.addTest(test_plan("test_layouts"))
+    testSuite.addTest(test_plan("test_double_size"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_plan()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
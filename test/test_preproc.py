@@ -43,7 +43,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 import time, os, logging
 import numpy
 import pyopencl, pyopencl.array
-import scipy, scipy.misc
+import scipy, scipy.misc, scipy.ndimage
 import sys
 import unittest
 from utilstest import UtilsTest, getLogger, ctx
@@ -107,6 +107,23 @@ def binning(input_img, binsize):
         out = temp.sum(axis=3).sum(axis=1)
     return out
 
+def bin_mean(img, binsize):
+    """
+    Reference binning: mean of each bin with reshape, the last bins only averaging the pixels
+    within the image when the shape is not a multiple of the binning
+
+    @param img: 2D ndarray
+    @param binsize: 2-tuple (bin_h, bin_w)
+    @return: binned image as float32
+    """
+    bin_h, bin_w = binsize
+    height = (img.shape[0] + bin_h - 1) // bin_h
+    width = (img.shape[1] + bin_w - 1) // bin_w
+    padded = numpy.empty((height * bin_h, width * bin_w), dtype=numpy.float64)
+    padded.fill(numpy.nan)
+    padded[:img.shape[0], :img.shape[1]] = img
+    return numpy.nanmean(padded.reshape(height, bin_h, width, bin_w), axis=(1, 3)).astype(numpy.float32)
+
 class test_preproc(unittest.TestCase):
     def setUp(self):
         self.input = scipy.misc.lena()
@@ -216,6 +233,187 @@ class test_preproc(unittest.TestCase):
             logger.info("conversion int64->float took %.3fms and normalization took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start),
                                                                                              1e-6 * (k2.profile.end - k2.profile.start)))
 
+    def test_minmax(self):
+        """
+        tests the fused uint8 conversion and min/max reduction
+        """
+        lint = self.input.astype(numpy.uint8)
+        t0 = time.time()
+        au8 = pyopencl.array.to_device(queue, lint)
+        nb_groups = (self.shape[0] // self.wg[0]) * (self.shape[1] // self.wg[1])
+        wg = self.wg[0] * self.wg[1]
+        partial = pyopencl.array.empty(queue, (nb_groups, 2), dtype=numpy.float32)
+        min_data = pyopencl.array.empty(queue, 1, dtype=numpy.float32)
+        max_data = pyopencl.array.empty(queue, 1, dtype=numpy.float32)
+        k1 = self.program.u8_to_float_minmax(queue, self.shape, self.wg, au8.data, self.gpudata.data, partial.data,
+                                             pyopencl.LocalMemory(8 * wg), self.IMAGE_W, self.IMAGE_H)
+        k2 = self.program.reduce_minmax(queue, (wg,), (wg,), partial.data, numpy.int32(nb_groups),
+                                        min_data.data, max_data.data, pyopencl.LocalMemory(8 * wg))
+        res = self.gpudata.get()
+        t1 = time.time()
+        delta = abs(lint - res).max()
+        self.assert_(delta == 0, "delta=%s" % delta)
+        self.assert_(min_data.get()[0] == lint.min(), "min=%s" % min_data.get()[0])
+        self.assert_(max_data.get()[0] == lint.max(), "max=%s" % max_data.get()[0])
+        if PROFILE:
+            logger.info("Global execution time: GPU: %.3fms." % (1000.0 * (t1 - t0)))
+            logger.info("conversion uint8->float with min/max took %.3fms and reduction took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start),
+                                                                                                     1e-6 * (k2.profile.end - k2.profile.start)))
+
+    def convert_minmax(self, name, data, *args):
+        """
+        Run a *_minmax conversion kernel followed by reduce_minmax
+
+        @return: converted image, min and max
+        """
+        nb_groups = (self.shape[0] // self.wg[0]) * (self.shape[1] // self.wg[1])
+        wg = self.wg[0] * self.wg[1]
+        inp_gpu = pyopencl.array.to_device(queue, data)
+        partial = pyopencl.array.empty(queue, (nb_groups, 2), dtype=numpy.float32)
+        min_data = pyopencl.array.empty(queue, 1, dtype=numpy.float32)
+        max_data = pyopencl.array.empty(queue, 1, dtype=numpy.float32)
+        getattr(self.program, name)(queue, self.shape, self.wg, inp_gpu.data, self.gpudata.data, partial.data,
+                                    pyopencl.LocalMemory(8 * wg), *(args + (self.IMAGE_W, self.IMAGE_H)))
+        self.program.reduce_minmax(queue, (wg,), (wg,), partial.data, numpy.int32(nb_groups),
+                                   min_data.data, max_data.data, pyopencl.LocalMemory(8 * wg))
+        return self.gpudata.get(), min_data.get()[0], max_data.get()[0]
+
+    def test_converters_minmax(self):
+        """
+        tests the fused conversion and min/max reduction of the other pixel types, including negative values,
+        values beyond the float precision and color images
+        """
+        lena = self.input.astype(numpy.float64)
+        inputs = {"s8_to_float_minmax": (lena - 128).astype(numpy.int8),
+                  "s16_to_float_minmax": ((lena - 128) * 200).astype(numpy.int16),
+                  "u32_to_float_minmax": (lena * 16777259).astype(numpy.uint32),
+                  "double_to_float_minmax": (lena - 100) * 1e-3}
+        for name, lint in inputs.items():
+            if lint.dtype == numpy.float64 and "cl_khr_fp64" not in ctx.devices[0].extensions:
+                logger.warning("No double precision on %s: skipping %s" % (ctx.devices[0].name, name))
+                continue
+            res, mini, maxi = self.convert_minmax(name, lint)
+            ref = lint.astype(numpy.float32)
+            delta = abs(ref - res).max()
+            self.assert_(delta == 0, "%s: delta=%s" % (name, delta))
+            self.assert_(mini == ref.min(), "%s: min=%s expected %s" % (name, mini, ref.min()))
+            self.assert_(maxi == ref.max(), "%s: max=%s expected %s" % (name, maxi, ref.max()))
+        rgb = numpy.random.randint(0, 65536, size=self.input.shape + (3,)).astype(numpy.uint16)
+        ref = (0.299 * rgb[..., 0] + 0.587 * rgb[..., 1] + 0.114 * rgb[..., 2]).astype(numpy.float32)
+        size = numpy.int32(self.input.size)
+        for layout, data, pixel_stride, channel_stride in (("interleaved", rgb, numpy.int32(3), numpy.int32(1)),
+                                                           ("planar", numpy.ascontiguousarray(rgb.transpose(2, 0, 1)),
+                                                            numpy.int32(1), size)):
+            res, mini, maxi = self.convert_minmax("rgb16_to_float_minmax", data, pixel_stride, channel_stride)
+            delta = abs(ref - res).max()
+            self.assert_(delta < 0.05, "rgb16 %s: delta=%s" % (layout, delta))
+            self.assert_(mini == res.min(), "rgb16 %s: min=%s" % (layout, mini))
+            self.assert_(maxi == res.max(), "rgb16 %s: max=%s" % (layout, maxi))
+
+    def test_correction(self):
+        """
+        tests the fused uint16 conversion with dark/flat correction and min/max reduction,
+        followed by the 3x3 median hot pixel filter of sort.cl
+        """
+        lint = self.input.astype(numpy.uint16) + 100
+        dark = numpy.random.uniform(90, 110, lint.shape).astype(numpy.float32)
+        gain = numpy.random.uniform(0.8, 1.2, lint.shape).astype(numpy.float32)
+        lint.flat[numpy.random.randint(0, lint.size, 50)] = 1000
+        sort_path = os.path.join(os.path.dirname(os.path.abspath(sift.__file__)), "sort.cl")
+        sort_program = pyopencl.Program(ctx, open(sort_path).read()).build()
+        t0 = time.time()
+        au16 = pyopencl.array.to_device(queue, lint)
+        dark_gpu = pyopencl.array.to_device(queue, dark)
+        gain_gpu = pyopencl.array.to_device(queue, gain)
+        out_gpu = pyopencl.array.empty_like(self.gpudata)
+        nb_groups = (self.shape[0] // self.wg[0]) * (self.shape[1] // self.wg[1])
+        wg = self.wg[0] * self.wg[1]
+        partial = pyopencl.array.empty(queue, (nb_groups, 2), dtype=numpy.float32)
+        min_data = pyopencl.array.empty(queue, 1, dtype=numpy.float32)
+        max_data = pyopencl.array.empty(queue, 1, dtype=numpy.float32)
+        k1 = self.program.u16_to_float_correct_minmax(queue, self.shape, self.wg, au16.data, self.gpudata.data,
+                                                      dark_gpu.data, gain_gpu.data, partial.data,
+                                                      pyopencl.LocalMemory(8 * wg), self.IMAGE_W, self.IMAGE_H)
+        k2 = self.program.reduce_minmax(queue, (wg,), (wg,), partial.data, numpy.int32(nb_groups),
+                                        min_data.data, max_data.data, pyopencl.LocalMemory(8 * wg))
+        k3 = sort_program.median3x3_filter(queue, self.shape, self.wg, self.gpudata.data, out_gpu.data,
+                                           numpy.float32(50), self.IMAGE_W, self.IMAGE_H)
+        corrected = self.gpudata.get()
+        res = out_gpu.get()
+        t1 = time.time()
+        ref = (lint - dark) * gain
+        delta = abs(ref - corrected).max()
+        self.assert_(delta < 1e-3, "delta=%s" % delta)
+        self.assert_(min_data.get()[0] == corrected.min(), "min=%s" % min_data.get()[0])
+        self.assert_(max_data.get()[0] == corrected.max(), "max=%s" % max_data.get()[0])
+        median = scipy.ndimage.median_filter(ref, 3, mode="nearest")
+        ref = numpy.where(abs(ref - median) > 50, median, ref)
+        delta = abs(ref - res).max()
+        self.assert_(delta < 1e-3, "delta=%s" % delta)
+        if PROFILE:
+            logger.info("Global execution time: GPU: %.3fms." % (1000.0 * (t1 - t0)))
+            logger.info("corrected conversion uint16->float with min/max took %.3fms, reduction %.3fms and median filter %.3fms" % (
+                        1e-6 * (k1.profile.end - k1.profile.start), 1e-6 * (k2.profile.end - k2.profile.start),
+                        1e-6 * (k3.profile.end - k3.profile.start)))
+
+    def test_histogram(self):
+        """
+        tests the histogram between min and max and the percentile lookup
+        """
+        data = self.input.astype(numpy.float32)
+        data.flat[numpy.random.randint(0, data.size, 20)] = 10 * data.max()
+        nbins = 4096
+        inp_gpu = pyopencl.array.to_device(queue, data)
+        hist_gpu = pyopencl.array.zeros(queue, nbins, dtype=numpy.uint32)
+        min_data = pyopencl.array.to_device(queue, numpy.array([data.min()], dtype=numpy.float32))
+        max_data = pyopencl.array.to_device(queue, numpy.array([data.max()], dtype=numpy.float32))
+        t0 = time.time()
+        k1 = self.program.histogram(queue, self.shape, self.wg, inp_gpu.data, None, min_data.data, max_data.data,
+                                    hist_gpu.data, pyopencl.LocalMemory(4 * nbins), numpy.int32(nbins),
+                                    self.IMAGE_W, self.IMAGE_H)
+        res = hist_gpu.get()
+        k2 = self.program.percentile_range(queue, (1,), (1,), hist_gpu.data, numpy.int32(nbins),
+                                           min_data.data, max_data.data, numpy.float32(0.01), numpy.float32(0.99))
+        low, high = min_data.get()[0], max_data.get()[0]
+        t1 = time.time()
+        ref = numpy.histogram(data, nbins, (data.min(), data.max()))[0]
+        width = (data.max() - data.min()) / nbins
+        ref_low, ref_high = numpy.percentile(data, [1, 99])
+        self.assert_(res.sum() == data.size, "all pixels are counted: %s" % res.sum())
+        self.assert_(abs(res.astype(int) - ref).sum() <= 0.001 * data.size, "histogram differs from numpy")
+        self.assert_(abs(low - ref_low) <= 2 * width, "low=%s ref=%s" % (low, ref_low))
+        self.assert_(abs(high - ref_high) <= 2 * width, "high=%s ref=%s" % (high, ref_high))
+        self.assert_(hist_gpu.get().max() == 0, "histogram is reset")
+        if PROFILE:
+            logger.info("Global execution time: GPU: %.3fms." % (1000.0 * (t1 - t0)))
+            logger.info("histogram took %.3fms and percentiles %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start),
+                                                                        1e-6 * (k2.profile.end - k2.profile.start)))
+
+    def test_packed12(self):
+        """
+        tests the unpacking of 12-bit pixels (Mono12p)
+        """
+        lint = (self.input.astype(numpy.uint16) * 16 + 3).ravel()
+        packed = numpy.empty(lint.size * 3 // 2, dtype=numpy.uint8)
+        packed[0::3] = lint[0::2] & 0xFF
+        packed[1::3] = (lint[0::2] >> 8) | ((lint[1::2] & 0xF) << 4)
+        packed[2::3] = lint[1::2] >> 4
+        t0 = time.time()
+        au8 = pyopencl.array.to_device(queue, packed)
+        nb_groups = (self.shape[0] // self.wg[0]) * (self.shape[1] // self.wg[1])
+        partial = pyopencl.array.empty(queue, (nb_groups, 2), dtype=numpy.float32)
+        k1 = self.program.packed12_to_float_minmax(queue, self.shape, self.wg, au8.data, self.gpudata.data, partial.data,
+                                                   pyopencl.LocalMemory(8 * self.wg[0] * self.wg[1]), self.IMAGE_W, self.IMAGE_H)
+        res = self.gpudata.get()
+        t1 = time.time()
+        delta = abs(lint.reshape(self.input.shape) - res).max()
+        self.assert_(delta == 0, "delta=%s" % delta)
+        self.assert_(partial.get()[:, 0].min() == lint.min(), "min")
+        self.assert_(partial.get()[:, 1].max() == lint.max(), "max")
+        if PROFILE:
+            logger.info("Global execution time: GPU: %.3fms." % (1000.0 * (t1 - t0)))
+            logger.info("unpacking 12-bit->float took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
+
     def test_shrink(self):
         """
         Test shrinking kernel
@@ -293,14 +491,109 @@ class test_preproc(unittest.TestCase):
             raw_input("enter")
         self.assert_(delta < 1e-6, "delta=%s" % delta)
 
+    def test_bin_uneven(self):
+        """
+        tests the binning kernel against numpy on non square images, with sizes which are not multiples of the binning
+        """
+        numpy.random.seed(0)
+        for shape in ((512, 512), (509, 371), (100, 333)):
+            lint = numpy.random.randint(0, 4096, size=shape).astype(numpy.float32)  # exact sums in float32
+            inp_gpu = pyopencl.array.to_device(queue, lint)
+            for binsize in ((2, 2), (3, 2), (4, 3), (1, 5), (7, 7)):
+                ref = bin_mean(lint, binsize)
+                out_gpu = pyopencl.array.empty(queue, ref.shape, dtype=numpy.float32)
+                wg = (1, 32)
+                self.program.bin(queue, calc_size(ref.shape, wg), wg, inp_gpu.data, out_gpu.data,
+                                 numpy.int32(binsize[1]), numpy.int32(binsize[0]),
+                                 numpy.int32(shape[1]), numpy.int32(shape[0]),
+                                 numpy.int32(ref.shape[1]), numpy.int32(ref.shape[0]))
+                res = out_gpu.get()
+                if shape[0] % binsize[0] == 0 and shape[1] % binsize[1] == 0:
+                    mean = lint.reshape(shape[0] // binsize[0], binsize[0], shape[1] // binsize[1], binsize[1])
+                    self.assert_(abs(ref - mean.mean(axis=3).mean(axis=1)).max() < 1e-2, "reference with reshape")
+                delta = abs(ref - res).max()
+                self.assert_(delta < 1e-2, "shape %s, binning %s: delta=%s" % (shape, binsize, delta))
+                # the partial bins of the last row and column
+                self.assert_(abs(ref[-1] - res[-1]).max() < 1e-2, "shape %s, binning %s: last row" % (shape, binsize))
+                self.assert_(abs(ref[:, -1] - res[:, -1]).max() < 1e-2, "shape %s, binning %s: last column" % (shape, binsize))
+
+    def test_upsample(self):
+        """
+        Test the x2 bilinear upsampling kernel (DoubleImSize)
+        """
+        lint = numpy.ascontiguousarray(self.input, numpy.float32)
+        out_shape = (2 * lint.shape[0], 2 * lint.shape[1])
+        t0 = time.time()
+        inp_gpu = pyopencl.array.to_device(queue, lint)
+        out_gpu = pyopencl.array.empty(queue, out_shape, dtype=numpy.float32, order="C")
+        k1 = self.program.upsample2(queue, calc_size(out_shape, self.wg), self.wg, inp_gpu.data, out_gpu.data,
+                                    self.IMAGE_W, self.IMAGE_H, numpy.int32(out_shape[1]), numpy.int32(out_shape[0]))
+        res = out_gpu.get()
+        t1 = time.time()
+        pad = numpy.pad(lint, ((0, 1), (0, 1)), mode="edge")
+        ref = numpy.empty(out_shape, dtype=numpy.float32)
+        ref[0::2, 0::2] = lint
+        ref[0::2, 1::2] = 0.5 * (pad[:-1, :-1] + pad[:-1, 1:])
+        ref[1::2, 0::2] = 0.5 * (pad[:-1, :-1] + pad[1:, :-1])
+        ref[1::2, 1::2] = 0.25 * (pad[:-1, :-1] + pad[:-1, 1:] + pad[1:, :-1] + pad[1:, 1:])
+        t2 = time.time()
+        delta = abs(ref - res).max()
+        if PROFILE:
+            logger.info("Global execution time: CPU %.3fms, GPU: %.3fms." % (1000.0 * (t2 - t1), 1000.0 * (t1 - t0)))
+            logger.info("Upsampling took %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start)))
+        self.assert_(delta < 1e-4, "delta=%s" % delta)
+
+    def test_transform(self):
+        """
+        Test the bilinear transformation kernel and the accumulation of frames
+        """
+        lint = numpy.ascontiguousarray(self.input, numpy.float32)
+        matrix = numpy.array([[0.9, 0.1, 5.0], [-0.05, 1.02, 3.0], [0.0, 0.0, 1.0]], dtype=numpy.float32)
+        t0 = time.time()
+        inp_gpu = pyopencl.array.to_device(queue, lint)
+        out_gpu = pyopencl.array.zeros(queue, lint.shape, dtype=numpy.float32, order="C")
+        cnt_gpu = pyopencl.array.zeros(queue, lint.shape, dtype=numpy.float32, order="C")
+        mat_gpu = pyopencl.array.to_device(queue, matrix.ravel())
+        k1 = self.program.transform_bilinear(queue, self.shape, self.wg, inp_gpu.data, out_gpu.data, cnt_gpu.data, mat_gpu.data,
+                                             numpy.int32(1), numpy.float32(0), self.IMAGE_W, self.IMAGE_H, self.IMAGE_W, self.IMAGE_H)
+        k2 = self.program.transform_bilinear(queue, self.shape, self.wg, inp_gpu.data, out_gpu.data, cnt_gpu.data, mat_gpu.data,
+                                             numpy.int32(1), numpy.float32(0), self.IMAGE_W, self.IMAGE_H, self.IMAGE_W, self.IMAGE_H)
+        k3 = self.program.average(queue, self.shape, self.wg, out_gpu.data, cnt_gpu.data, out_gpu.data, numpy.float32(0),
+                                  self.IMAGE_W, self.IMAGE_H)
+        res = out_gpu.get()
+        cnt = cnt_gpu.get()
+        t1 = time.time()
+        y, x = numpy.mgrid[0:lint.shape[0], 0:lint.shape[1]]
+        xs = matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2]
+        ys = matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2]
+        valid = (xs >= 0) & (xs <= lint.shape[1] - 1) & (ys >= 0) & (ys <= lint.shape[0] - 1)
+        ref = scipy.ndimage.map_coordinates(lint, [ys, xs], order=1)
+        t2 = time.time()
+        delta = abs(ref - res)[valid].max()
+        if PROFILE:
+            logger.info("Global execution time: CPU %.3fms, GPU: %.3fms." % (1000.0 * (t2 - t1), 1000.0 * (t1 - t0)))
+            logger.info("Transformation took %.3fms and average %.3fms" % (1e-6 * (k1.profile.end - k1.profile.start),
+                                                                          1e-6 * (k3.profile.end - k3.profile.start)))
+        self.assert_(abs(cnt[valid] - 2).max() == 0, "all valid pixels have 2 contributions")
+        self.assert_(cnt[~valid].max() == 0, "invalid pixels have no contribution")
+        self.assert_(delta < 1e-3, "delta=%s" % delta)
+
 def test_suite_preproc():
     testSuite = unittest.TestSuite()
     testSuite.addTest(test_preproc("test_uint8"))
     testSuite.addTest(test_preproc("test_uint16"))
     testSuite.addTest(test_preproc("test_int32"))
     testSuite.addTest(test_preproc("test_int64"))
+    testSuite.addTest(test_preproc("test_minmax"))
+    testSuite.addTest(test_preproc("test_converters_minmax"))
+    testSuite.addTest(test_preproc("test_correction"))
+    testSuite.addTest(test_preproc("test_histogram"))
+    testSuite.addTest(test_preproc("test_packed12"))
     testSuite.addTest(test_preproc("test_shrink"))
     testSuite.addTest(test_preproc("test_bin"))
+    testSuite.addTest(test_preproc("test_bin_uneven"))
+    testSuite.addTest(test_preproc("test_upsample"))
+    testSuite.addTest(test_preproc("test_transform"))
     return testSuite
 
 if __name__ == '__main__':
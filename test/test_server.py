@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the keypoint server (SiftServer) and its client (SiftClient)
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import sys, subprocess, tempfile, shutil, threading, socket, json, types
+import unittest
+from utilstest import UtilsTest, getLogger, ctx
+import sift
+from sift.server import SiftServer
+from sift.client import SiftClient, SHM_DIR, HEADER, recv_exactly
+from sift.utils import dtype_kp
+logger = getLogger(__file__)
+
+
+class StubPool(object):
+    """
+    Stands for a SiftPool: one keypoint per row of the image, x being the first pixel of the row
+    """
+    def keypoints(self, image):
+        if image.max() == image.min():
+            raise RuntimeError("flat image")
+        kp = numpy.recarray(shape=(image.shape[0],), dtype=dtype_kp)
+        kp.x = image[:, 0]
+        kp.y = numpy.arange(image.shape[0])
+        kp.scale = image.shape[1]
+        kp.angle = 0
+        kp.desc = 0
+        return kp
+
+
+class StubServer(SiftServer):
+    def get_pool(self, shape, dtype):
+        return StubPool()
+
+
+class test_server(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "sift.sock")
+        self.server = StubServer(self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def request(self, request):
+        """
+        send a raw request
+        @return: status, payload
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("ascii"))
+            status, size = HEADER.unpack(recv_exactly(sock, HEADER.size))
+            return status, recv_exactly(sock, size if status else size * dtype_kp.itemsize)
+        finally:
+            sock.close()
+
+    def test_round_trip(self):
+        """
+        tests that images sent through shared memory come back as keypoints, the file being grown on demand
+        """
+        client = SiftClient(self.path)
+        try:
+            for shape, dtype in (((20, 30), numpy.uint8), ((50, 40), numpy.uint16), ((10, 10), numpy.float32)):
+                image = (numpy.random.random(shape) * 200).astype(dtype)
+                kp = client.keypoints(image)
+                self.assertEqual(kp.dtype, dtype_kp)
+                self.assertEqual(kp.shape, (shape[0],))
+                self.assert_(abs(kp.x - image[:, 0]).max() == 0, "first column of %s" % (shape,))
+                self.assert_((kp.scale == shape[1]).all(), "width of %s" % (shape,))
+            self.assert_(client.shm_size >= 50 * 40 * 2, "shared memory grown")
+            shm_name = client.shm_name
+        finally:
+            client.close()
+        self.assert_(not os.path.exists(shm_name), "shared memory released")
+
+    def test_errors(self):
+        """
+        tests that errors are reported with a negative status, the connection being kept
+        """
+        client = SiftClient(self.path)
+        try:
+            self.assertRaises(RuntimeError, client.keypoints, numpy.zeros((10, 10), numpy.uint8))
+            kp = client.keypoints(numpy.arange(100, dtype=numpy.uint8).reshape(10, 10))
+            self.assertEqual(kp.shape, (10,))
+            request = {"shm": client.shm_name, "shape": [10, 10], "dtype": "|u1"}
+            self.assertEqual(self.request(request)[0], 0)
+            # only the sift_* files of SHM_DIR are read, within their size
+            fd, other = tempfile.mkstemp(prefix="other_", dir=SHM_DIR)
+            os.write(fd, b"\x01" * 100)
+            os.close(fd)
+            outside = os.path.join(self.tmpdir, "sift_outside")
+            shutil.copy(other, outside)
+            link = tempfile.mktemp(prefix="sift_", dir=SHM_DIR)
+            os.symlink(outside, link)
+            try:
+                for bad in ({"shm": other},
+                            {"shm": outside},
+                            {"shm": link},
+                            {"shape": [20, 10]},
+                            {"offset": 1},
+                            {"offset": -1},
+                            {"shape": [10, -10]},
+                            {"dtype": "|O"}):
+                    status, message = self.request(dict(request, **bad))
+                    self.assertEqual(status, -1, "%s rejected: %s" % (bad, message))
+            finally:
+                os.unlink(other)
+                os.unlink(link)
+        finally:
+            client.close()
+
+    def test_client_without_opencl(self):
+        """
+        tests that the client is imported without pyopencl, and without initialising OpenCL
+        """
+        script = "; ".join(["import sys",
+                            "sys.modules['pyopencl'] = None",
+                            "sys.path.insert(0, %r)" % UtilsTest.sift_home,
+                            "import sift",
+                            "from sift.client import SiftClient",
+                            "assert sift.SiftClient is SiftClient",
+                            "assert sift.SiftServer and sift.KeypointFile and sift.KeypointCache and sift.StackReader",
+                            "assert 'sift.opencl' not in sys.modules and not hasattr(sift, 'SiftPlan')"])
+        self.assertEqual(subprocess.call([sys.executable, "-c", script]), 0)
+
+    def test_pools(self):
+        """
+        tests that the plans of the least recently used geometry are released
+        """
+        if ctx is None:
+            self.skipTest("no OpenCL device")
+        server = SiftServer(os.path.join(self.tmpdir, "pools.sock"), pool_size=1, max_pools=2, ctx=ctx)
+        try:
+            first = server.get_pool((64, 64), numpy.uint8)
+            server.get_pool((64, 80), numpy.uint8)
+            self.assert_(server.get_pool((64, 64), numpy.uint8) is first, "pool re-used")
+            server.get_pool((80, 64), numpy.uint8)
+            self.assertEqual(list(server.pools.keys()), [((64, 64), "|u1"), ((80, 64), "|u1")])
+        finally:
+            server.server_close()
+
+    def test_pool_lock(self):
+        """
+        tests that building the plans of a new geometry does not delay the requests for the existing pools,
+        and that concurrent requests for the new geometry wait for a single build
+        """
+        gate = threading.Event()
+        built = []
+
+        class SiftPool(object):
+            def __init__(self, shape, dtype, size, **kwargs):
+                built.append(shape)
+                if shape == (80, 80):
+                    gate.wait(10)
+
+        module = types.ModuleType("sift.pool")
+        module.SiftPool = SiftPool
+        saved = sys.modules.get("sift.pool")
+        sys.modules["sift.pool"] = module
+        server = SiftServer(os.path.join(self.tmpdir, "lock.sock"), pool_size=1)
+        try:
+            first = server.get_pool((64, 64), numpy.uint8)
+            pools = []
+            threads = [threading.Thread(target=lambda: pools.append(server.get_pool((80, 80), numpy.uint8)))
+                       for i in range(2)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            self.assert_(server.get_pool((64, 64), numpy.uint8) is first, "existing pool served during the build")
+            self.assertEqual(pools, [], "build still in progress")
+            gate.set()
+            for thread in threads:
+                thread.join(10)
+            self.assertEqual(built, [(64, 64), (80, 80)], "a single build per geometry")
+            self.assertEqual(len(pools), 2)
+            self.assert_(pools[0] is pools[1], "same pool")
+            self.assertEqual(list(server.pools.keys()), [((64, 64), "|u1"), ((80, 80), "|u1")])
+        finally:
+            gate.set()
+            server.server_close()
+            if saved is None:
+                sys.modules.pop("sift.pool", None)
+            else:
+                sys.modules["sift.pool"] = saved
+
+    def test_pool_cache(self):
+        """
+        tests that all the workspaces of a pool share its cache
+        """
+        if ctx is None:
+            self.skipTest("no OpenCL device")
+        from sift.pool import SiftPool
+        from sift.cache import KeypointCache
+        cache = KeypointCache(os.path.join(self.tmpdir, "cache"))
+        pool = SiftPool(shape=(64, 64), dtype=numpy.uint8, size=2, ctx=ctx, cache=cache)
+        workspace = pool._acquire()
+        other = pool._acquire()
+        self.assert_(other is not workspace, "second workspace allocated")
+        self.assert_(all(w.cache is cache for w in pool.workspaces), "cache shared by the workspaces")
+
+    def test_pool_device(self):
+        """
+        tests that the device results of a pool, copied before the workspace is released, do not share the
+        page-locked staging of the workspace and are not changed by the next extractions
+        """
+        if ctx is None:
+            self.skipTest("no OpenCL device")
+        from sift.pool import SiftPool
+        numpy.random.seed(0)
+        images = [(numpy.random.random((64, 64)) * 255).astype(numpy.uint8) for i in range(2)]
+        pool = SiftPool(shape=(64, 64), dtype=numpy.uint8, size=1, ctx=ctx)
+        ref = pool.keypoints(images[0])
+        dkp = pool.keypoints(images[0], device=True)
+        self.assert_(dkp.host_keypoints is None and dkp.host_descriptors is None, "staging of the workspace not shared")
+        pool.keypoints(images[1])
+        kp = dkp.get()
+        self.assertEqual(kp.shape, ref.shape)
+        order, ref_order = numpy.lexsort((kp.scale, kp.y, kp.x)), numpy.lexsort((ref.scale, ref.y, ref.x))
+        self.assert_((kp[order].x == ref[ref_order].x).all() and (kp[order].y == ref[ref_order].y).all(), "same positions")
+        self.assert_((kp[order].desc == ref[ref_order].desc).all(), "same descriptors")
+
+
+def test_suite_server():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_server("test_round_trip"))
+    testSuite.addTest(test_server("test_errors"))
+    testSuite.addTest(test_server("test_client_without_opencl"))
+    testSuite.addTest(test_server("test_pools"))
+    testSuite.addTest(test_server("test_pool_lock"))
+    testSuite.addTest(test_server("test_pool_cache"))
+    testSuite.addTest(test_server("test_pool_device"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_server()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
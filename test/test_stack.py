@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the stack reader and the prefetching of frames
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import sys, tempfile, shutil
+import unittest
+from utilstest import UtilsTest, getLogger
+import sift
+from sift.stack import StackReader, prefetch
+logger = getLogger(__file__)
+
+
+class StubPlan(object):
+    """
+    Stands for a SiftPlan: only provides the input buffers
+    """
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+        self.buffers = {}
+
+    def input_buffer(self, slot=0):
+        if slot not in self.buffers:
+            self.buffers[slot] = numpy.empty(self.shape, dtype=self.dtype)
+        return self.buffers[slot]
+
+
+class test_stack(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stack = numpy.random.randint(0, 65000, size=(7, 20, 30)).astype(numpy.uint16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        self.stack = None
+
+    def test_raw(self):
+        """
+        tests the reading of a raw file with a header, the number of frames being deduced from its size
+        """
+        filename = os.path.join(self.tmpdir, "stack.raw")
+        with open(filename, "wb") as f:
+            f.write(b"H" * 100)
+            f.write(self.stack.tostring())
+        self.assertRaises(RuntimeError, StackReader, filename)
+        for nframes in (7, None, -1):
+            stack = StackReader(filename, shape=(nframes, 20, 30), dtype="uint16", offset=100)
+            self.assertEqual(len(stack), 7)
+            self.assertEqual(stack.shape, (20, 30))
+            self.assertEqual(stack.dtype, numpy.uint16)
+            self.assert_(abs(stack[3] - self.stack[3]).max() == 0, "frame 3 with %s frames" % nframes)
+            self.assert_(abs(numpy.array(list(stack)) - self.stack).max() == 0, "all frames")
+        # Fortran ordered raw file
+        with open(filename, "wb") as f:
+            f.write(numpy.asfortranarray(self.stack).tostring(order="F"))
+        stack = StackReader(filename, shape=(7, 20, 30), dtype="uint16", order="F")
+        self.assert_(abs(stack[5] - self.stack[5]).max() == 0, "Fortran order")
+
+    def test_npy(self):
+        """
+        tests the reading of a .npy file (memory mapped) and of arrays
+        """
+        filename = os.path.join(self.tmpdir, "stack.npy")
+        numpy.save(filename, self.stack)
+        stack = StackReader(filename)
+        self.assert_(isinstance(stack.data, numpy.memmap), "memory mapped")
+        self.assertEqual(len(stack), 7)
+        self.assert_(abs(stack[6] - self.stack[6]).max() == 0, "last frame")
+        stack = StackReader(self.stack)
+        self.assert_(abs(stack[2] - self.stack[2]).max() == 0, "array")
+        self.assertRaises(RuntimeError, StackReader, self.stack[0])
+
+    def test_prefetch(self):
+        """
+        tests the ring of prefetched frames: order, recycled slots, ranges and early exit
+        """
+        stack = StackReader(self.stack)
+        slots = set()
+        indexes = []
+        for index, frame in stack.prefetch(depth=2):
+            self.assert_(abs(frame - self.stack[index]).max() == 0, "frame %s" % index)
+            slots.add(id(frame))
+            indexes.append(index)
+        self.assertEqual(indexes, range(7))
+        self.assert_(len(slots) <= 3, "%s slots for a depth of 2" % len(slots))
+        self.assertEqual([i for i, frame in stack.prefetch(depth=1, start=1, stop=6, step=2)], [1, 3, 5])
+        plan = StubPlan(stack.shape, stack.dtype)
+        for index, frame in stack.prefetch(plan, depth=3):
+            self.assert_(any(frame is buf for buf in plan.buffers.values()), "frame in the input buffers of the plan")
+            if index == 2:
+                break  # the reading thread is stopped
+        self.assertEqual(len(plan.buffers), 4)
+
+    def test_prefetch_error(self):
+        """
+        tests that an error while reading a frame is raised in the consumer, after the frames already read
+        """
+        def frames():
+            yield 0, self.stack[0]
+            yield 1, self.stack[1]
+            raise IOError("corrupted frame")
+        slots = [numpy.empty(self.stack.shape[1:], self.stack.dtype) for i in range(2)]
+        read = []
+        try:
+            for index, frame in prefetch(frames(), slots):
+                read.append(index)
+        except IOError as error:
+            self.assertEqual(str(error), "corrupted frame")
+        else:
+            self.fail("IOError not raised")
+        self.assertEqual(read, [0, 1])
+
+
+def test_suite_stack():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_stack("test_raw"))
+    testSuite.addTest(test_stack("test_npy"))
+    testSuite.addTest(test_stack("test_prefetch"))
+    testSuite.addTest(test_stack("test_prefetch_error"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_stack()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the warping of images on the device (WarpPlan)
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-17"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import numpy
+import pyopencl, pyopencl.array
+import scipy, scipy.ndimage
+import sys
+import unittest
+from utilstest import UtilsTest, getLogger, ctx
+import sift
+from sift.warp import WarpPlan, as_matrix
+logger = getLogger(__file__)
+
+
+def project(matrix, shape):
+    """
+    Input coordinates (xs, ys) of all pixels of the output image and the mask of those inside the input
+    """
+    y, x = numpy.mgrid[0:shape[0], 0:shape[1]].astype(numpy.float64)
+    w = matrix[2, 0] * x + matrix[2, 1] * y + matrix[2, 2]
+    xs = (matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2]) / w
+    ys = (matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2]) / w
+    valid = (xs >= 0) & (xs <= shape[1] - 1) & (ys >= 0) & (ys <= shape[0] - 1)
+    return xs, ys, valid
+
+
+def cubic(x):
+    """
+    Keys' cubic convolution kernel (a=-0.5), as in transform_bicubic
+    """
+    ax = abs(x)
+    return numpy.where(ax <= 1, (1.5 * ax - 2.5) * ax * ax + 1,
+                       numpy.where(ax < 2, ((-0.5 * ax + 2.5) * ax - 4) * ax + 2, 0))
+
+
+def my_bicubic(img, xs, ys):
+    """
+    Reference bicubic interpolation with clamped borders
+    """
+    c0 = numpy.floor(xs).astype(int)
+    r0 = numpy.floor(ys).astype(int)
+    out = numpy.zeros(xs.shape)
+    for r in range(-1, 3):
+        rr = numpy.clip(r0 + r, 0, img.shape[0] - 1)
+        for c in range(-1, 3):
+            cc = numpy.clip(c0 + c, 0, img.shape[1] - 1)
+            out += cubic(ys - r0 - r) * cubic(xs - c0 - c) * img[rr, cc]
+    return out
+
+
+class test_warp(unittest.TestCase):
+    def setUp(self):
+        self.shape = (120, 150)
+        self.input = scipy.ndimage.gaussian_filter(numpy.random.random(self.shape), 2).astype(numpy.float32) * 1000
+        # homography in (x:col, y:row) order, mapping the output onto the input
+        self.matrix = numpy.array([[0.95, 0.05, 4.0], [-0.03, 1.02, 2.5], [1e-4, -2e-4, 1.0]])
+
+    def tearDown(self):
+        self.input = None
+
+    def test_bilinear(self):
+        """
+        tests the projective warping with bilinear interpolation against scipy
+        """
+        warp = WarpPlan(self.shape, ctx=ctx, fill=-1)
+        t0 = time.time()
+        res = warp.warp(self.input, self.matrix).get()
+        t1 = time.time()
+        xs, ys, valid = project(self.matrix, self.shape)
+        ref = scipy.ndimage.map_coordinates(self.input.astype(numpy.float64), [ys, xs], order=1)
+        delta = abs(ref - res)[valid].max()
+        logger.info("Bilinear warping took %.3fms" % (1000.0 * (t1 - t0)))
+        self.assert_(delta < 1e-2, "delta=%s" % delta)
+        self.assert_((res[~valid] == -1).all(), "pixels outside the input are filled")
+
+    def test_bicubic(self):
+        """
+        tests the projective warping with bicubic interpolation against a numpy implementation
+        """
+        warp = WarpPlan(self.shape, ctx=ctx, interpolation="bicubic")
+        res = warp.warp(self.input, self.matrix).get()
+        xs, ys, valid = project(self.matrix, self.shape)
+        ref = my_bicubic(self.input.astype(numpy.float64), xs, ys)
+        delta = abs(ref - res)[valid].max()
+        self.assert_(delta < 1e-2, "delta=%s" % delta)
+        self.assert_((res[~valid] == 0).all(), "pixels outside the input are filled")
+
+    def test_accumulate(self):
+        """
+        tests the accumulation of shifted frames: each pixel is averaged over the frames which contributed to it
+        """
+        warp = WarpPlan(self.shape, ctx=ctx)
+        shifts = [(0, 0), (5, -3), (-7, 2)]
+        ref_sum = numpy.zeros(self.shape)
+        ref_count = numpy.zeros(self.shape)
+        for dx, dy in shifts:
+            matrix = as_matrix(numpy.identity(2), (dx, dy))
+            warp.accumulate(self.input, matrix)
+            xs, ys, valid = project(matrix, self.shape)
+            ref_sum[valid] += self.input[ys[valid].astype(int), xs[valid].astype(int)]
+            ref_count += valid
+        self.assertEqual(warp.nb_frames, len(shifts))
+        res = warp.average()
+        ref = ref_sum / numpy.maximum(ref_count, 1)
+        self.assert_(abs(warp.sum() - ref_sum).max() < 1e-2, "running sum")
+        self.assert_(abs(res - ref)[ref_count > 0].max() < 1e-3, "average")
+        warp.reset()
+        self.assertEqual(warp.nb_frames, 0)
+        self.assert_(abs(warp.sum()).max() == 0, "reset")
+
+    def test_shape(self):
+        """
+        tests the transformation matrices and the rejection of images of the wrong shape
+        """
+        self.assert_(abs(as_matrix([[1, 2], [3, 4]], (5, 6)) - numpy.array([[1, 2, 5], [3, 4, 6], [0, 0, 1]])).max() == 0, "2x2 + offset")
+        self.assert_(abs(as_matrix([[1, 2, 5], [3, 4, 6]]) - numpy.array([[1, 2, 5], [3, 4, 6], [0, 0, 1]])).max() == 0, "2x3")
+        self.assertRaises(RuntimeError, as_matrix, numpy.ones((3, 2)))
+        warp = WarpPlan(self.shape, ctx=ctx)
+        matrix = numpy.identity(3)
+        self.assertRaises(RuntimeError, warp.warp, numpy.zeros(self.shape + (3,), numpy.float32), matrix)
+        self.assertRaises(RuntimeError, warp.warp, numpy.zeros((2,) + self.shape, numpy.float32), matrix)
+        self.assertRaises(RuntimeError, warp.warp, numpy.zeros(self.shape[::-1], numpy.float32), matrix)
+        gpu_img = pyopencl.array.to_device(warp.queue, self.input.astype(numpy.float64))
+        self.assertRaises(RuntimeError, warp.warp, gpu_img, matrix)
+        res = warp.warp(pyopencl.array.to_device(warp.queue, self.input), matrix).get()
+        self.assert_(abs(res - self.input).max() < 1e-3, "identity on a device image")
+
+
+def test_suite_warp():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_warp("test_bilinear"))
+    testSuite.addTest(test_warp("test_bicubic"))
+    testSuite.addTest(test_warp("test_accumulate"))
+    testSuite.addTest(test_warp("test_shape"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_warp()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#    Project: Sift implementation in Python + OpenCL
+#             https://github.com/kif/sift_pyocl
+#
+
+"""
+Test suite for the worker thread and the futures of the asynchronous calls
+"""
+
+from __future__ import division
+
+__authors__ = ["Jérôme Kieffer"]
+__contact__ = "jerome.kieffer@esrf.eu"
+__license__ = "BSD"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "2013-06-24"
+__license__ = """
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import time, os, logging
+import threading
+import numpy
+import sys
+import unittest
+from utilstest import UtilsTest, getLogger
+import sift
+from sift.worker import Worker, SimpleFuture
+logger = getLogger(__file__)
+
+
+class test_worker(unittest.TestCase):
+    def setUp(self):
+        self.worker = Worker("test")
+
+    def tearDown(self):
+        self.worker.stop()
+        self.worker = None
+
+    def test_order(self):
+        """
+        tests that the requests are processed in order, in a single thread which is not the caller's one
+        """
+        done = []
+        threads = set()
+        def process(value, offset=0):
+            time.sleep(0.01 * (value % 3))
+            done.append(value)
+            threads.add(threading.current_thread().name)
+            return value + offset
+        futures = [self.worker.submit(process, i, offset=10) for i in range(10)]
+        self.assertEqual([f.result(5) for f in futures], range(10, 20))
+        self.assertEqual(done, range(10))
+        self.assertEqual(threads, set(["test"]))
+        self.assert_(all(f.done() for f in futures), "all done")
+
+    def test_exception(self):
+        """
+        tests that errors are raised by result(), without stopping the worker
+        """
+        def fail(message):
+            raise RuntimeError(message)
+        future = self.worker.submit(fail, "no device")
+        self.assertRaises(RuntimeError, future.result, 5)
+        self.assertEqual(str(future.exception(5)), "no device")
+        self.assertEqual(self.worker.submit(abs, -3).result(5), 3)
+
+    def test_stop(self):
+        """
+        tests that stop waits for the queued requests, and that the worker restarts on the next submission
+        """
+        gate = threading.Event()
+        blocked = self.worker.submit(gate.wait, 5)
+        queued = self.worker.submit(lambda: "queued")
+        threading.Timer(0.1, gate.set).start()
+        self.worker.stop()
+        self.assert_(blocked.done() and queued.done(), "queued requests processed before stopping")
+        self.assertEqual(queued.result(), "queued")
+        self.assertEqual(self.worker.thread, None)
+        self.assertEqual(self.worker.submit(len, "abc").result(5), 3)
+        self.assert_(self.worker.thread.is_alive(), "restarted")
+
+    def test_future(self):
+        """
+        tests the replacement of concurrent.futures.Future: callbacks and timeouts
+        """
+        future = SimpleFuture()
+        called = []
+        future.add_done_callback(lambda f: called.append(f.result()))
+        self.assertFalse(future.done())
+        self.assertRaises(RuntimeError, future.result, 0.01)
+        future.set_result(42)
+        self.assertEqual(called, [42])
+        future.add_done_callback(lambda f: called.append(-f.result()))
+        self.assertEqual(called, [42, -42])
+        future = SimpleFuture()
+        future.set_exception(IOError("lost"))
+        self.assertRaises(IOError, future.result)
+        self.assert_(isinstance(future.exception(), IOError))
+
+
+def test_suite_worker():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(test_worker("test_order"))
+    testSuite.addTest(test_worker("test_exception"))
+    testSuite.addTest(test_worker("test_stop"))
+    testSuite.addTest(test_worker("test_future"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_worker()
+    runner = unittest.TextTestRunner()
+    if not runner.run(mysuite).wasSuccessful():
+        sys.exit(1)